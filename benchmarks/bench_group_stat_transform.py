@@ -0,0 +1,216 @@
+"""Micro-benchmark of ``GroupStatStream.transform_to_flat_structure``.
+
+Compares the table-driven flattening with the previous implementation
+(eight copy-pasted loops with ``copy()`` + ``update()`` per row) on a
+synthetic 365-day, 500-city ``stats.get`` payload::
+
+    python -m benchmarks.bench_group_stat_transform
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import sys
+import timeit
+import typing as t
+
+from tap_vk.streams import GroupStatStream
+
+AGE_GROUPS = ("12-18", "18-21", "21-24", "24-27", "27-30", "30-35", "35-45", "45-100")
+
+
+def make_payload(days: int = 365, cities: int = 500) -> list[dict]:
+    """Build a synthetic ``stats.get`` response with ``interval=day, extended=1``."""
+
+    def buckets() -> dict:
+        return {
+            "age": [{"value": value, "count": 10} for value in AGE_GROUPS],
+            "cities": [
+                {"name": f"City {i}", "city_id": i, "count": i} for i in range(cities)
+            ],
+            "countries": [
+                {"name": f"Country {i}", "code": str(i), "count": i} for i in range(20)
+            ],
+            "sex": [{"value": "f", "count": 1}, {"value": "m", "count": 2}],
+        }
+
+    start = 1_700_000_000
+    return [
+        {
+            "period_from": start + day * 86400,
+            "period_to": start + (day + 1) * 86400,
+            "activity": {
+                "comments": 1,
+                "copies": 2,
+                "hidden": 3,
+                "likes": 4,
+                "subscribed": 5,
+                "unsubscribed": 6,
+            },
+            "reach": {
+                "mobile_reach": 1, "reach": 2, "reach_subscribers": 3, **buckets(),
+            },
+            "visitors": {"mobile_views": 1, "views": 2, "visitors": 3, **buckets()},
+        }
+        for day in range(days)
+    ]
+
+
+def legacy_transform(data: list[dict]) -> t.Iterator[dict]:  # noqa: C901
+    """Previous implementation, kept as the baseline."""
+    for record in data:
+        # Общие поля (1 уровень вложенности)
+        if record.get("activity"):
+            base_record = {
+                "period_from": record["period_from"],
+                "period_to": record["period_to"],
+                **{f"activity_{k}": v for k, v in record["activity"].items()},
+                "mobile_reach": record["reach"]["mobile_reach"],
+                "total_reach": record["reach"]["reach"],
+                "reach_subscribers": record["reach"]["reach_subscribers"],
+                "mobile_views": record["visitors"]["mobile_views"],
+                "total_views": record["visitors"]["views"],
+                "total_visitors": record["visitors"]["visitors"],
+            }
+        else:
+            base_record = {
+                "period_from": record["period_from"],
+                "period_to": record["period_to"],
+                "mobile_reach": record["reach"]["mobile_reach"],
+                "total_reach": record["reach"]["reach"],
+                "reach_subscribers": record["reach"]["reach_subscribers"],
+                "mobile_views": record["visitors"]["mobile_views"],
+                "total_views": record["visitors"]["views"],
+                "total_visitors": record["visitors"]["visitors"],
+            }
+
+        # Вложенность 2 уровня -> новые строки
+        # Reach -> Age
+        for age_group in record.get("reach", {}).get("age", []):
+            row = base_record.copy()
+            row.update({
+                "dimension": "age",
+                "dimension_value": age_group["value"],
+                "count": age_group["count"],
+                "source": "reach",
+            })
+            yield row
+
+        # Reach -> Cities
+        for city in record.get("reach", {}).get("cities", []):
+            row = base_record.copy()
+            row.update({
+                "dimension": "city",
+                "dimension_value": city["name"],
+                "count": city["count"],
+                "source": "reach",
+            })
+            yield row
+
+        # Reach -> Countries
+        for country in record.get("reach", {}).get("countries", []):
+            row = base_record.copy()
+            row.update({
+                "dimension": "country",
+                "dimension_value": country["name"],
+                "count": country["count"],
+                "source": "reach",
+            })
+            yield row
+
+        # Reach -> Sex
+        for sex_group in record.get("reach", {}).get("sex", []):
+            row = base_record.copy()
+            row.update({
+                "dimension": "sex",
+                "dimension_value": sex_group["value"],
+                "count": sex_group["count"],
+                "source": "reach",
+            })
+            yield row
+
+        # Visitors -> Age
+        for age_group in record.get("visitors", {}).get("age", []):
+            row = base_record.copy()
+            row.update({
+                "dimension": "age",
+                "dimension_value": age_group["value"],
+                "count": age_group["count"],
+                "source": "visitors",
+            })
+            yield row
+
+        # Visitors -> Cities
+        for city in record.get("visitors", {}).get("cities", []):
+            row = base_record.copy()
+            row.update({
+                "dimension": "city",
+                "dimension_value": city["name"],
+                "count": city["count"],
+                "source": "visitors",
+            })
+            yield row
+
+        # Visitors -> Countries
+        for country in record.get("visitors", {}).get("countries", []):
+            row = base_record.copy()
+            row.update({
+                "dimension": "country",
+                "dimension_value": country["name"],
+                "count": country["count"],
+                "source": "visitors",
+            })
+            yield row
+
+        # Visitors -> Sex
+        for sex_group in record.get("visitors", {}).get("sex", []):
+            row = base_record.copy()
+            row.update({
+                "dimension": "sex",
+                "dimension_value": sex_group["value"],
+                "count": sex_group["count"],
+                "source": "visitors",
+            })
+            yield row
+
+
+def count_rows(
+        transform: t.Callable[[list[dict]], t.Iterable[dict]],
+        payload: list[dict],
+) -> int:
+    """Consume the rows of ``transform`` and return their number."""
+    return sum(1 for _ in transform(payload))
+
+
+def main() -> None:
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--cities", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = make_payload(args.days, args.cities)
+    current = list(GroupStatStream.transform_to_flat_structure(payload))
+    baseline = list(legacy_transform(payload))
+    if current != baseline:
+        sys.exit("table-driven rows differ from the baseline")
+
+    print(f"{len(current)} rows from {args.days} days x {args.cities} cities")
+    candidates = (
+        ("legacy", legacy_transform),
+        ("table-driven", GroupStatStream.transform_to_flat_structure),
+    )
+    for name, func in candidates:
+        timings = timeit.repeat(
+            functools.partial(count_rows, func, payload),
+            number=1,
+            repeat=args.repeat,
+        )
+        best = min(timings)
+        print(f"{name:>13}: {best * 1000:8.1f} ms  {len(current) / best:12,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
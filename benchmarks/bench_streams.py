@@ -0,0 +1,324 @@
+"""End-to-end benchmark of the tap's streams against the local VK stand-in.
+
+Every stream is synced on its own, in a separate process, against
+:class:`tap_vk.standin.VkStandIn` serving a community of the given size::
+
+    python -m benchmarks.bench_streams --sizes 1000,10000
+    python -m benchmarks.bench_streams --compare benchmarks/results/main.json
+
+For every stream and size the report has the record count, records per
+second, API calls per record (methods called, ``execute`` counted once plus
+the calls inside it), HTTP latency percentiles and peak RSS. Results are
+saved as JSON. ``--compare`` prints the change against an earlier file and
+exits with status 1 when throughput drops or API calls grow by more than
+``--threshold``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+from pathlib import Path
+
+from tap_vk.standin import DAY, SyntheticVk, VkStandIn
+from tap_vk.storage import StoryIdCache
+
+STREAMS = (
+    "group",
+    "group_posts",
+    "group_posts_comments",
+    "story",
+    "story_history",
+    "groupStat",
+)
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+DEFAULT_OUTPUT = Path("benchmarks/results/streams.json")
+STATS_DAYS = 30
+GROUP_ID = 1
+
+
+def data_shape(stream: str, size: int) -> dict:
+    """Return :class:`SyntheticVk` arguments for about ``size`` records."""
+    if stream == "group_posts":
+        return {"posts": size}
+    if stream == "group_posts_comments":
+        # 5 комментариев и по одному ответу на каждый: 10 записей на пост
+        return {"posts": max(size // 10, 1), "comments": 5, "replies": 1}
+    if stream in ("story", "story_history"):
+        return {"stories": size}
+    if stream == "groupStat":
+        # Строк за день: 2 источника x (2 возраста + города + 1 страна + 2 пола)
+        return {"cities": max((size // STATS_DAYS - 10) // 2, 1)}
+    return {}
+
+
+def make_config(
+        stream: str,
+        size: int,
+        api_url: str,
+        cache_dir: str,
+        rps: float,
+) -> dict:
+    """Return the tap config of one benchmark run."""
+    config = {
+        "token": "benchmark",
+        "group_ids": [GROUP_ID],
+        "api_url": api_url,
+        "cache_dir": cache_dir,
+        "requests_per_second": rps,
+        "start_date": "2000-01-01T00:00:00Z",
+    }
+    if stream == "group":
+        # groups.getById принимает не больше 500 сообществ
+        config["group_ids"] = list(range(1, min(size, 500) + 1))
+    if stream == "groupStat":
+        now = datetime.datetime.now(datetime.timezone.utc)
+        start = now - datetime.timedelta(days=STATS_DAYS)
+        config["start_date"] = start.strftime("%Y-%m-%dT00:00:00Z")
+        config["stats_window_days"] = STATS_DAYS + 1
+    return config
+
+
+class RecordCounter:
+    """Stand-in for stdout counting the Singer RECORD messages written."""
+
+    def __init__(self) -> None:
+        """Create the counter."""
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, data: str) -> int:
+        """Count a chunk of Singer output."""
+        self.records += data.count('"type":"RECORD"') + data.count('"type": "RECORD"')
+        self.bytes += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        """Nothing is buffered."""
+
+
+def percentile(values: list[float], share: float) -> float:
+    """Return the ``share`` percentile of ``values`` (nearest rank)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+def run_scenario(
+        stream: str,
+        size: int,
+        *,
+        latency: float = 0.0,
+        rps: float = 1e6,
+) -> dict:
+    """Sync one stream against a fresh stand-in and measure it.
+
+    Meant to run in its own process, so that the peak RSS belongs to this
+    scenario only.
+    """
+    from tap_vk.tap import TapVk
+
+    data = SyntheticVk(**data_shape(stream, size))
+    with (
+        VkStandIn(data, latency=latency) as standin,
+        tempfile.TemporaryDirectory() as cache_dir,
+    ):
+        if stream == "story_history":
+            index = StoryIdCache(cache_dir).get(GROUP_ID)
+            for story_id in range(1, data.stories + 1):
+                index.add(story_id, data.now + DAY)
+            index.save()
+
+        config = make_config(stream, size, standin.url, cache_dir, rps)
+        tap = TapVk(config=config, parse_env_config=False)
+        for name, tap_stream in tap.streams.items():
+            tap_stream.selected = name == stream
+        latencies: list[float] = []
+        tap.client.http.hooks["response"].append(
+            lambda response, *_args, **_kwargs: latencies.append(
+                response.elapsed.total_seconds()
+            )
+        )
+
+        sink = RecordCounter()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(t.cast("t.TextIO", sink)):
+            tap.sync_all()
+            tap.teardown()
+        elapsed = time.perf_counter() - started
+
+        calls = dict(standin.calls)
+        requests_count = standin.requests
+
+    api_calls = sum(count for method, count in calls.items() if method != "execute")
+    return {
+        "stream": stream,
+        "size": size,
+        "records": sink.records,
+        "seconds": round(elapsed, 4),
+        "records_per_sec": round(sink.records / elapsed, 1) if elapsed else 0.0,
+        "http_requests": requests_count,
+        "api_calls": api_calls,
+        "api_calls_per_record": (
+            round(api_calls / sink.records, 4) if sink.records else None
+        ),
+        "calls": calls,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p90": round(percentile(latencies, 0.90) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+        },
+        "output_bytes": sink.bytes,
+        # ru_maxrss в килобайтах на Linux и в байтах на macOS
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            / (1024 * 1024 if sys.platform == "darwin" else 1024),
+            1,
+        ),
+    }
+
+
+def run_isolated(stream: str, size: int, latency: float, rps: float) -> dict:
+    """Run :func:`run_scenario` in a child process and return its result."""
+    command = [
+        sys.executable, "-m", "benchmarks.bench_streams", "--worker",
+        "--streams", stream, "--sizes", str(size),
+        "--latency", str(latency), "--rps", str(rps),
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True, check=False)  # noqa: S603
+    if completed.returncode != 0:
+        msg = f"{stream} x {size} failed:\n{completed.stderr[-2000:]}"
+        raise RuntimeError(msg)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def environment() -> dict:
+    """Describe the machine and revision the results were measured on."""
+    try:
+        revision = subprocess.run(  # noqa: S603
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(
+            timespec="seconds"
+        ),
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    """Print the change against ``baseline`` and return the regressions."""
+    previous = {(row["stream"], row["size"]): row for row in baseline}
+    regressions = []
+    print(
+        f"{'stream':<22}{'size':>8}{'rec/s':>12}{'change':>9}"
+        f"{'calls':>9}{'change':>9}"
+    )
+    for row in results:
+        old = previous.get((row["stream"], row["size"]))
+        if old is None:
+            continue
+        speed = calls = 0.0
+        if old["records_per_sec"]:
+            speed = row["records_per_sec"] / old["records_per_sec"] - 1
+        if old["api_calls"]:
+            calls = row["api_calls"] / old["api_calls"] - 1
+        print(
+            f"{row['stream']:<22}{row['size']:>8}"
+            f"{row['records_per_sec']:>12.0f}{speed:>+9.1%}"
+            f"{row['api_calls']:>9}{calls:>+9.1%}"
+        )
+        scenario = f"{row['stream']} x {row['size']}"
+        if speed < -threshold:
+            regressions.append(f"{scenario}: throughput {speed:+.1%}")
+        if calls > threshold:
+            regressions.append(f"{scenario}: API calls {calls:+.1%}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the benchmark and save or compare the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument(
+        "--streams", default=",".join(STREAMS), help="comma-separated stream names"
+    )
+    parser.add_argument(
+        "--sizes",
+        default=",".join(map(str, DEFAULT_SIZES)),
+        help="comma-separated sizes",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="stand-in latency per request, seconds",
+    )
+    parser.add_argument(
+        "--rps", type=float, default=1e6, help="requests per second allowed by the tap"
+    )
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument(
+        "--compare", type=Path, help="earlier results file to compare with"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="allowed relative regression"
+    )
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    streams = [name for name in args.streams.split(",") if name]
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    if args.worker:
+        result = run_scenario(streams[0], sizes[0], latency=args.latency, rps=args.rps)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for size in sizes:
+        for stream in streams:
+            row = run_isolated(stream, size, args.latency, args.rps)
+            results.append(row)
+            latency = row["latency_ms"]
+            print(
+                f"{stream:<22}{size:>8} {row['records']:>8} records "
+                f"{row['seconds']:>8.2f} s {row['records_per_sec']:>10.0f} rec/s "
+                f"{row['api_calls']:>7} calls p50 {latency['p50']:>6.2f} ms "
+                f"p99 {latency['p99']:>6.2f} ms {row['peak_rss_mb']:>7.1f} MB",
+            )
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(
+        json.dumps({"environment": environment(), "results": results}, indent=2),
+        encoding="utf-8",
+    )
+    print(f"Saved to {args.output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
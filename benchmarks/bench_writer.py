@@ -0,0 +1,90 @@
+"""Micro-benchmark of Singer RECORD output.
+
+Writes synthetic ``group_posts_comments`` records through the SDK record
+path (``_write_record_message``: deselected properties, type conformance,
+``write_message``) to ``os.devnull`` with three tap configurations: the SDK
+writer, ``fast_output`` and ``fast_output`` with ``skip_record_conformance``::
+
+    python -m benchmarks.bench_writer --records 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import os
+import time
+from pathlib import Path
+
+from tap_vk.tap import TapVk
+
+STREAM = "group_posts_comments"
+WRITERS = {
+    "sdk": {},
+    "fast_output": {"fast_output": True},
+    "+skip conformance": {"fast_output": True, "skip_record_conformance": True},
+}
+
+
+def make_records(count: int) -> list[dict]:
+    """Build comment records as ``Comments.transform_items`` yields them."""
+    return [
+        {
+            "post_id": i // 10,
+            "group_id": 1,
+            "comment_id": i,
+            "from_id": 1000 + i % 997,
+            "date": "2024-05-01T12:00:00+00:00",
+            "text": f"Комментарий {i}: " + "текст " * 8,
+            "reply_to_user": 0,
+            "reply_to_comment": 0,
+            "likes": i % 13,
+            "parent_comment_id": 0 if i % 2 else i - 1,
+            "thread_depth": i % 2,
+        }
+        for i in range(count)
+    ]
+
+
+def run(config: dict, records: list[dict]) -> float:
+    """Write ``records`` with a tap built from ``config``, return the seconds taken."""
+    tap = TapVk(
+        config={"token": "benchmark", "group_ids": [1], **config},
+        parse_env_config=False,
+    )
+    stream = tap.streams[STREAM]
+    # Конформность изменяет запись на месте, поэтому каждому прогону свои копии
+    batch = [dict(record) for record in records]
+    with (
+        Path(os.devnull).open("w", encoding="utf-8") as devnull,
+        contextlib.redirect_stdout(devnull),
+    ):
+        started = time.perf_counter()
+        for record in batch:
+            stream._write_record_message(record)  # noqa: SLF001
+        if tap.message_writer is not None:
+            tap.message_writer.flush()
+        return time.perf_counter() - started
+
+
+def main() -> None:
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    print(f"{args.records} {STREAM} records")
+    baseline = None
+    for name, config in WRITERS.items():
+        best = min(run(config, records) for _ in range(args.repeat))
+        baseline = baseline or best
+        print(
+            f"{name:>18}: {best * 1000:8.1f} ms  "
+            f"{args.records / best:12,.0f} records/s  x{baseline / best:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,25 +2,1165 @@
 
 from __future__ import annotations
 
+import datetime
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
 import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-from vk_api import VkApi
-
+import requests
+from vk_api.exceptions import ApiError, ApiHttpError
+from vk_api.vk_api import VkApiMethod
 
+from singer_sdk.exceptions import ConfigValidationError
 from singer_sdk.streams import Stream
+from singer_sdk.streams.core import REPLICATION_FULL_TABLE
+# В SDK 0.43 у этих классов нет публичного экспорта, поэтому версия SDK
+# закреплена в pyproject.toml в пределах 0.43.x
+from singer_sdk.helpers._batch import BaseBatchFileEncoding, BatchConfig
+from singer_sdk.helpers._typing import TypeConformanceLevel
 from singer_sdk.helpers.jsonpath import extract_jsonpath
 
+from tap_vk.batch import DEFAULT_BATCH_FILE_MB, RotatingBatchWriter
+from tap_vk.metrics import ApiMetrics
+from tap_vk.pipeline import (
+    CHUNK_SIZE,
+    DEFAULT_PIPELINE_QUEUE_SIZE,
+    Pipeline,
+    StageStats,
+    log_stage_stats,
+)
+from tap_vk.ratelimit import THROTTLING_CODES, RateLimiter, rate_limiter
+from tap_vk.storage import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_FULL_REFRESH_DAYS,
+    FingerprintStore,
+    ResponseCache,
+)
+from tap_vk.tokens import PooledToken, TokenPool
+from tap_vk.transport import make_adapter
+
 if t.TYPE_CHECKING:
+    from requests.adapters import BaseAdapter
     from singer_sdk.helpers.types import Context
+    from typing_extensions import Self
+
+    from tap_vk.tap import TapVk
+
+API_URL = "https://api.vk.com/method/"
+API_VERSION = "5.92"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_CONCURRENCY = 4
+DEFAULT_GROUP_CONCURRENCY = 4
+
+_T = t.TypeVar("_T")
+_R = t.TypeVar("_R")
+
+
+def chunked(items: t.Iterable[_T], size: int) -> t.Iterator[list[_T]]:
+    """Split ``items`` into lists of at most ``size`` elements, lazily."""
+    chunk: list[_T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class VkClient:
+    """Shared VK API session used by every stream of the tap.
+
+    All calls go through a single ``requests.Session`` with a keep-alive
+    connection pool, so the TLS handshake is paid once per run instead of once
+    per stream. The object is a drop-in replacement for ``vk_api.VkApi`` as far
+    as ``VkApiMethod`` and ``ApiError.try_method`` are concerned.
+
+    Every call is signed with a token chosen by a :class:`TokenPool`; a
+    single ``token`` is wrapped into a pool of one.
+    """
+
+    def __init__(  # noqa: PLR0913
+            self,
+            token: str | None,
+            *,
+            token_type: str = "user",  # noqa: S107
+            tokens: TokenPool | None = None,
+            pool_size: int = DEFAULT_POOL_SIZE,
+            max_retries: int = DEFAULT_MAX_RETRIES,
+            backoff_factor: float = 0.5,
+            limiter: RateLimiter | None = None,
+            api_version: str = API_VERSION,
+            api_url: str = API_URL,
+            transport: BaseAdapter | None = None,
+            cache: ResponseCache | None = None,
+            metrics: ApiMetrics | None = None,
+            logger: logging.Logger | None = None,
+    ) -> None:
+        """Create the pooled session.
+
+        Args:
+            token: VK access token, ignored if ``tokens`` is given.
+            token_type: Token type (``user``, ``community`` or ``service``),
+                selects the rate limit buckets.
+            tokens: Pool of tokens to dispatch the calls to.
+            pool_size: Maximum number of keep-alive connections per host.
+            max_retries: How many times a throttled call is repeated.
+            backoff_factor: Base delay in seconds between retries, doubled
+                after every attempt.
+            limiter: Rate limiter, defaults to the process-wide one.
+            api_version: VK API version sent with every call.
+            api_url: Base URL of the API methods, e.g. a local stand-in.
+            transport: Adapter sending the HTTP requests, a pooled live
+                adapter by default (see :mod:`tap_vk.transport`).
+            cache: Optional on-disk cache for responses of slow-changing
+                methods.
+            metrics: Per-method call counters, a new set by default.
+            logger: Logger used for connection statistics.
+        """
+        self.token = token
+        self.token_type = token_type
+        self.tokens = tokens or TokenPool.single(token, token_type)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.limiter = limiter or rate_limiter
+        self.api_version = api_version
+        self.api_url = api_url
+        self.cache = cache
+        self.metrics = metrics or ApiMetrics()
+        # Ответы кэшируются отдельно для каждого набора токенов и версии API
+        token_hash = hashlib.sha256(self.tokens.scope.encode()).hexdigest()[:16]
+        self.cache_scope = f"{token_hash}:{api_version}"
+        # Токен последнего запроса в каждом потоке, нужен should_retry
+        self._local = threading.local()
+        self.logger = logger or logging.getLogger("vk_api")
+
+        self.http = requests.Session()
+        self.http.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        adapter = transport or make_adapter(pool_size=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    def method(
+            self,
+            method: str,
+            values: dict | None = None,
+            *,
+            raw: bool = False,
+    ) -> t.Any:  # noqa: ANN401
+        """Call a VK API method.
+
+        The call is sent with the least-loaded token of :attr:`tokens`
+        allowed for the communities it touches, waits for that token's rate
+        limiter and is repeated with exponential backoff when VK answers with
+        a throttling error (6, 9 or 29). Tokens rejected or throttled by VK
+        are quarantined and the call moves to another token without backoff.
+        Responses of methods with a TTL in :attr:`cache` are served from
+        the cache while fresh.
+
+        Args:
+            method: Method name, e.g. ``wall.get``.
+            values: Method parameters.
+            raw: Return the whole response instead of ``response['response']``.
+
+        Returns:
+            Decoded API response.
+
+        Raises:
+            ApiHttpError: If VK answers with a non-2xx status.
+            ApiError: If VK answers with an error object.
+            NoTokenAvailableError: If every token allowed for the call is revoked
+                or out of its daily quota.
+        """
+        cache_key = None
+        if self.cache is not None and self.cache.ttl(method) > 0:
+            cache_key = self.cache.make_key(
+                method, {**(values or {}), "raw": raw}, self.cache_scope
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        attempt = 0
+        while True:
+            token = self.tokens.acquire(values)
+            self._local.token = token
+            self.limiter.acquire(token.token_type, method, token.key)
+            try:
+                response = self._request(method, values, token, raw=raw)
+            except ApiError as error:
+                if self.tokens.release(token, error.code, values):
+                    self.limiter.on_error(
+                        token.token_type, method, error.code, token.key
+                    )
+                    self.logger.warning(
+                        "VK answered %s with error %s for %s, switching tokens",
+                        method,
+                        error.code,
+                        token.name,
+                    )
+                    continue
+                if not self.should_retry(method, error, attempt):
+                    raise
+                attempt += 1
+                continue
+            except Exception:
+                self.tokens.release(token)
+                raise
+            self.tokens.release(token)
+            self.limiter.on_success(token.token_type, method, token.key)
+            if self.cache is not None and cache_key is not None:
+                self.cache.set(cache_key, method, response)
+            return response
+
+    def should_retry(self, method: str, error: ApiError, attempt: int) -> bool:
+        """Register a failed call and sleep before repeating it if allowed.
+
+        Args:
+            method: Method that failed.
+            error: Error returned by VK.
+            attempt: Number of retries already made.
+
+        Returns:
+            ``True`` if the call should be sent again.
+        """
+        if error.code not in THROTTLING_CODES:
+            return False
+        token = getattr(self._local, "token", None)
+        if token is not None:
+            self.limiter.on_error(token.token_type, method, error.code, token.key)
+        else:
+            self.limiter.on_error(self.token_type, method, error.code)
+        if attempt >= self.max_retries:
+            return False
+        self.metrics.record_retry(method)
+        delay = self.backoff_factor * 2 ** attempt
+        self.logger.warning(
+            "VK throttled %s with error %s, retrying in %.1f sec",
+            method,
+            error.code,
+            delay,
+        )
+        time.sleep(delay)
+        return True
+
+    def _request(
+            self,
+            method: str,
+            values: dict | None,
+            token: PooledToken,
+            *,
+            raw: bool,
+    ) -> t.Any:  # noqa: ANN401
+        values = values.copy() if values else {}
+        values.setdefault("v", self.api_version)
+        if token.token:
+            values.setdefault("access_token", token.token)
+
+        started = time.perf_counter()
+        http_response = self.http.post(self.api_url + method, values)
+        size = len(http_response.content)
+        elapsed = time.perf_counter() - started
+        if not http_response.ok:
+            self.metrics.record_request(
+                method, elapsed, size, http_response.status_code
+            )
+            raise ApiHttpError(self, method, values, raw, http_response)
+
+        response = http_response.json()
+        error = response.get("error")
+        self.metrics.record_request(
+            method, elapsed, size, error and error.get("error_code")
+        )
+        if error is not None:
+            raise ApiError(self, method, values, raw, error)
+
+        return response if raw else response["response"]
+
+    def get_api(self) -> VkApiMethod:
+        """Return the ``vk.section.method(...)`` accessor bound to this client."""
+        return VkApiMethod(self)
+
+    def paginate(
+            self,
+            method: str,
+            values: dict | None = None,
+            *,
+            page_size: int = 100,
+            first_page: dict | None = None,
+    ) -> t.Iterator[dict]:
+        """Yield ``items`` of an offset-paginated method page by page.
+
+        The next page is requested only when the consumer reaches it, so
+        stopping the iteration early saves the remaining calls.
+
+        Args:
+            method: Method name, e.g. ``wall.get``.
+            values: Method parameters except ``offset`` and ``count``.
+            page_size: Number of items per call.
+            first_page: Response to the call with offset 0 if it has already
+                been made, e.g. in an ``execute`` batch.
+        """
+        values = dict(values or {})
+        offset = 0
+        page = first_page
+        while True:
+            if page is None:
+                page = self.method(
+                    method, {**values, "offset": offset, "count": page_size}
+                )
+            items = page.get("items", [])
+            yield from items
+            offset += len(items)
+            if not items or offset >= page.get("count", 0):
+                return
+            page = None
+
+    def batch(self, concurrency: int = 1) -> VkBatch:
+        """Return a new ``execute`` batch bound to this client.
+
+        Args:
+            concurrency: Number of ``execute`` requests kept in flight.
+        """
+        return VkBatch(self, concurrency=concurrency)
+
+    @staticmethod
+    def map(
+            func: t.Callable[[_T], _R],
+            items: t.Iterable[_T],
+            concurrency: int = 1,
+    ) -> t.Iterator[_R]:
+        """Apply ``func`` to ``items`` with at most ``concurrency`` calls in flight.
+
+        Results are yielded in the order of ``items``. All calls made by
+        ``func`` still go through the shared rate limiter.
+
+        Args:
+            func: Function making VK API calls.
+            items: Arguments for ``func``.
+            concurrency: Maximum number of parallel calls.
+        """
+        if concurrency <= 1:
+            yield from map(func, items)
+            return
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            yield from executor.map(func, items)
+
+    def connection_stats(self) -> dict[str, int]:
+        """Count HTTP connections opened and reused by the pool.
+
+        Returns:
+            Dictionary with ``requests``, ``opened`` and ``reused`` counters.
+        """
+        requests_count = 0
+        opened = 0
+        for adapter in set(self.http.adapters.values()):
+            if not hasattr(adapter, "poolmanager"):
+                continue
+            pools = adapter.poolmanager.pools
+            # Обходить сам контейнер пулов urllib3 не позволяет
+            for key in pools.keys():  # noqa: SIM118
+                pool = pools[key]
+                requests_count += pool.num_requests
+                opened += pool.num_connections
+        return {
+            "requests": requests_count,
+            "opened": opened,
+            "reused": max(requests_count - opened, 0),
+        }
+
+    def log_connection_stats(self) -> None:
+        """Write connection pool statistics to the log."""
+        stats = self.connection_stats()
+        self.logger.info(
+            "VK API connections: %d requests, %d opened, %d reused",
+            stats["requests"],
+            stats["opened"],
+            stats["reused"],
+        )
+        if self.cache is not None:
+            self.logger.info(
+                "VK API response cache: %d hits, %d misses",
+                self.cache.hits,
+                self.cache.misses,
+            )
+
+    def log_token_stats(self) -> None:
+        """Write the daily usage of every token to the log."""
+        for stats in self.tokens.stats():
+            quota = stats["daily_quota"]
+            quarantine = ""
+            if stats["quarantined"]:
+                quarantine = f", quarantined after error {stats['last_error']}"
+            self.logger.info(
+                "VK API %s: %d calls today of %s%s",
+                stats["name"],
+                stats["used_today"],
+                "unlimited" if quota is None else quota,
+                quarantine,
+            )
+
+    def close(self) -> None:
+        """Close all pooled connections and the response cache.
+
+        The daily usage of the tokens is saved as well.
+        """
+        self.tokens.save_usage()
+        self.http.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+class VkBatchResult:
+    """Deferred result of a call queued in a :class:`VkBatch`."""
+
+    __slots__ = ("_error", "_result", "method", "ready", "values")
+
+    def __init__(self, method: str, values: dict) -> None:
+        """Create an empty result.
+
+        Args:
+            method: Queued method name.
+            values: Queued method parameters.
+        """
+        self.method = method
+        self.values = values
+        self.ready = False
+        self._result: t.Any = None
+        self._error: ApiError | None = None
+
+    def set_result(self, result: t.Any) -> None:  # noqa: ANN401
+        """Store a successful response."""
+        self._result = result
+        self._error = None
+        self.ready = True
+
+    def set_error(self, error: ApiError) -> None:
+        """Store the error VK returned for this call."""
+        self._error = error
+        self.ready = True
+
+    @property
+    def ok(self) -> bool:
+        """``True`` if the call finished without an error."""
+        return self.ready and self._error is None
+
+    @property
+    def error(self) -> ApiError | None:
+        """Error returned for this call, if any."""
+        return self._error
+
+    @property
+    def result(self) -> t.Any:  # noqa: ANN401
+        """Response of the call.
+
+        Raises:
+            RuntimeError: If the batch has not been executed yet.
+            ApiError: If VK returned an error for this call.
+        """
+        if not self.ready:
+            msg = f"Batch with {self.method} has not been executed yet"
+            raise RuntimeError(msg)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class VkBatch:
+    """Queue of VK API calls sent through the ``execute`` method.
+
+    Calls are collected with :meth:`method` (or through :meth:`get_api`) and
+    sent in groups of :attr:`size` when the batch is executed, either
+    explicitly or on leaving the ``with`` block. Every call gets its own
+    :class:`VkBatchResult`, so one failed call does not affect its neighbours.
+    """
+
+    size = 25  # Лимит VK на количество обращений к API внутри execute
+
+    def __init__(self, client: VkClient, concurrency: int = 1) -> None:
+        """Create an empty batch.
+
+        Args:
+            client: Client used to send ``execute`` requests.
+            concurrency: Number of ``execute`` requests kept in flight.
+        """
+        self.client = client
+        self.concurrency = concurrency
+        self.pending: list[VkBatchResult] = []
+
+    def __enter__(self) -> Self:
+        """Return the batch itself."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # noqa: ANN001
+        """Execute the queued calls unless the block raised."""
+        if exc_type is None:
+            self.execute()
+
+    def method(self, method: str, values: dict | None = None) -> VkBatchResult:
+        """Queue a call.
+
+        Args:
+            method: Method name, e.g. ``wall.getComments``.
+            values: Method parameters.
+
+        Returns:
+            Result placeholder filled in by :meth:`execute`.
+        """
+        result = VkBatchResult(method, dict(values or {}))
+        self.pending.append(result)
+        return result
+
+    def get_api(self) -> VkApiMethod:
+        """Return a ``vk.section.method(...)`` accessor that queues calls."""
+        return VkApiMethod(self)
+
+    @staticmethod
+    def build_code(calls: t.Sequence[VkBatchResult]) -> str:
+        """Build the VKScript code returning the responses of ``calls``."""
+        body = ",".join(
+            f"API.{call.method}({json.dumps(call.values, ensure_ascii=False)})"
+            for call in calls
+        )
+        return f"return [{body}];"
+
+    def execute(self) -> None:
+        """Send all queued calls and fill in their results."""
+        pending, self.pending = self.pending, []
+        chunks = [
+            pending[start:start + self.size]
+            for start in range(0, len(pending), self.size)
+        ]
+        for _ in self.client.map(self._execute_chunk, chunks, self.concurrency):
+            pass
+
+    def _execute_chunk(self, calls: list[VkBatchResult]) -> None:
+        attempt = 0
+        while calls:
+            self._send(calls)
+            throttled = [
+                call for call in calls
+                if call.error is not None and call.error.code in THROTTLING_CODES
+            ]
+            if not throttled:
+                return
+            first = throttled[0]
+            if not self.client.should_retry(first.method, first.error, attempt):
+                return
+            calls = throttled
+            attempt += 1
+
+    def _send(self, calls: list[VkBatchResult]) -> None:
+        code = self.build_code(calls)
+        try:
+            response = self.client.method("execute", {"code": code}, raw=True)
+        except ApiError as error:
+            for call in calls:
+                call.set_error(error)
+            return
+
+        results = response.get("response") or []
+        errors = iter(response.get("execute_errors", []))
+        metrics = self.client.metrics
+        for index, call in enumerate(calls):
+            result = results[index] if index < len(results) else False
+            if result is not False:
+                call.set_result(result)
+                metrics.record_batched(call.method)
+                continue
+            failure = next(errors, None) or {
+                "error_code": 0,
+                "error_msg": "No response from execute",
+            }
+            metrics.record_batched(call.method, failure.get("error_code"))
+            call.set_error(ApiError(
+                self.client, call.method, call.values, raw=False, error=failure
+            ))
+
+
+class PartitionPrefetcher:
+    """Fetch stream partitions in background threads ahead of the consumer.
+
+    The Singer SDK reads partitions one after another. The prefetcher starts
+    ``fetch(partition)`` for up to ``concurrency`` partitions at once, in
+    partition order, and buffers their records in bounded queues. Records of a
+    partition are handed out only when the SDK asks for that partition, so
+    output order and per-partition state are the same as in a serial run.
+    """
+
+    _RECORD, _DONE, _ERROR = range(3)
+
+    def __init__(
+            self,
+            fetch: t.Callable[[Context], t.Iterable[dict]],
+            partitions: t.Sequence[Context],
+            concurrency: int,
+            queue_size: int = 1000,
+    ) -> None:
+        """Create the prefetcher, threads are started on first use.
+
+        Args:
+            fetch: Function returning the records of one partition.
+            partitions: Partition contexts in the order they are consumed.
+            concurrency: Maximum number of partitions fetched at once.
+            queue_size: Maximum number of buffered records per partition.
+        """
+        self._fetch = fetch
+        self._partitions = partitions
+        self._queues: list[queue.Queue[tuple[int, t.Any]]] = [
+            queue.Queue(maxsize=queue_size) for _ in partitions
+        ]
+        self._slots = threading.Semaphore(concurrency)
+        self._stop = threading.Event()
+        self._started = False
+
+    def _put(self, index: int, item: tuple[int, t.Any]) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queues[index].put(item, timeout=0.5)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def _work(self, index: int) -> None:
+        try:
+            for record in self._fetch(self._partitions[index]):
+                if not self._put(index, (self._RECORD, record)):
+                    return
+            self._put(index, (self._DONE, None))
+        except Exception as exc:  # noqa: BLE001
+            self._put(index, (self._ERROR, exc))
+        finally:
+            self._slots.release()
+
+    def _dispatch(self) -> None:
+        # Слоты выдаются строго по порядку партиций, иначе поздние партиции
+        # могут занять все слоты и заблокироваться на полных очередях.
+        for index in range(len(self._partitions)):
+            self._slots.acquire()
+            if self._stop.is_set():
+                return
+            threading.Thread(target=self._work, args=(index,), daemon=True).start()
+
+    def records(self, context: Context) -> t.Iterator[dict]:
+        """Yield the records of one partition.
+
+        Args:
+            context: Partition context, one of ``partitions``.
+        """
+        index = self._partitions.index(context)
+        if not self._started:
+            self._started = True
+            threading.Thread(target=self._dispatch, daemon=True).start()
+        completed = False
+        try:
+            while True:
+                kind, value = self._queues[index].get()
+                if kind == self._DONE:
+                    completed = True
+                    return
+                if kind == self._ERROR:
+                    raise value
+                yield value
+        finally:
+            if not completed:
+                self.close()
+
+    def close(self) -> None:
+        """Stop all background fetches."""
+        self._stop.set()
 
 
 class VkStream(Stream):
     """Stream class for Vk streams."""
+    _tap: TapVk
     records_jsonpath = "$[*]"
+    # Поле записи с ID сообщества, по нему строятся партиции
+    partition_key = "group_id"
+    # Поля-метрики потока: строки, в которых они не изменились, можно не
+    # отправлять (включается настройкой skip_unchanged_records)
+    metric_fields: t.ClassVar[tuple[str, ...]] = ()
+    # Записи собирает сам тап строго по схеме, их можно не приводить к типам
+    # схемы повторно (включается настройкой skip_record_conformance)
+    builds_records = False
+    # Поток может выгружаться файлами с сообщениями BATCH вместо RECORD
+    # (включается настройками batch_config или stream_batch_config)
+    supports_batch = False
+    # Поля схемы, которые заполняет отдельный метод VK: {метод: (поля, ...)}.
+    # Метод не вызывается, если ни одно из его полей не выбрано в каталоге.
+    enrichments: t.ClassVar[dict[str, tuple[str, ...]]] = {}
+    _prefetcher: PartitionPrefetcher | None = None
+    _pipeline_stats: list[StageStats] | None = None
+    _start_values: dict[int, t.Any] | None = None
+
+    @property
+    def client(self) -> VkClient:
+        """The tap's shared VK API client."""
+        return self._tap.client
+
+    @property
+    def TYPE_CONFORMANCE_LEVEL(self) -> TypeConformanceLevel:  # type: ignore[override]  # noqa: N802
+        """How the SDK conforms records to the schema before writing them.
+
+        Records of :attr:`builds_records` streams are not conformed when
+        ``skip_record_conformance`` is set.
+        """
+        if self.builds_records and self.config.get("skip_record_conformance"):
+            return TypeConformanceLevel.NONE
+        return TypeConformanceLevel.RECURSIVE
+
+    def get_batch_config(self, config: t.Mapping) -> BatchConfig | None:
+        """Return the batch config of a :attr:`supports_batch` stream.
+
+        ``stream_batch_config[<stream name>]`` is merged over the SDK's
+        ``batch_config``. Files are gzip JSON Lines in ``cache_dir/batches``
+        unless configured otherwise. Other streams always emit RECORD messages.
+
+        Args:
+            config: Tap configuration dictionary.
+        """
+        if not self.supports_batch:
+            return None
+        base = config.get("batch_config") or {}
+        per_stream = (config.get("stream_batch_config") or {}).get(self.name) or {}
+        if not base and not per_stream:
+            return None
+        root = Path(config.get("cache_dir", DEFAULT_CACHE_DIR), "batches")
+        return BatchConfig.from_dict({
+            "encoding": {
+                "format": "jsonl",
+                "compression": "gzip",
+                **(base.get("encoding") or {}),
+                **(per_stream.get("encoding") or {}),
+            },
+            "storage": {
+                "root": root.resolve().as_uri(),
+                **(base.get("storage") or {}),
+                **(per_stream.get("storage") or {}),
+            },
+            "batch_size": per_stream.get("batch_size") or base.get("batch_size"),
+        })
+
+    def get_batches(
+        self,
+        batch_config: BatchConfig,
+        context: Context | None = None,
+    ) -> t.Iterable[tuple[BaseBatchFileEncoding, list[str]]]:
+        """Write the records to rotating batch files and yield their manifests.
+
+        The writer stays open between calls, so a child stream synced once
+        per parent record still fills whole files; the tap closes it before
+        every STATE message and at the end of the sync. Records are trimmed
+        to the selected properties, conformed and mapped like RECORD messages.
+
+        Args:
+            batch_config: Batch config for this stream.
+            context: Stream partition or context dictionary.
+
+        Yields:
+            A tuple of (encoding, manifest) for each file.
+        """
+        writer = self._tap.batch_writers.get(self.name)
+        if writer is None:
+            per_stream = self.config.get("stream_batch_config") or {}
+            per_stream = per_stream.get(self.name) or {}
+            writer = self._tap.batch_writers[self.name] = RotatingBatchWriter(
+                self.tap_name,
+                self.name,
+                batch_config,
+                self.schema,
+                max_file_mb=per_stream.get("max_file_mb") or DEFAULT_BATCH_FILE_MB,
+            )
+        for record in self._sync_records(context, write_messages=False):
+            # Те же преобразования, что и для сообщений RECORD
+            for message in self._generate_record_messages(record):
+                manifest = writer.write(message.record)
+                if manifest:
+                    yield writer.encoding, manifest
+
+    @property
+    def group_ids(self) -> list[int]:
+        """Communities to extract, from ``group_ids`` or the legacy ``group_id``."""
+        group_ids = self.config.get("group_ids") or []
+        if not group_ids and self.config.get("group_id"):
+            group_ids = [self.config["group_id"]]
+        return [abs(int(group_id)) for group_id in group_ids]
+
+    @property
+    def partitions(self) -> list[dict] | None:
+        """One partition per community."""
+        return [{self.partition_key: group_id} for group_id in self.group_ids] or None
+
+    def get_group_id(self, context: Context | None) -> int:
+        """Return the community ID of a partition.
+
+        Raises:
+            ConfigValidationError: If neither ``group_ids`` nor ``group_id``
+                is configured.
+        """
+        if context and self.partition_key in context:
+            return abs(int(context[self.partition_key]))
+        group_id = self.config.get("group_id")
+        if group_id is None:
+            msg = "No community to extract: set group_ids (or the legacy group_id)"
+            raise ConfigValidationError(msg)
+        return abs(int(group_id))
+
+    def starting_value(self, context: Context | None) -> t.Any:  # noqa: ANN401
+        """Return the replication value a partition starts from, without writing state.
+
+        The same value the SDK writes as ``starting_replication_value`` when
+        it reaches the partition: the bookmark, or ``start_date`` if there is
+        none. ``None`` for streams without a replication key.
+
+        Args:
+            context: Stream partition or context dictionary.
+        """
+        if (
+            not self.replication_key
+            or self.replication_method == REPLICATION_FULL_TABLE
+        ):
+            return None
+        state = self.read_context_state(context)
+        value = None
+        if (
+            state.get("replication_key_value")
+            and state.get("replication_key") == self.replication_key
+        ):
+            value = state["replication_key_value"]
+        start_date = self.config.get("start_date")
+        if start_date:
+            value = self.compare_start_date(value, start_date) if value else start_date
+        return value
+
+    def read_context_state(self, context: Context | None) -> dict:
+        """Return the state of a partition without creating it.
+
+        Unlike :meth:`get_context_state` the tap state is only read.
+
+        Args:
+            context: Stream partition or context dictionary.
+        """
+        state = self.tap_state.get("bookmarks", {}).get(self.name, {})
+        if not context:
+            return state
+        keys = self.state_partitioning_keys
+        partition = context
+        if keys is not None:
+            partition = {k: v for k, v in context.items() if k in keys}
+        for partition_state in state.get("partitions", []):
+            if partition_state.get("context") == partition:
+                return partition_state
+        return {}
+
+    def freeze_start_values(self, context: Context | None) -> None:
+        """Work out the starting values of all partitions on the calling thread.
+
+        Partitions after the current one are fetched ahead in worker threads,
+        before the SDK has written their starting values. Fetch code reads
+        the values frozen here through :meth:`get_start_value` and never
+        touches the SDK state itself. Called from the main thread at the
+        start of every partition; the values are recomputed when the first
+        partition starts again.
+
+        Args:
+            context: The partition about to be synced.
+        """
+        partitions = self.partitions or []
+        if self._start_values is None or not partitions or context == partitions[0]:
+            self._start_values = {
+                self.get_group_id(partition): self.starting_value(partition)
+                for partition in partitions
+            }
+        if context and self.replication_key:
+            # Для текущей партиции SDK уже записал значение в состояние
+            value = self.get_starting_replication_key_value(context)
+            self._start_values[self.get_group_id(context)] = value
+
+    def get_start_value(self, context: Context | None) -> t.Any:  # noqa: ANN401
+        """Return the starting replication value of a partition.
+
+        Safe to call from fetch threads: the value comes from
+        :meth:`freeze_start_values`.
+
+        Args:
+            context: Stream partition or context dictionary.
+        """
+        group_id = self.get_group_id(context) if context else None
+        if self._start_values is not None and group_id in self._start_values:
+            return self._start_values[group_id]
+        return self.starting_value(context)
+
+    def get_start_timestamp(self, context: Context | None) -> int | None:
+        """Return the unix time to extract from.
+
+        The stream bookmark if there is one, otherwise ``start_date``.
+        """
+        value = self.get_start_value(context)
+        if value is None:
+            value = self.config.get("start_date")
+        if value is None:
+            return None
+        # Без закладки SDK подставляет в состояние start_date строкой
+        if isinstance(value, str):
+            start = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if start.tzinfo is None:
+                start = start.replace(tzinfo=datetime.timezone.utc)
+            return int(start.timestamp())
+        return int(value)
+
+    @property
+    def group_concurrency(self) -> int:
+        """Number of communities fetched at once."""
+        return self.config.get("group_concurrency", DEFAULT_GROUP_CONCURRENCY)
+
+    @property
+    def concurrency(self) -> int:
+        """Number of detail requests this stream keeps in flight.
+
+        Taken from ``stream_concurrency[<stream name>]``, then ``concurrency``
+        in the tap config.
+        """
+        per_stream = self.config.get("stream_concurrency") or {}
+        if self.name in per_stream:
+            return per_stream[self.name]
+        return self.config.get("concurrency", DEFAULT_CONCURRENCY)
+
+    @property
+    def detail_chunk_size(self) -> int:
+        """Number of items whose detail calls are sent before records are emitted.
+
+        Enough to keep every ``execute`` slot of :attr:`concurrency` busy.
+        """
+        return VkBatch.size * max(self.concurrency, 1)
+
+    @property
+    def vk(self) -> VkApiMethod:
+        """VK API accessor backed by the tap's shared session."""
+        return self.client.get_api()
+
+    def is_property_selected(self, name: str) -> bool:
+        """Return ``True`` if a schema property is emitted by this sync.
+
+        A property of a stream synced only for its children (the stream
+        itself is deselected) is never emitted.
+        """
+        return self.selected and self.mask.get(("properties", name), True)
+
+    def needs(self, method: str) -> bool:
+        """Return ``True`` unless every property ``method`` fills is deselected.
+
+        Methods missing from :attr:`enrichments` are always needed.
+        """
+        properties = self.enrichments.get(method)
+        if properties is None or any(map(self.is_property_selected, properties)):
+            return True
+        pruned = self.__dict__.setdefault("_pruned_methods", set())
+        if method not in pruned:
+            pruned.add(method)
+            self.logger.info(
+                "Not calling %s, none of its properties are selected", method
+            )
+        return False
+
+    def selected_fields(self, fields: dict[str, str]) -> str:
+        """Build the ``fields`` parameter of a VK method from the catalog.
+
+        Args:
+            fields: VK field name by schema property.
+
+        Returns:
+            Comma-separated VK fields of the selected properties.
+        """
+        return ",".join(dict.fromkeys(
+            field for name, field in fields.items() if self.is_property_selected(name)
+        ))
 
     def get_records(
         self,
         context: Context | None,
+    ) -> t.Iterable[dict]:
+        """Return the records of a partition, fetching other partitions ahead.
+
+        Streams implement :meth:`get_group_records`, or
+        :meth:`fetch_group_items` and :meth:`transform_items`; this method
+        runs up to ``group_concurrency`` communities in parallel, shapes the
+        records in a separate stage (see :meth:`fetch_partition`) and drops
+        unchanged rows, see :meth:`changed_records`.
+
+        Args:
+            context: Stream partition or context dictionary.
+        """
+        yield from self.changed_records(self.fetch_partition(context), context)
+
+    def fetch_partition(
+        self,
+        context: Context | None,
+    ) -> t.Iterable[dict]:
+        """Return the records of a partition through the staged pipeline.
+
+        Fetching (:meth:`fetch_group_items`) and shaping the records
+        (:meth:`transform_items`) run in their own threads, linked to the
+        caller by queues of ``pipeline_queue_size`` items, so network waits,
+        record building and the SDK's validation and output overlap. With
+        ``pipeline_queue_size`` 0 everything runs in the caller's thread, as
+        do the contexts of child streams: a child context (e.g. the comments
+        of one post) is too small to pay for two new threads, and its parent
+        already runs in a pipeline.
+
+        Args:
+            context: Stream partition or context dictionary.
+        """
+        self.freeze_start_values(context)
+        items = self.prefetch_items(context)
+        queue_size = self.config.get("pipeline_queue_size", DEFAULT_PIPELINE_QUEUE_SIZE)
+        if queue_size <= 0 or self.parent_stream_type is not None:
+            yield from self.transform_items(items, context)
+            return
+        if self._pipeline_stats is None:
+            self._pipeline_stats = Pipeline.new_stats(["fetch", "transform"])
+        yield from Pipeline(
+            self.name,
+            items,
+            [("transform", lambda upstream: self.transform_items(upstream, context))],
+            queue_size=queue_size,
+            stats=self._pipeline_stats,
+        )
+
+    def log_pipeline_stats(self) -> None:
+        """Write the occupancy of the pipeline stages of this stream, if it ran."""
+        if self._pipeline_stats is not None:
+            queue_size = self.config.get(
+                "pipeline_queue_size", DEFAULT_PIPELINE_QUEUE_SIZE
+            )
+            chunks = max(-(-queue_size // CHUNK_SIZE), 1)
+            log_stage_stats(self.name, self._pipeline_stats, chunks)
+
+    def prefetch_items(
+        self,
+        context: Context | None,
+    ) -> t.Iterable:
+        """Return the fetched items of a partition, fetching other partitions ahead.
+
+        Args:
+            context: Stream partition or context dictionary.
+        """
+        partitions = self.partitions
+        if (
+            not context
+            or not partitions
+            or context not in partitions
+            or self.group_concurrency <= 1
+        ):
+            yield from self.fetch_group_items(context)
+            return
+
+        if self._prefetcher is None:
+            self._prefetcher = PartitionPrefetcher(
+                self.fetch_group_items,
+                partitions,
+                self.group_concurrency,
+            )
+        prefetcher = self._prefetcher
+        try:
+            yield from prefetcher.records(context)
+        except BaseException:
+            self._prefetcher = None
+            raise
+        if context == partitions[-1]:
+            self._prefetcher = None
+
+    def changed_records(
+        self,
+        records: t.Iterable[dict],
+        context: Context | None,
+    ) -> t.Iterable[dict]:
+        """Drop records whose metrics are the same as in the previous run.
+
+        Only applies to selected streams with :attr:`metric_fields` when
+        ``skip_unchanged_records`` is set. Fingerprints of the metrics are
+        kept per partition under ``cache_dir``. Once the partition has been
+        read completely they are handed to the tap, which saves them after
+        the next STATE message (see :meth:`TapVk.save_fingerprints`), so a
+        failed run emits the same rows again. Every ``full_refresh_days``
+        (or with ``full_refresh``) all records are emitted again.
+
+        Args:
+            records: Records of the partition.
+            context: Stream partition or context dictionary.
+        """
+        # Поток, выгружаемый только ради дочерних, ничего не отправляет
+        if not (
+            self.metric_fields
+            and self.selected
+            and self.config.get("skip_unchanged_records")
+        ):
+            yield from records
+            return
+
+        cache_dir = Path(self.config.get("cache_dir", DEFAULT_CACHE_DIR))
+        group_id = self.get_group_id(context)
+        store = FingerprintStore(
+            cache_dir / f"fingerprints_{self.name}_{group_id}.json"
+        )
+        full_refresh = self.config.get("full_refresh") or store.full_refresh_due(
+            float(self.config.get("full_refresh_days", DEFAULT_FULL_REFRESH_DAYS))
+        )
+        skipped = 0
+        for record in records:
+            key = "|".join(str(record.get(name)) for name in self.primary_keys or ())
+            if store.changed(key, record, self.metric_fields) or full_refresh:
+                yield record
+            else:
+                skipped += 1
+        self._tap.pending_fingerprints.append((store, full_refresh))
+        self.logger.info(
+            "Skipped %d unchanged records of group %d%s",
+            skipped,
+            group_id,
+            " (full refresh)" if full_refresh else "",
+        )
+
+    def fetch_group_items(
+        self,
+        context: Context | None,
+    ) -> t.Iterable:
+        """Return the items of a partition as fetched from VK (fetch stage).
+
+        By default these are already the records of :meth:`get_group_records`.
+
+        Args:
+            context: Stream partition or context dictionary.
+        """
+        return self.get_group_records(context)
+
+    def transform_items(
+        self,
+        items: t.Iterable,
+        context: Context | None,
+    ) -> t.Iterable[dict]:
+        """Shape fetched items into records (transform stage).
+
+        Args:
+            items: Items from :meth:`fetch_group_items`.
+            context: Stream partition or context dictionary.
+        """
+        return items
+
+    def get_group_records(
+        self,
+        context: Context | None,
     ) -> t.Iterable[dict]:
         """Return a generator of record-type dictionary objects.
 
@@ -34,15 +1174,9 @@ class VkStream(Stream):
         Raises:
             NotImplementedError: If the implementation is TODO
         """
-        # Ваш токен доступа
         params = self.config.get("params") or {}
-        token = params.get('token')
-        vk_session = VkApi(token=token)
-
-        # Получаем объект VK_API
-        vk = vk_session.get_api()
 
-        records = vk.groups.get(user_id=params.get('user_id'), filter='admin')
+        records = self.vk.groups.get(user_id=params.get("user_id"), filter="admin")
         #for record in records:
          #   yield record.to_dict()
         yield from extract_jsonpath(self.records_jsonpath, input=records)
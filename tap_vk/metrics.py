@@ -0,0 +1,251 @@
+"""Per-method instrumentation of VK API calls."""
+
+from __future__ import annotations
+
+import bisect
+import enum
+import os
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+from singer_sdk import metrics as sdk_metrics
+
+if t.TYPE_CHECKING:
+    import logging
+
+# Границы корзин гистограммы времени ответа, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_LOG_INTERVAL = sdk_metrics.DEFAULT_LOG_INTERVAL
+
+
+class VkMetric(str, enum.Enum):
+    """Metric names logged next to the SDK's own metrics."""
+
+    BATCHED_CALLS = "vk_api_batched_calls"
+    RETRIES = "vk_api_retries"
+    ERRORS = "vk_api_errors"
+    RESPONSE_BYTES = "vk_api_response_bytes"
+
+
+class MethodStats:
+    """Counters of one VK API method."""
+
+    __slots__ = (
+        "batched",
+        "buckets",
+        "bytes",
+        "errors",
+        "requests",
+        "retries",
+        "seconds",
+    )
+
+    def __init__(self) -> None:
+        """Create zeroed counters."""
+        self.requests = 0
+        self.batched = 0
+        self.retries = 0
+        self.errors: dict[int, int] = {}
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def quantile(self, share: float) -> float:
+        """Estimate a latency quantile from the histogram, in seconds."""
+        rank = share * self.requests
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+        return 0.0
+
+
+class ApiMetrics:
+    """Thread-safe per-method counters filled in by :class:`tap_vk.client.VkClient`.
+
+    Recording is a dictionary lookup and a few additions under a lock, so it
+    stays on for every run. The counters are written as Singer SDK metric
+    log lines every ``log_interval`` seconds and at the end of the run, and
+    can also be exported as a Prometheus textfile.
+    """
+
+    def __init__(
+            self,
+            *,
+            log_interval: float = DEFAULT_LOG_INTERVAL,
+            logger: logging.Logger | None = None,
+    ) -> None:
+        """Create empty counters.
+
+        Args:
+            log_interval: Seconds between periodic metric log lines, 0 to log
+                only on :meth:`log`.
+            logger: Logger for the metric lines, the SDK metrics logger by
+                default.
+        """
+        self.methods: dict[str, MethodStats] = {}
+        self.log_interval = log_interval
+        self.logger = logger or sdk_metrics.get_metrics_logger()
+        self._lock = threading.Lock()
+        self._last_log = time.monotonic()
+
+    def _stats(self, method: str) -> MethodStats:
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats()
+        return stats
+
+    def record_request(
+            self,
+            method: str,
+            seconds: float,
+            size: int,
+            error_code: int | None = None,
+    ) -> None:
+        """Register one HTTP request.
+
+        Args:
+            method: Method name, ``execute`` for batches.
+            seconds: Time until the response was read.
+            size: Response body size in bytes.
+            error_code: VK error code (or HTTP status) of a failed request.
+        """
+        with self._lock:
+            stats = self._stats(method)
+            stats.requests += 1
+            stats.bytes += size
+            stats.seconds += seconds
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            if error_code is not None:
+                stats.errors[error_code] = stats.errors.get(error_code, 0) + 1
+            elapsed = time.monotonic() - self._last_log
+            due = self.log_interval and elapsed >= self.log_interval
+        if due:
+            self.log()
+
+    def record_batched(self, method: str, error_code: int | None = None) -> None:
+        """Register a call sent inside ``execute``."""
+        with self._lock:
+            stats = self._stats(method)
+            stats.batched += 1
+            if error_code is not None:
+                stats.errors[error_code] = stats.errors.get(error_code, 0) + 1
+
+    def record_retry(self, method: str) -> None:
+        """Register a repeated call."""
+        with self._lock:
+            self._stats(method).retries += 1
+
+    def log(self) -> None:
+        """Write the counters accumulated so far as Singer metric lines."""
+        with self._lock:
+            self._last_log = time.monotonic()
+            snapshot = sorted(self.methods.items())
+            pid = os.getpid()
+            # Метрики тапа не входят в перечисление SDK, но пишутся так же
+            points: list[tuple[str, t.Any, t.Any, dict[str, t.Any]]] = []
+            for method, stats in snapshot:
+                tags: dict[str, t.Any] = {
+                    sdk_metrics.Tag.ENDPOINT: method,
+                    sdk_metrics.Tag.PID: pid,
+                }
+                if stats.requests:
+                    points.append((
+                        "counter",
+                        sdk_metrics.Metric.HTTP_REQUEST_COUNT,
+                        stats.requests,
+                        tags,
+                    ))
+                    points.append((
+                        "timer",
+                        sdk_metrics.Metric.HTTP_REQUEST_DURATION,
+                        {
+                            "sum": round(stats.seconds, 3),
+                            "p50": stats.quantile(0.5),
+                            "p90": stats.quantile(0.9),
+                            "p99": stats.quantile(0.99),
+                        },
+                        tags,
+                    ))
+                if stats.batched:
+                    points.append(
+                        ("counter", VkMetric.BATCHED_CALLS, stats.batched, tags)
+                    )
+                if stats.retries:
+                    points.append(("counter", VkMetric.RETRIES, stats.retries, tags))
+                for code, count in sorted(stats.errors.items()):
+                    error_tags = {**tags, "error_code": code}
+                    points.append(("counter", VkMetric.ERRORS, count, error_tags))
+                if stats.bytes:
+                    points.append(
+                        ("counter", VkMetric.RESPONSE_BYTES, stats.bytes, tags)
+                    )
+        for metric_type, metric, value, tags in points:
+            point = sdk_metrics.Point(metric_type, metric, value, tags)
+            sdk_metrics.log(self.logger, point)
+
+    def render_prometheus(self, prefix: str = "tap_vk_api") -> str:
+        """Return the counters in the Prometheus text exposition format."""
+        lines: list[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> str:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            return f"{prefix}_{name}"
+
+        with self._lock:
+            snapshot = sorted(self.methods.items())
+
+            name = family(
+                "requests_total", "counter", "HTTP requests to the VK API by method."
+            )
+            lines.extend(f'{name}{{method="{m}"}} {s.requests}' for m, s in snapshot)
+            name = family(
+                "batched_calls_total", "counter", "Calls sent inside execute by method."
+            )
+            lines.extend(
+                f'{name}{{method="{m}"}} {s.batched}' for m, s in snapshot if s.batched
+            )
+            name = family(
+                "retries_total", "counter", "Calls repeated after throttling by method."
+            )
+            lines.extend(f'{name}{{method="{m}"}} {s.retries}' for m, s in snapshot)
+            name = family(
+                "errors_total", "counter", "VK API errors by method and error code."
+            )
+            lines.extend(
+                f'{name}{{method="{m}",code="{code}"}} {count}'
+                for m, s in snapshot
+                for code, count in sorted(s.errors.items())
+            )
+            name = family(
+                "response_bytes_total", "counter", "Response body bytes by method."
+            )
+            lines.extend(f'{name}{{method="{m}"}} {s.bytes}' for m, s in snapshot)
+            name = family(
+                "request_duration_seconds",
+                "histogram",
+                "VK API response time by method.",
+            )
+            for method, stats in snapshot:
+                if not stats.requests:
+                    continue
+                cumulative = 0
+                label = f'method="{method}"'
+                for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), stats.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{label}}} {stats.seconds:.6f}")
+                lines.append(f"{name}_count{{{label}}} {stats.requests}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str | os.PathLike) -> None:
+        """Write :meth:`render_prometheus` to a node_exporter textfile atomically."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(self.render_prometheus(), encoding="utf-8")
+        tmp_path.replace(path)
@@ -0,0 +1,121 @@
+"""Buffered Singer message writer serializing records with orjson."""
+
+from __future__ import annotations
+
+import decimal
+import json
+import sys
+import threading
+import typing as t
+
+from singer_sdk._singerlib import RecordMessage, StateMessage
+from singer_sdk._singerlib.json import serialize_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None  # type: ignore[assignment]
+
+if t.TYPE_CHECKING:
+    from singer_sdk._singerlib import Message
+
+DEFAULT_OUTPUT_BUFFER_KB = 256
+
+
+def _default(obj: t.Any) -> t.Any:  # noqa: ANN401
+    """Encode values JSON has no type for, the way the SDK does."""
+    if isinstance(obj, decimal.Decimal):
+        if orjson is not None and hasattr(orjson, "Fragment"):
+            # Число без потери точности, как simplejson(use_decimal=True) в SDK
+            return orjson.Fragment(str(obj))
+        return float(obj)
+    return obj.isoformat(sep="T") if hasattr(obj, "isoformat") else str(obj)
+
+
+if orjson is not None:
+    def dumps(obj: t.Any) -> bytes:  # noqa: ANN401
+        """Serialize ``obj`` to compact UTF-8 JSON."""
+        return orjson.dumps(obj, default=_default)
+else:
+    _encoder = json.JSONEncoder(
+        separators=(",", ":"), ensure_ascii=False, default=_default
+    )
+
+    def dumps(obj: t.Any) -> bytes:  # noqa: ANN401
+        """Serialize ``obj`` to compact UTF-8 JSON."""
+        return _encoder.encode(obj).encode("utf-8")
+
+
+class MessageWriter:
+    """Writes Singer messages to stdout in large buffered chunks.
+
+    RECORD messages are assembled from a pre-encoded
+    ``{"type":"RECORD","stream":"<name>","record":`` prefix and the record
+    serialized with :func:`dumps` (orjson when installed, the standard
+    library otherwise). Other messages are serialized by the SDK. The buffer
+    is written out when it grows over ``buffer_size`` bytes, after every
+    STATE message (so that targets can checkpoint) and on :meth:`flush`.
+    """
+
+    def __init__(self, buffer_size: int = DEFAULT_OUTPUT_BUFFER_KB * 1024) -> None:
+        """Create the writer.
+
+        Args:
+            buffer_size: Number of bytes collected before they are written.
+        """
+        self.buffer_size = buffer_size
+        self._buffer = bytearray()
+        self._prefixes: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _prefix(self, stream: str) -> bytes:
+        prefix = self._prefixes.get(stream)
+        if prefix is None:
+            prefix = self._prefixes[stream] = (
+                b'{"type":"RECORD","stream":' + dumps(stream) + b',"record":'
+            )
+        return prefix
+
+    def serialize(self, message: Message) -> bytes:
+        """Return one message as a line of JSON, with the trailing newline."""
+        if type(message) is RecordMessage:
+            line = self._prefix(message.stream) + dumps(message.record)
+            if message.version is not None:
+                line += b',"version":' + dumps(message.version)
+            if message.time_extracted is not None:
+                line += b',"time_extracted":' + dumps(message.time_extracted)
+            return line + b"}\n"
+        return serialize_json(message.to_dict()).encode("utf-8") + b"\n"
+
+    def write(self, message: Message) -> None:
+        """Add a message to the buffer, writing the buffer out when full."""
+        line = self.serialize(message)
+        with self._lock:
+            self._buffer += line
+            full = len(self._buffer) >= self.buffer_size
+            if not full and not isinstance(message, StateMessage):
+                return
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            self._write(data)
+
+    def flush(self) -> None:
+        """Write out everything buffered so far."""
+        with self._lock:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            if data:
+                self._write(data)
+
+    @staticmethod
+    def _write(data: bytes) -> None:
+        # sys.stdout ищется при каждой записи: тесты подменяют его на StringIO
+        stdout = sys.stdout
+        binary = getattr(stdout, "buffer", None)
+        if binary is not None:
+            stdout.flush()
+            binary.write(data)
+            binary.flush()
+        else:
+            stdout.write(data.decode("utf-8"))
+            stdout.flush()
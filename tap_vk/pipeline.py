@@ -0,0 +1,264 @@
+"""Staged record pipeline: fetch, transform and emit overlapped in threads."""
+
+from __future__ import annotations
+
+import enum
+import os
+import queue
+import threading
+import time
+import typing as t
+
+from singer_sdk import metrics as sdk_metrics
+
+if t.TYPE_CHECKING:
+    import logging
+
+DEFAULT_PIPELINE_QUEUE_SIZE = 1000
+# Элементы передаются между стадиями пачками: одна операция с очередью
+# на пачку вместо каждой записи
+CHUNK_SIZE = 100
+CHUNK_MAX_DELAY = 0.05
+
+_ITEM, _DONE, _ERROR = range(3)
+
+
+class PipelineMetric(str, enum.Enum):
+    """Metric names of the pipeline stages."""
+
+    ITEMS = "vk_pipeline_items"
+    BUSY = "vk_pipeline_busy_seconds"
+    BLOCKED = "vk_pipeline_blocked_seconds"
+    STARVED = "vk_pipeline_starved_seconds"
+    QUEUE_DEPTH = "vk_pipeline_queue_depth"
+
+
+class StageStats:
+    """Occupancy of one pipeline stage.
+
+    ``busy`` is the time spent on the stage's own work, ``starved`` the time
+    waiting for the previous stage and ``blocked`` the time waiting for room
+    in the next stage's queue (backpressure). The slowest stage is the one
+    that is busy while its neighbours are starved or blocked.
+    """
+
+    __slots__ = (
+        "blocked",
+        "busy",
+        "depth_max",
+        "depth_sum",
+        "items",
+        "name",
+        "received",
+        "starved",
+    )
+
+    def __init__(self, name: str) -> None:
+        """Create zeroed counters."""
+        self.name = name
+        self.received = 0
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.starved = 0.0
+        # Глубина входной очереди в пачках, замеряется при каждом get
+        self.depth_sum = 0
+        self.depth_max = 0
+
+    @property
+    def depth_avg(self) -> float:
+        """Average number of chunks waiting in the stage's input queue."""
+        return self.depth_sum / self.received if self.received else 0.0
+
+
+class Pipeline:
+    """Chain of generator stages running in their own threads.
+
+    The first stage is an iterable (usually VK pages being fetched), every
+    next stage is a function taking the iterator of the previous stage's
+    items and yielding its own. Stages are linked by bounded queues, so a
+    fast stage blocks instead of piling up items, and the caller iterating
+    the pipeline is the last (emit) stage. Items travel in chunks of up to
+    :data:`CHUNK_SIZE`, a chunk is handed over early if the stage has been
+    collecting it for :data:`CHUNK_MAX_DELAY` seconds. Errors are re-raised in the
+    caller; if the caller stops early the stages are stopped too.
+    """
+
+    def __init__(  # noqa: PLR0913
+            self,
+            name: str,
+            source: t.Iterable,
+            stages: t.Sequence[tuple[str, t.Callable[[t.Iterator], t.Iterable]]] = (),
+            *,
+            source_name: str = "fetch",
+            queue_size: int = DEFAULT_PIPELINE_QUEUE_SIZE,
+            stats: t.Sequence[StageStats] | None = None,
+    ) -> None:
+        """Create the pipeline, threads are started on iteration.
+
+        Args:
+            name: Name used in metrics, usually the stream name.
+            source: Items of the first stage.
+            stages: ``(name, function)`` of the following stages.
+            source_name: Name of the first stage.
+            queue_size: Maximum number of items between two stages,
+                rounded up to whole chunks.
+            stats: Counters to add the occupancy to, one per stage plus the
+                emit stage, so that consecutive pipelines of a stream are
+                reported together. New counters by default.
+        """
+        self.name = name
+        self.source = source
+        self.stages = list(stages)
+        self.source_name = source_name
+        self.queue_size = queue_size
+        self.queue_chunks = max(-(-queue_size // CHUNK_SIZE), 1)
+        self.stats = list(stats) if stats is not None else self.new_stats(
+            [source_name, *(stage for stage, _ in self.stages)]
+        )
+        self._stop = threading.Event()
+
+    @staticmethod
+    def new_stats(stages: t.Sequence[str]) -> list[StageStats]:
+        """Return zeroed counters of ``stages`` followed by the emit stage."""
+        return [StageStats(stage) for stage in (*stages, "emit")]
+
+    def _put(
+            self,
+            out: queue.Queue,
+            item: tuple[int, t.Any],
+            stats: StageStats,
+    ) -> bool:
+        started = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    out.put(item, timeout=0.5)
+                except queue.Full:
+                    continue
+                return True
+            return False
+        finally:
+            stats.blocked += time.perf_counter() - started
+
+    def _drain(self, inbox: queue.Queue, stats: StageStats) -> t.Iterator:
+        """Yield the items of the previous stage, counting the time waited."""
+        while True:
+            started = time.perf_counter()
+            depth = inbox.qsize()
+            try:
+                kind, value = inbox.get(timeout=0.5)
+            except queue.Empty:
+                stats.starved += time.perf_counter() - started
+                if self._stop.is_set():
+                    return
+                continue
+            stats.starved += time.perf_counter() - started
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            stats.received += 1
+            stats.depth_sum += depth
+            stats.depth_max = max(stats.depth_max, depth)
+            yield from value
+
+    def _run(self, items: t.Iterable, out: queue.Queue, stats: StageStats) -> None:
+        iterator = iter(items)
+        chunk: list = []
+        chunk_started = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                starved = stats.starved
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    now = time.perf_counter()
+                    stats.busy += now - started - (stats.starved - starved)
+                stats.items += 1
+                if not chunk:
+                    chunk_started = now
+                chunk.append(item)
+                if len(chunk) >= CHUNK_SIZE or now - chunk_started >= CHUNK_MAX_DELAY:
+                    if not self._put(out, (_ITEM, chunk), stats):
+                        return
+                    chunk = []
+            if chunk and not self._put(out, (_ITEM, chunk), stats):
+                return
+            self._put(out, (_DONE, None), stats)
+        except Exception as exc:  # noqa: BLE001
+            self._put(out, (_ERROR, exc), stats)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def __iter__(self) -> t.Iterator:
+        """Start the stages and yield the items of the last one."""
+        inbox: queue.Queue = queue.Queue(maxsize=self.queue_chunks)
+        threading.Thread(
+            target=self._run,
+            args=(self.source, inbox, self.stats[0]),
+            name=f"{self.name}-{self.source_name}",
+            daemon=True,
+        ).start()
+        for (stage, function), stats in zip(self.stages, self.stats[1:]):
+            out: queue.Queue = queue.Queue(maxsize=self.queue_chunks)
+            threading.Thread(
+                target=self._run,
+                args=(function(self._drain(inbox, stats)), out, stats),
+                name=f"{self.name}-{stage}",
+                daemon=True,
+            ).start()
+            inbox = out
+
+        emit = self.stats[-1]
+        try:
+            for item in self._drain(inbox, emit):
+                emit.items += 1
+                # Время между выдачей записей уходит на валидацию и запись в stdout
+                yielded = time.perf_counter()
+                yield item
+                emit.busy += time.perf_counter() - yielded
+        finally:
+            self._stop.set()
+
+
+def log_stage_stats(
+        name: str,
+        stats: t.Iterable[StageStats],
+        queue_size: int,
+        logger: logging.Logger | None = None,
+) -> None:
+    """Write the occupancy of pipeline stages as Singer metric lines.
+
+    Args:
+        name: Stream name.
+        stats: Counters of the stages.
+        queue_size: Capacity of the queues between the stages, in chunks.
+        logger: Logger for the metric lines, the SDK metrics logger by default.
+    """
+    logger = logger or sdk_metrics.get_metrics_logger()
+    for stage in stats:
+        tags = {"stream": name, "stage": stage.name, sdk_metrics.Tag.PID: os.getpid()}
+        points: list[tuple[str, t.Any, t.Any]] = [
+            ("counter", PipelineMetric.ITEMS, stage.items),
+            ("timer", PipelineMetric.BUSY, round(stage.busy, 3)),
+            ("timer", PipelineMetric.BLOCKED, round(stage.blocked, 3)),
+            ("timer", PipelineMetric.STARVED, round(stage.starved, 3)),
+            (
+                "histogram",
+                PipelineMetric.QUEUE_DEPTH,
+                {
+                    "avg": round(stage.depth_avg, 1),
+                    "max": stage.depth_max,
+                    "size": queue_size,
+                },
+            ),
+        ]
+        for metric_type, metric, value in points:
+            point = sdk_metrics.Point(metric_type, metric, value, tags)
+            sdk_metrics.log(logger, point)
@@ -0,0 +1,209 @@
+"""Token-bucket rate limiting for VK API calls."""
+
+from __future__ import annotations
+
+import threading
+import time
+import typing as t
+
+# Коды ошибок VK, после которых запрос имеет смысл повторить
+TOO_MANY_RPS_CODE = 6
+FLOOD_CONTROL_CODE = 9
+RATE_LIMIT_CODE = 29
+THROTTLING_CODES = frozenset({TOO_MANY_RPS_CODE, FLOOD_CONTROL_CODE, RATE_LIMIT_CODE})
+
+# Лимиты VK на количество запросов в секунду для разных типов токенов
+DEFAULT_RATES = {
+    "user": 3.0,
+    "community": 20.0,
+    "service": 20.0,
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket with an adjustable refill rate.
+
+    The bucket may go into debt: :meth:`acquire` always takes a token and then
+    sleeps for as long as it takes to pay the debt back, so concurrent callers
+    are spread evenly over time instead of racing for the next token.
+    """
+
+    def __init__(
+            self,
+            rate: float,
+            *,
+            capacity: float | None = None,
+            min_rate: float | None = None,
+            clock: t.Callable[[], float] = time.monotonic,
+            sleep: t.Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Create a full bucket.
+
+        Args:
+            rate: Maximum (and initial) number of tokens added per second.
+            capacity: Bucket size, defaults to ``rate`` (one second of burst).
+            min_rate: Lowest rate :meth:`slow_down` may go to.
+            clock: Monotonic clock, replaceable in tests.
+            sleep: Sleep function, replaceable in tests.
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        refilled = self.tokens + (now - self._updated) * self.rate
+        self.tokens = min(self.capacity, refilled)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until it is available.
+
+        Returns:
+            Number of seconds spent waiting.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def slow_down(self, factor: float = 0.5) -> None:
+        """Multiply the rate by ``factor`` and drop any accumulated burst."""
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * factor)
+            self.tokens = min(self.tokens, 0.0)
+
+    def speed_up(self, step: float) -> None:
+        """Increase the rate by ``step`` up to the initial rate."""
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + step)
+
+
+class RateLimiter:
+    """Process-wide limiter with buckets per access token and method family.
+
+    Every call takes a token from the bucket of its access token (VK's
+    requests per second limit, set by the token type) and from the bucket of
+    its method family (``wall``, ``stats``, ...) for that access token. The
+    rates back off multiplicatively when VK reports throttling and recover
+    additively after a run of successful calls.
+    """
+
+    def __init__(
+            self,
+            rates: dict[str, float] | None = None,
+            *,
+            family_rates: dict[str, float] | None = None,
+            recovery_after: int = 50,
+    ) -> None:
+        """Create a limiter.
+
+        Args:
+            rates: Requests per second per token type.
+            family_rates: Requests per second per method family. Families not
+                listed here are limited by the token type rate only.
+            recovery_after: Number of consecutive successes before a bucket
+                rate is raised again.
+        """
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        self.family_rates = dict(family_rates or {})
+        self.recovery_after = recovery_after
+        self._buckets: dict[tuple[str, str | None, str | None], TokenBucket] = {}
+        self._successes: dict[tuple[str, str | None, str | None], int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def family(method: str) -> str:
+        """Return the method family, e.g. ``wall`` for ``wall.getComments``."""
+        return method.split(".", 1)[0]
+
+    def bucket(
+            self,
+            token_type: str,
+            family: str | None = None,
+            token: str | None = None,
+    ) -> TokenBucket:
+        """Return (creating if needed) the bucket for a token or method family.
+
+        Args:
+            token_type: Token type, one of :data:`DEFAULT_RATES` keys.
+            family: Method family, or ``None`` for the token bucket.
+            token: Key of the access token (not the token itself), ``None``
+                to share the buckets between all tokens of the type.
+        """
+        key = (token_type, token, family)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                rate = self.rates.get(token_type, DEFAULT_RATES["user"])
+                if family is not None:
+                    rate = self.family_rates.get(family, rate)
+                bucket = self._buckets[key] = TokenBucket(rate)
+            return bucket
+
+    def _buckets_for(
+            self,
+            token_type: str,
+            method: str,
+            token: str | None,
+    ) -> list[TokenBucket]:
+        return [
+            self.bucket(token_type, token=token),
+            self.bucket(token_type, self.family(method), token),
+        ]
+
+    def acquire(self, token_type: str, method: str, token: str | None = None) -> float:
+        """Wait until a call to ``method`` is allowed.
+
+        Returns:
+            Number of seconds spent waiting.
+        """
+        buckets = self._buckets_for(token_type, method, token)
+        return sum(bucket.acquire() for bucket in buckets)
+
+    def on_success(
+            self,
+            token_type: str,
+            method: str,
+            token: str | None = None,
+    ) -> None:
+        """Register a successful call and raise the rates after a streak."""
+        family = self.family(method)
+        for key in ((token_type, token, None), (token_type, token, family)):
+            with self._lock:
+                count = self._successes.get(key, 0) + 1
+                recovered = count >= self.recovery_after
+                self._successes[key] = 0 if recovered else count
+            if recovered:
+                bucket = self.bucket(key[0], key[2], key[1])
+                bucket.speed_up(bucket.max_rate / 10)
+
+    def on_error(
+            self,
+            token_type: str,
+            method: str,
+            code: int,
+            token: str | None = None,
+    ) -> None:
+        """Lower the rate of the bucket responsible for a throttling error.
+
+        Error 6 is a per-token limit, errors 9 and 29 are per method.
+        """
+        family = None if code == TOO_MANY_RPS_CODE else self.family(method)
+        with self._lock:
+            self._successes[(token_type, token, family)] = 0
+        self.bucket(token_type, family, token).slow_down()
+
+
+rate_limiter = RateLimiter()
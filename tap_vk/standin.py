@@ -0,0 +1,583 @@
+"""Local stand-in for the VK API serving synthetic data.
+
+The server answers the methods used by the tap's streams with deterministic
+payloads, so every stream can be run end to end without network access or
+a real token. Latency and throttling errors can be injected to exercise the
+rate limiter and the retry logic::
+
+    python -m tap_vk.standin --port 8090 --latency 0.05 --error-rate 0.01
+
+and then run the tap with ``"api_url": "http://127.0.0.1:8090/method/"``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import typing as t
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+if t.TYPE_CHECKING:
+    from typing_extensions import Self
+
+DAY = 24 * 60 * 60
+
+_API_CALL = re.compile(r"API\.([\w.]+)\(")
+
+
+class StandInError(Exception):
+    """VK API error returned by a synthetic method."""
+
+    def __init__(self, code: int, message: str) -> None:
+        """Create the error.
+
+        Args:
+            code: VK error code.
+            message: VK error message.
+        """
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def to_dict(self, method: str, params: dict) -> dict:
+        """Return the error object VK would send."""
+        return {
+            "error_code": self.code,
+            "error_msg": self.message,
+            "method": method,
+            "request_params": [{"key": k, "value": str(v)} for k, v in params.items()],
+        }
+
+
+def _ids(value: t.Any) -> list[str]:  # noqa: ANN401
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return [item for item in str(value).split(",") if item]
+
+
+def _page(items: list, params: dict, default_count: int = 100) -> list:
+    offset = int(params.get("offset", 0))
+    count = int(params.get("count", default_count))
+    return items[offset:offset + count]
+
+
+class SyntheticVk:
+    """Deterministic VK data for the methods used by the tap.
+
+    Every community has the same shape: ``posts`` wall posts one
+    ``post_interval`` apart, ``comments`` top-level comments per post with
+    ``replies`` replies each, ``stories`` stories and daily statistics with
+    ``cities`` cities per day.
+    """
+
+    def __init__(  # noqa: PLR0913
+            self,
+            *,
+            posts: int = 100,
+            comments: int = 3,
+            replies: int = 2,
+            stories: int = 10,
+            cities: int = 5,
+            post_interval: int = 60 * 60,
+            missing_posts: t.Iterable[int] = (),
+            missing_stories: t.Iterable[int] = (),
+            comment_errors: t.Mapping[int, int] | None = None,
+            thread_errors: t.Mapping[int, int] | None = None,
+            now: int | None = None,
+    ) -> None:
+        """Configure the data set.
+
+        Args:
+            posts: Wall posts per community.
+            comments: Top-level comments per post.
+            replies: Replies per top-level comment.
+            stories: Active stories per community.
+            cities: Cities in every daily statistics breakdown.
+            post_interval: Seconds between two posts.
+            missing_posts: Post IDs ``stats.getPostReach`` fails for, like
+                for deleted posts.
+            missing_stories: Story IDs ``stories.getById`` fails for.
+            comment_errors: Error codes ``wall.getComments`` returns for the
+                comments of a post, by post ID.
+            thread_errors: Error codes ``wall.getComments`` returns for the
+                replies of a comment, by comment ID.
+            now: Unix time of the newest post, defaults to the current time.
+        """
+        self.posts = posts
+        self.comments = comments
+        self.replies = replies
+        self.stories = stories
+        self.cities = cities
+        self.post_interval = post_interval
+        self.missing_posts = frozenset(missing_posts)
+        self.missing_stories = frozenset(missing_stories)
+        self.comment_errors = dict(comment_errors or {})
+        self.thread_errors = dict(thread_errors or {})
+        self.now = int(time.time()) if now is None else now
+        self.methods: dict[str, t.Callable[[dict], t.Any]] = {
+            "groups.getById": self.groups_get_by_id,
+            "users.get": self.users_get,
+            "wall.get": self.wall_get,
+            "wall.getComments": self.wall_get_comments,
+            "stats.get": self.stats_get,
+            "stats.getPostReach": self.stats_get_post_reach,
+            "stories.get": self.stories_get,
+            "stories.getById": self.stories_get_by_id,
+            "stories.getStats": self.stories_get_stats,
+        }
+
+    def call(self, method: str, params: dict) -> t.Any:  # noqa: ANN401
+        """Return the ``response`` of a method call.
+
+        Raises:
+            StandInError: If the method is unknown or the call is invalid.
+        """
+        handler = self.methods.get(method)
+        if handler is None:
+            raise StandInError(3, "Unknown method passed")
+        return handler(params)
+
+    def post(self, owner_id: int, post_id: int) -> dict:
+        """Return wall post ``post_id``; higher IDs are newer."""
+        return {
+            "id": post_id,
+            "owner_id": owner_id,
+            "from_id": owner_id,
+            "date": self.now - (self.posts - post_id) * self.post_interval,
+            "inner_type": "wall_wallpost",
+            "type": "post",
+            "text": f"Post {post_id}",
+            "comments": {"count": self.comments * (1 + self.replies)},
+            "likes": {"count": post_id % 50},
+        }
+
+    def comment(self, post: dict, comment_id: int, parent_id: int = 0) -> dict:
+        """Return a comment of ``post``."""
+        # Каждый седьмой комментарий оставлен от имени сообщества
+        if comment_id % 7 == 0:
+            author_id = -(1 + comment_id % 5)
+        else:
+            author_id = 1000 + comment_id % 97
+        comment = {
+            "id": comment_id,
+            "from_id": author_id,
+            "date": post["date"] + comment_id % 1000,
+            "text": f"Comment {comment_id}",
+            "likes": {"count": comment_id % 7},
+        }
+        if parent_id:
+            comment["reply_to_comment"] = parent_id
+            comment["reply_to_user"] = 1000 + parent_id % 97
+        return comment
+
+    def story(self, owner_id: int, story_id: int) -> dict:
+        """Return story ``story_id``; higher IDs are newer."""
+        date = self.now - (self.stories - story_id) * 600
+        return {
+            "id": story_id,
+            "owner_id": owner_id,
+            "date": date,
+            "expires_at": date + DAY,
+            "type": "photo",
+            "track_code": f"track-{story_id}",
+            "likes_count": story_id % 11,
+        }
+
+    def groups_get_by_id(self, params: dict) -> list[dict]:
+        """Answer ``groups.getById``."""
+        group_ids = _ids(params.get("group_ids") or params.get("group_id") or "1")
+        return [
+            {
+                "id": abs(int(group_id)),
+                "name": f"Community {abs(int(group_id))}",
+                "screen_name": f"club{abs(int(group_id))}",
+                "is_closed": 0,
+                "type": "group",
+                "members_count": 1000 * abs(int(group_id)),
+            }
+            for group_id in group_ids
+        ]
+
+    def users_get(self, params: dict) -> list[dict]:
+        """Answer ``users.get``."""
+        return [
+            {
+                "id": int(user_id),
+                "first_name": f"User{user_id}",
+                "last_name": f"Test{user_id}",
+                "screen_name": f"id{user_id}",
+                "is_closed": int(user_id) % 2 == 0,
+                "can_access_closed": True,
+            }
+            for user_id in _ids(params.get("user_ids", ""))
+        ]
+
+    def wall_get(self, params: dict) -> dict:
+        """Answer ``wall.get``, newest posts first."""
+        owner_id = int(params["owner_id"])
+        post_ids = list(range(self.posts, 0, -1))
+        return {
+            "count": self.posts,
+            "items": [
+                self.post(owner_id, post_id) for post_id in _page(post_ids, params)
+            ],
+        }
+
+    def wall_get_comments(self, params: dict) -> dict:
+        """Answer ``wall.getComments`` for posts and for comment threads."""
+        owner_id = int(params["owner_id"])
+        post_id = int(params["post_id"])
+        if not 0 < post_id <= self.posts:
+            msg = "One of the parameters specified was missing or invalid"
+            raise StandInError(100, msg)
+        post = self.post(owner_id, post_id)
+
+        def replies_of(parent_id: int) -> list[dict]:
+            return [
+                self.comment(post, parent_id + number, parent_id)
+                for number in range(1, self.replies + 1)
+            ]
+
+        if params.get("comment_id"):
+            comment_id = int(params["comment_id"])
+            if comment_id in self.thread_errors:
+                msg = f"Replies of comment {comment_id} are unavailable"
+                raise StandInError(self.thread_errors[comment_id], msg)
+            replies = replies_of(comment_id)
+            return {"count": len(replies), "items": _page(replies, params)}
+
+        if post_id in self.comment_errors:
+            msg = f"Comments of post {post_id} are unavailable"
+            raise StandInError(self.comment_errors[post_id], msg)
+        thread_items = int(params.get("thread_items_count", 0))
+        comment_ids = [
+            post_id * 10000 + number * 100 for number in range(self.comments)
+        ]
+        items = []
+        for comment_id in _page(comment_ids, params):
+            comment = self.comment(post, comment_id)
+            comment["thread"] = {
+                "count": self.replies,
+                "items": replies_of(comment_id)[:thread_items],
+            }
+            items.append(comment)
+        return {"count": len(comment_ids), "items": items}
+
+    def stats_get(self, params: dict) -> list[dict]:
+        """Answer ``stats.get`` with one entry per day."""
+        timestamp_from = int(params.get("timestamp_from", self.now - DAY))
+        timestamp_to = int(params.get("timestamp_to", self.now))
+        days = []
+        for period_from in range(timestamp_from, timestamp_to + 1, DAY):
+            day = (period_from // DAY) % 100
+
+            def breakdown(day: int = day) -> dict:
+                return {
+                    "age": [
+                        {"value": "18-21", "count": day + 1},
+                        {"value": "21-24", "count": day + 2},
+                    ],
+                    "cities": [
+                        {"name": f"City {n}", "city_id": n, "count": day + n}
+                        for n in range(self.cities)
+                    ],
+                    "countries": [{"name": "Россия", "code": "RU", "count": day + 10}],
+                    "sex": [
+                        {"value": "f", "count": day + 3},
+                        {"value": "m", "count": day + 4},
+                    ],
+                }
+
+            days.append({
+                "period_from": period_from,
+                "period_to": period_from + DAY,
+                "activity": {"comments": day % 5, "likes": day, "subscribed": day % 3},
+                "reach": {
+                    "mobile_reach": day * 2,
+                    "reach": day * 3,
+                    "reach_subscribers": day,
+                    **breakdown(),
+                },
+                "visitors": {
+                    "mobile_views": day * 4,
+                    "views": day * 6,
+                    "visitors": day * 5,
+                    **breakdown(),
+                },
+            })
+        return days
+
+    def stats_get_post_reach(self, params: dict) -> list[dict]:
+        """Answer ``stats.getPostReach``, failing if any post is missing."""
+        post_ids = _ids(params["post_ids"])
+        if any(int(post_id) in self.missing_posts for post_id in post_ids):
+            msg = "One of the parameters specified was missing or invalid: post_ids"
+            raise StandInError(100, msg)
+        return [
+            {
+                "post_id": int(post_id),
+                "hide": 0,
+                "join_group": int(post_id) % 3,
+                "links": int(post_id) % 4,
+                "reach_subscribers": int(post_id) * 10,
+                "reach_total": int(post_id) * 15,
+                "reach_viral": int(post_id) * 5,
+                "reach_ads": 0,
+                "report": 0,
+                "to_group": int(post_id) % 2,
+                "unsubscribe": 0,
+            }
+            for post_id in post_ids
+        ]
+
+    def stories_get(self, params: dict) -> dict:
+        """Answer ``stories.get`` in the grouped 5.92 format."""
+        owner_id = int(params.get("owner_id", 0))
+        stories = [
+            self.story(owner_id, story_id) for story_id in range(1, self.stories + 1)
+        ]
+        return {"count": 1 if stories else 0, "items": [stories] if stories else []}
+
+    def stories_get_by_id(self, params: dict) -> dict:
+        """Answer ``stories.getById`` for ``owner_story`` IDs."""
+        items = []
+        for full_id in _ids(params["stories"]):
+            owner_id, story_id = (int(part) for part in full_id.split("_"))
+            if story_id in self.missing_stories:
+                msg = "One of the parameters specified was missing or invalid: stories"
+                raise StandInError(100, msg)
+            items.append(self.story(owner_id, story_id))
+        return {"count": len(items), "items": items}
+
+    def stories_get_stats(self, params: dict) -> dict:
+        """Answer ``stories.getStats``."""
+        story_id = int(params["story_id"])
+        counters = (
+            "views", "replies", "answer", "shares", "subscribers", "bans", "open_link",
+        )
+        return {
+            name: {"state": "on", "count": story_id * (position + 1)}
+            for position, name in enumerate(counters)
+        }
+
+
+class VkStandIn:
+    """Threaded HTTP server speaking the VK API protocol.
+
+    ``execute`` requests are supported for code made of ``API.method({...})``
+    calls, which is what :class:`tap_vk.client.VkBatch` sends.
+    """
+
+    def __init__(  # noqa: PLR0913
+            self,
+            data: SyntheticVk | None = None,
+            *,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            error_code: int = 6,
+            revoked_tokens: t.Iterable[str] = (),
+            seed: int = 0,
+    ) -> None:
+        """Create the server, it starts listening on :meth:`start`.
+
+        Args:
+            data: Synthetic data set, defaults to :class:`SyntheticVk`.
+            host: Interface to listen on.
+            port: Port to listen on, 0 picks a free one.
+            latency: Seconds every HTTP request is delayed by.
+            error_rate: Probability of answering a call with ``error_code``.
+            error_code: VK error code injected, 6 (too many requests) by default.
+            revoked_tokens: Access tokens answered with error 5
+                (authorization failed).
+            seed: Seed of the error injection.
+        """
+        self.data = data or SyntheticVk()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.revoked_tokens = frozenset(revoked_tokens)
+        self.calls: Counter[str] = Counter()
+        # Вызовы по (методу, сообществу) для проверок инкрементальной выгрузки
+        self.group_calls: Counter[tuple[str, int]] = Counter()
+        self.tokens: Counter[str] = Counter()
+        self.requests = 0
+        self._random = random.Random(seed)  # noqa: S311
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to use as the tap's ``api_url``."""
+        host, port = self._server.socket.getsockname()[:2]
+        return f"http://{host}:{port}/method/"
+
+    def __enter__(self) -> Self:
+        """Start the server."""
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:  # noqa: ANN001
+        """Stop the server."""
+        self.stop()
+
+    def start(self) -> Self:
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve requests in the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _inject_error(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def call(self, method: str, params: dict) -> dict:
+        """Return the full response (``response`` or ``error``) of one call."""
+        owner_id = params.get("owner_id") or params.get("group_id")
+        with self._lock:
+            self.calls[method] += 1
+            if owner_id:
+                self.group_calls[method, abs(int(owner_id))] += 1
+        if self._inject_error():
+            error = StandInError(self.error_code, "Too many requests per second")
+            return {"error": error.to_dict(method, params)}
+        try:
+            return {"response": self.data.call(method, params)}
+        except StandInError as error:
+            return {"error": error.to_dict(method, params)}
+
+    def execute(self, params: dict) -> dict:
+        """Run the ``API.*`` calls of an ``execute`` request."""
+        with self._lock:
+            self.calls["execute"] += 1
+        if self._inject_error():
+            error = StandInError(self.error_code, "Too many requests per second")
+            return {"error": error.to_dict("execute", params)}
+        decoder = json.JSONDecoder()
+        code = params.get("code", "")
+        results = []
+        errors = []
+        for match in _API_CALL.finditer(code):
+            values, _ = decoder.raw_decode(code, match.end())
+            response = self.call(match.group(1), values)
+            if "error" in response:
+                results.append(False)
+                errors.append(response["error"])
+            else:
+                results.append(response["response"])
+        answer: dict = {"response": results}
+        if errors:
+            answer["execute_errors"] = errors
+        return answer
+
+    def handle(self, method: str, params: dict) -> dict:
+        """Answer one HTTP request."""
+        token = params.get("access_token", "")
+        with self._lock:
+            self.requests += 1
+            self.tokens[token] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if token in self.revoked_tokens:
+            error = StandInError(
+                5,
+                "User authorization failed: "
+                "access_token was given to another ip address",
+            )
+            return {"error": error.to_dict(method, params)}
+        if method == "execute":
+            return self.execute(params)
+        return self.call(method, params)
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Заголовки и тело уходят отдельными write, без этого каждый
+            # ответ ждёт delayed ACK клиента (~40 мс)
+            disable_nagle_algorithm = True
+
+            def do_POST(self) -> None:  # noqa: N802
+                length = int(self.headers.get("Content-Length", 0))
+                query = self.rfile.read(length).decode("utf-8")
+                params = dict(parse_qsl(query, keep_blank_values=True))
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                response = standin.handle(method, params)
+                body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: t.Any) -> None:  # noqa: A002
+                pass
+
+        return Handler
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the stand-in server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per request"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of throttled calls"
+    )
+    parser.add_argument("--error-code", type=int, default=6)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--comments", type=int, default=3)
+    parser.add_argument("--replies", type=int, default=2)
+    parser.add_argument("--stories", type=int, default=10)
+    parser.add_argument("--cities", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    data = SyntheticVk(
+        posts=args.posts,
+        comments=args.comments,
+        replies=args.replies,
+        stories=args.stories,
+        cities=args.cities,
+    )
+    standin = VkStandIn(
+        data,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_code=args.error_code,
+    )
+    print(f"VK API stand-in listening on {standin.url}")  # noqa: T201
+    standin.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""Local on-disk state kept by the tap between runs."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = ".tap-vk-cache"
+DEFAULT_RESPONSE_CACHE_MB = 64
+DEFAULT_PROFILE_TTL_DAYS = 7
+DEFAULT_PROFILE_MEMORY_SIZE = 100_000
+DEFAULT_FULL_REFRESH_DAYS = 7
+
+# Время жизни ответов по умолчанию, секунды. Методы, которых здесь нет,
+# не кэшируются, пока для них не задан TTL в конфиге.
+DEFAULT_RESPONSE_TTLS = {
+    "groups.getById": 24 * 60 * 60,
+    "users.get": 24 * 60 * 60,
+}
+
+
+def write_json_atomic(path: Path, data: t.Any) -> None:  # noqa: ANN401
+    """Write ``data`` to ``path`` so that readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+    tmp_path = path.with_name(f"{path.name}.{suffix}")
+    with tmp_path.open("w", encoding="utf-8") as tmp_file:
+        json.dump(data, tmp_file, separators=(",", ":"))
+    tmp_path.replace(path)
+
+
+class StoryIdIndex:
+    """Known stories of one community with their ``expires_at``.
+
+    IDs come from two places: rows already loaded into Postgres, read
+    incrementally above :attr:`db_high_water`, and records emitted by the
+    ``story`` stream. Only the first source moves the high-water mark, so
+    stories that were seen by the tap but never reached the database are
+    still picked up by the next query.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Load the index from ``path`` if it exists.
+
+        Args:
+            path: JSON file backing the index.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        data = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        self.db_high_water: int = data.get("db_high_water", 0)
+        self.stories: dict[int, int] = {
+            int(story_id): expires_at
+            for story_id, expires_at in data.get("stories", {}).items()
+        }
+
+    def add(self, story_id: int, expires_at: int | None) -> None:
+        """Remember a story seen in the ``story`` stream output."""
+        with self.lock:
+            self.stories[story_id] = expires_at or 0
+
+    def merge_from_db(self, rows: t.Iterable[tuple[int, int | None]]) -> int:
+        """Add ``(id, expires_at)`` rows read from Postgres.
+
+        Returns:
+            Number of rows merged.
+        """
+        count = 0
+        with self.lock:
+            for story_id, expires_at in rows:
+                known = self.stories.get(story_id, 0)
+                self.stories[story_id] = max(known, expires_at or 0)
+                self.db_high_water = max(self.db_high_water, story_id)
+                count += 1
+        return count
+
+    def ids(self, expires_since: int | None = None) -> list[int]:
+        """Return known story IDs, optionally only those expiring after a date."""
+        with self.lock:
+            return sorted(
+                story_id
+                for story_id, expires_at in self.stories.items()
+                if expires_since is None or expires_at >= expires_since
+            )
+
+    def save(self) -> None:
+        """Write the index back to disk."""
+        with self.lock:
+            data = {
+                "db_high_water": self.db_high_water,
+                "stories": {
+                    str(story_id): exp for story_id, exp in self.stories.items()
+                },
+            }
+        write_json_atomic(self.path, data)
+
+
+class FingerprintStore:
+    """Hashes of the rows emitted for one partition of a stream.
+
+    Every row is reduced to an 8-byte BLAKE2 digest of its metric fields,
+    keyed on the primary key. Only rows read during the current run are
+    written back, so rows that left the extraction window do not accumulate.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Load the fingerprints from ``path`` if it exists.
+
+        Args:
+            path: JSON file backing the store.
+        """
+        self.path = path
+        data = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        self.full_refresh_at: float = data.get("full_refresh_at", 0)
+        self.rows: dict[str, str] = data.get("rows", {})
+        self._seen: dict[str, str] = {}
+
+    @staticmethod
+    def fingerprint(record: dict, fields: t.Sequence[str]) -> str:
+        """Return the digest of the ``fields`` of a record."""
+        values = [record.get(name) for name in fields]
+        payload = json.dumps(values, ensure_ascii=False, default=str)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
+
+    def full_refresh_due(self, days: float, now: float | None = None) -> bool:
+        """Return ``True`` if the last full refresh is older than ``days``."""
+        now = time.time() if now is None else now
+        return now - self.full_refresh_at >= days * 24 * 60 * 60
+
+    def changed(self, key: str, record: dict, fields: t.Sequence[str]) -> bool:
+        """Remember the record and tell whether its ``fields`` have changed."""
+        fingerprint = self.fingerprint(record, fields)
+        self._seen[key] = fingerprint
+        return self.rows.get(key) != fingerprint
+
+    def save(self, *, full_refresh: bool = False) -> None:
+        """Replace the stored fingerprints with those seen in this run.
+
+        Args:
+            full_refresh: Every row was emitted, restart the refresh period.
+        """
+        if full_refresh:
+            self.full_refresh_at = time.time()
+        self.rows = self._seen
+        self._seen = {}
+        write_json_atomic(
+            self.path, {"full_refresh_at": self.full_refresh_at, "rows": self.rows}
+        )
+
+
+class StoryIdCache:
+    """Per-community :class:`StoryIdIndex` files under one directory."""
+
+    def __init__(self, cache_dir: str | os.PathLike) -> None:
+        """Create the cache.
+
+        Args:
+            cache_dir: Directory holding the index files.
+        """
+        self.cache_dir = Path(cache_dir)
+        self._indexes: dict[int, StoryIdIndex] = {}
+        self._lock = threading.Lock()
+
+    def get(self, group_id: int) -> StoryIdIndex:
+        """Return the index of a community, loading it on first use."""
+        with self._lock:
+            index = self._indexes.get(group_id)
+            if index is None:
+                path = self.cache_dir / f"story_ids_{group_id}.json"
+                index = self._indexes[group_id] = StoryIdIndex(path)
+            return index
+
+
+class ResponseCache:
+    """SQLite cache of VK API responses with per-method TTLs.
+
+    Entries are keyed on the method name and its normalized parameters and
+    evicted least recently used first once the database grows over
+    ``max_bytes``. SQLite runs in WAL mode, so several tap processes may
+    share one cache file.
+    """
+
+    def __init__(
+            self,
+            path: str | os.PathLike,
+            ttls: dict[str, int] | None = None,
+            *,
+            max_bytes: int = DEFAULT_RESPONSE_CACHE_MB * 1024 * 1024,
+            clock: t.Callable[[], float] = time.time,
+    ) -> None:
+        """Open (creating if needed) the cache database.
+
+        Args:
+            path: SQLite database file.
+            ttls: Seconds to keep responses per method name; methods without
+                a positive TTL are not cached.
+            max_bytes: Total size of stored responses before eviction starts.
+            clock: Wall clock, replaceable in tests.
+        """
+        self.path = Path(path)
+        self.ttls = {**DEFAULT_RESPONSE_TTLS, **(ttls or {})}
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " method TEXT NOT NULL,"
+            " body TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " used_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)"
+        )
+
+    def ttl(self, method: str) -> int:
+        """Return the TTL of ``method`` in seconds, 0 if it is not cached."""
+        return self.ttls.get(method) or 0
+
+    @staticmethod
+    def make_key(method: str, values: dict | None, scope: str = "") -> str:
+        """Build the cache key of a call.
+
+        Args:
+            method: Method name.
+            values: Method parameters, the access token is left out.
+            scope: Extra key part, e.g. a token fingerprint, so responses
+                visible to one token are not served to another.
+        """
+        params = {
+            key: value
+            for key, value in (values or {}).items()
+            if key != "access_token"
+        }
+        normalized = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.sha256(f"{scope}|{method}|{normalized}".encode()).hexdigest()
+        return f"{method}:{digest}"
+
+    def get(self, key: str) -> t.Any | None:  # noqa: ANN401
+        """Return a fresh cached response or ``None``."""
+        now = self._clock()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body FROM responses WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(
+                "UPDATE responses SET used_at = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, method: str, response: t.Any) -> None:  # noqa: ANN401
+        """Store a response for :meth:`ttl` seconds of its method."""
+        ttl = self.ttl(method)
+        if ttl <= 0:
+            return
+        body = json.dumps(response, ensure_ascii=False, separators=(",", ":"))
+        now = self._clock()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, method, body, size, expires_at, used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, method, body, len(body), now + ttl, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        (total,) = self._db.execute(
+            "SELECT coalesce(sum(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        keys = []
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY used_at"
+        ):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+
+class ProfileCache:
+    """Resolved user and community profiles with a TTL.
+
+    A bounded in-memory LRU sits in front of a SQLite table, so profiles
+    looked up during the run are served from memory and profiles resolved
+    by earlier runs (or by other tap processes) cost one indexed read.
+
+    Every entry remembers the optional VK fields it was resolved with; a
+    lookup that needs fields an entry lacks treats it as missing.
+    """
+
+    # Лимит SQLite на количество параметров в одном запросе
+    _LOOKUP_CHUNK = 500
+
+    def __init__(
+            self,
+            path: str | os.PathLike,
+            *,
+            ttl: float = DEFAULT_PROFILE_TTL_DAYS * 24 * 60 * 60,
+            memory_size: int = DEFAULT_PROFILE_MEMORY_SIZE,
+            clock: t.Callable[[], float] = time.time,
+    ) -> None:
+        """Open (creating if needed) the cache database.
+
+        Args:
+            path: SQLite database file.
+            ttl: Seconds a resolved profile stays valid.
+            memory_size: Maximum number of profiles kept in memory.
+            clock: Wall clock, replaceable in tests.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self._clock = clock
+        self._memory: OrderedDict[int, tuple[float, frozenset[str], dict]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            " id INTEGER PRIMARY KEY,"
+            " body TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " fields TEXT NOT NULL DEFAULT '')"
+        )
+        # Таблица из версии без набора полей: старые записи считаются
+        # полученными без дополнительных полей
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(profiles)")}
+        if "fields" not in columns:
+            self._db.execute(
+                "ALTER TABLE profiles ADD COLUMN fields TEXT NOT NULL DEFAULT ''"
+            )
+
+    def _remember(
+            self,
+            profile_id: int,
+            expires_at: float,
+            fields: frozenset[str],
+            profile: dict,
+    ) -> None:
+        self._memory[profile_id] = (expires_at, fields, profile)
+        self._memory.move_to_end(profile_id)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_many(
+            self,
+            ids: t.Iterable[int],
+            fields: t.Iterable[str] = (),
+    ) -> dict[int, dict]:
+        """Return the fresh cached profiles among ``ids``.
+
+        Args:
+            ids: Profile IDs, negative for communities.
+            fields: Optional VK fields the profiles must have been resolved
+                with.
+        """
+        needed = frozenset(filter(None, fields))
+        now = self._clock()
+        found: dict[int, dict] = {}
+        missing = []
+        with self._lock:
+            for profile_id in ids:
+                entry = self._memory.get(profile_id)
+                if entry is not None and entry[0] > now and needed <= entry[1]:
+                    self._memory.move_to_end(profile_id)
+                    found[profile_id] = entry[2]
+                else:
+                    missing.append(profile_id)
+            for start in range(0, len(missing), self._LOOKUP_CHUNK):
+                chunk = missing[start:start + self._LOOKUP_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._db.execute(
+                    f"SELECT id, body, expires_at, fields FROM profiles "  # noqa: S608
+                    f"WHERE expires_at > ? AND id IN ({placeholders})",
+                    (now, *chunk),
+                )
+                for profile_id, body, expires_at, stored in rows:
+                    have: frozenset[str] = frozenset(filter(None, stored.split(",")))
+                    if not needed <= have:
+                        continue
+                    profile = json.loads(body)
+                    self._remember(profile_id, expires_at, have, profile)
+                    found[profile_id] = profile
+        return found
+
+    def put_many(
+            self,
+            profiles: dict[int, dict],
+            fields: t.Iterable[str] = (),
+    ) -> None:
+        """Store freshly resolved profiles.
+
+        Args:
+            profiles: Profiles by ID.
+            fields: Optional VK fields the profiles were resolved with.
+        """
+        have = frozenset(filter(None, fields))
+        stored = ",".join(sorted(have))
+        expires_at = self._clock() + self.ttl
+        rows = [
+            (
+                profile_id,
+                json.dumps(profile, ensure_ascii=False, separators=(",", ":")),
+                expires_at,
+                stored,
+            )
+            for profile_id, profile in profiles.items()
+        ]
+        with self._lock:
+            for profile_id, profile in profiles.items():
+                self._remember(profile_id, expires_at, have, profile)
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "DELETE FROM profiles WHERE expires_at <= ?", (expires_at - self.ttl,)
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO profiles (id, body, expires_at, fields) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._db.execute("COMMIT")
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._db.close()
@@ -2,33 +2,150 @@
 
 from __future__ import annotations
 
+import functools
 import logging
+import time
 
-from vk_api import VkApi
 from vk_api.exceptions import ApiError
 import typing as t
 from importlib import resources
 import datetime
 import psycopg2
+import psycopg2.extensions
 from psycopg2 import sql
-from typing import List, Any
 
 from singer_sdk import typing as th  # JSON Schema typing helpers
-from singer_sdk.helpers.jsonpath import extract_jsonpath
-from tap_vk.client import VkStream
+from tap_vk.client import VkStream, chunked
+from tap_vk.ratelimit import THROTTLING_CODES
+
+if t.TYPE_CHECKING:
+    from singer_sdk.helpers.types import Context
 
 # TODO: Delete this is if not using json files for schema definition
 SCHEMAS_DIR = resources.files(__package__) / "schemas"
 
 
+DEFAULT_REFRESH_WINDOW_DAYS = 7
+DEFAULT_STATS_LOOKBACK_DAYS = 3
+DEFAULT_STATS_WINDOW_DAYS = 30
+
+# Ошибки wall.getComments, при которых комментарии поста просто недоступны:
+# доступ запрещён (15), пост удалён (18), комментарии закрыты (212)
+COMMENTS_UNAVAILABLE_CODES = frozenset({15, 18, 212})
+
+# Разрезы stats.get, которые превращаются в отдельные строки groupStat:
+# (источник, dimension, ключ списка, ключ значения)
+STAT_DIMENSIONS = (
+    ('reach', 'age', 'age', 'value'),
+    ('reach', 'city', 'cities', 'name'),
+    ('reach', 'country', 'countries', 'name'),
+    ('reach', 'sex', 'sex', 'value'),
+    ('visitors', 'age', 'age', 'value'),
+    ('visitors', 'city', 'cities', 'name'),
+    ('visitors', 'country', 'countries', 'name'),
+    ('visitors', 'sex', 'sex', 'value'),
+)
+
+
+# Поля group_posts из stats.getPostReach, нули для постов без охвата
+POST_REACH_FIELDS = (
+    'hide',
+    'join_group',
+    'links',
+    'reach_subscribers',
+    'reach_total',
+    'reach_viral',
+    'reach_ads',
+    'report',
+    'to_group',
+    'unsubscribe',
+)
+# Счётчики activity из stats.get, для которых в groupStat есть колонки
+STAT_ACTIVITY = ('comments', 'copies', 'hidden', 'likes', 'subscribed', 'unsubscribed')
+# Поля story/story_history из stories.getStats
+STORY_STATS_FIELDS = (
+    'views', 'replies', 'answer', 'shares', 'subscribers', 'bans', 'open_link',
+)
+
+
+def story_record(story: dict, st: dict, group_id: int) -> dict:
+    """Build a ``story``/``story_history`` record from a story and its stats."""
+    stickers = story.get('clickable_stickers', {}).get('clickable_stickers', [])
+    if len(stickers) != 0:
+        link = stickers[0].get('link_object', {}).get('url', '-')
+    else:
+        link = '-'
+    return {'id': story['id'],
+            'group_id': group_id,
+            'date': story['date'],
+            'expires_at': story['expires_at'],
+            'type': story.get('type', '-'),
+            'track_code': story.get('track_code', '-'),
+            'views': st.get('views', {}).get('count', 0),
+            'replies': st.get('replies', {}).get('count', 0),
+            'likes_count': story.get('likes_count', 0),
+            'new_reactions': len(story.get('new_reactions', [])),
+            'narratives_count': story.get('narratives_count', 0),
+            'answer': st.get('answer', {}).get('count', 0),
+            'shares': st.get('shares', {}).get('count', 0),
+            'subscribers': st.get('subscribers', {}).get('count', 0),
+            'bans': st.get('bans', {}).get('count', 0),
+            'open_link': st.get('open_link', {}).get('count', 0),
+            'link': link
+            }
+
+
 # TODO: - Override `UsersStream` and `GroupsStream` with your own stream definition.
 #       - Copy-paste as many times as needed to create multiple stream types.
 
-class GroupPostsCommentsStream(VkStream):
+class WallStream(VkStream):
+    """Base class for streams built on top of the community wall."""
+
+    def get_wall_since(self, context: Context | None) -> int | None:
+        """Return the date of the oldest post to read from the wall.
+
+        Posts published inside the refresh window are read again on every run
+        so that their counters and reach are updated.
+        """
+        since = self.get_start_timestamp(context)
+        if since is None:
+            return None
+        days = self.config.get("refresh_window_days", DEFAULT_REFRESH_WINDOW_DAYS)
+        window_start = int(time.time()) - days * 24 * 60 * 60
+        return min(since, window_start)
+
+    def wall_posts(self, owner_id: int, since: int | None = None) -> t.Iterator[dict]:
+        """Walk the wall from the newest post down to ``since``.
+
+        Args:
+            owner_id: Wall owner, negative for communities.
+            since: Unix time of the oldest post to return, ``None`` for all.
+        """
+        seen = set()
+        for post in self.client.paginate('wall.get', {'owner_id': owner_id}):
+            # Закреплённый пост идёт первым независимо от даты
+            if since is not None and post['date'] < since:
+                if post.get('is_pinned'):
+                    continue
+                return
+            # Новые посты во время обхода сдвигают offset, отсекаем повторы
+            if post['id'] in seen:
+                continue
+            seen.add(post['id'])
+            yield post
+
+
+class GroupPostsStream(WallStream):
     """Define custom stream."""
 
-    name = "group_posts_comments"
-    primary_keys = ["post_id", "group_id", "comment_id"]
+    name = "group_posts"
+    primary_keys = ["post_id", "group_id"]
+    replication_key = "date"
+    metric_fields = ('comments', 'likes', *POST_REACH_FIELDS)
+    builds_records = True
+    enrichments: t.ClassVar[dict[str, tuple[str, ...]]] = {
+        'stats.getPostReach': POST_REACH_FIELDS,
+    }
     cont = []
 
     schema = th.PropertiesList(
@@ -42,60 +159,216 @@ class GroupPostsCommentsStream(VkStream):
             th.IntegerType,
             description="The group's system ID",
         ),
-        th.Property(
-            "comment_id",
-            th.IntegerType,
-            description="The comment's system ID",
-        ),
-        th.Property("from_id", th.IntegerType),
-        th.Property("date", th.StringType),
+        th.Property("inner_type", th.StringType),
+        th.Property("type", th.StringType),
         th.Property("text", th.StringType),
-        th.Property("reply_to_user", th.IntegerType),
-        th.Property("reply_to_comment", th.IntegerType),
-        th.Property("likes", th.IntegerType)
+        th.Property("comments", th.IntegerType),
+        th.Property("likes", th.IntegerType),
+        th.Property("hide", th.IntegerType),
+        th.Property("join_group", th.IntegerType),
+        th.Property("links", th.IntegerType),
+        th.Property("reach_subscribers", th.IntegerType),
+        th.Property("reach_total", th.IntegerType),
+        th.Property("reach_viral", th.IntegerType),
+        th.Property("reach_ads", th.IntegerType),
+        th.Property("report", th.IntegerType),
+        th.Property("to_group", th.IntegerType),
+        th.Property("unsubscribe", th.IntegerType),
+        th.Property("date", th.IntegerType),
     ).to_dict()
 
+    # Сколько записей stats.getPostReach принимает за один вызов
+    reach_batch_size = 30
+    _comment_counts: dict[int, dict[str, int]] | None = None
+
+    @property
+    def detail_chunk_size(self) -> int:
+        """Number of posts whose reach is requested before records are emitted."""
+        return self.reach_batch_size * max(self.concurrency, 1)
+
+    @property
+    def comments_stream(self) -> GroupPostsCommentsStream | None:
+        """The comments child stream, if it is selected."""
+        for stream in self.child_streams:
+            if isinstance(stream, GroupPostsCommentsStream) and stream.selected:
+                return stream
+        return None
+
+    def freeze_start_values(self, context: Context | None) -> None:
+        """Also freeze the comment counts of all partitions.
+
+        The fetch stage of later partitions runs ahead in worker threads and
+        compares the comment counts of its posts with this copy instead of
+        the SDK state.
+        """
+        super().freeze_start_values(context)
+        # Без партиций у потока один контекст, None
+        partitions: list[Context | None] = [*(self.partitions or ())] or [None]
+        if self._comment_counts is None or context == partitions[0]:
+            self._comment_counts = {
+                self.get_group_id(partition): dict(
+                    self.read_context_state(partition).get('comment_counts') or {}
+                )
+                for partition in partitions
+            }
+            # Словари сообществ создаются здесь, потоки только добавляют в них
+            pages = self._tap.comment_first_pages
+            for group_id in self._comment_counts:
+                pages.setdefault(group_id, {})
+
+    def fetch_reach(self, owner_id: int, post_ids: list[int]) -> dict[int, dict]:
+        """Return ``stats.getPostReach`` results of ``post_ids`` by post ID.
+
+        IDs are sent :attr:`reach_batch_size` at a time inside ``execute``.
+        A batch that fails is split in half and sent again, so one deleted
+        or inaccessible post only loses its own reach. Throttled batches
+        are not split, the client has already retried them.
+        """
+        reach = {}
+        pending = list(chunked(post_ids, self.reach_batch_size))
+        while pending:
+            with self.client.batch(self.concurrency) as batch:
+                batch_vk = batch.get_api()
+                calls = [
+                    (ids, batch_vk.stats.getPostReach(owner_id=owner_id, post_ids=ids))
+                    for ids in pending
+                ]
+            pending = []
+            for ids, response in calls:
+                try:
+                    result = response.result
+                except ApiError as e:
+                    if len(ids) > 1 and e.code not in THROTTLING_CODES:
+                        half = len(ids) // 2
+                        pending += [ids[:half], ids[half:]]
+                    continue
+                for post_id, item in zip(ids, result):
+                    reach[item.get('post_id', post_id)] = item
+        return reach
+
+    def fetch_group_items(
+            self,
+            context: Context | None,
+    ) -> t.Iterable[tuple[list[dict], dict[int, dict]]]:
+        """Yield chunks of wall posts together with their reach by post ID.
+
+        When comments are synced, the first comment page of every post of
+        the chunk whose comment count changed is requested as well, see
+        :meth:`GroupPostsCommentsStream.fetch_first_pages`.
+        """
+        group_id = self.get_group_id(context)
+        owner_id = 0 - group_id
+        posts = self.wall_posts(owner_id, self.get_wall_since(context))
+        need_reach = self.needs('stats.getPostReach')
+        comments = self.comments_stream
+        known = (self._comment_counts or {}).get(group_id, {})
+        for chunk in chunked(posts, self.detail_chunk_size):
+            reach = {}
+            if need_reach:
+                reach = self.fetch_reach(owner_id, [i['id'] for i in chunk])
+            if comments is not None:
+                changed = [
+                    i for i in chunk
+                    if known.get(str(i['id'])) != i['comments']['count']
+                ]
+                comments.fetch_first_pages(owner_id, changed)
+            yield chunk, reach
+
+    def transform_items(
+            self,
+            items: t.Iterable[tuple[list[dict], dict[int, dict]]],
+            context: Context | None,
+    ) -> t.Iterable[dict]:
+        """Join the posts of every chunk with their reach."""
+        for chunk, reach in items:
+            for i in chunk:
+                r = reach.get(i['id']) or {}
+                w = {'post_id': i['id'], **{k: r.get(k, 0) for k in POST_REACH_FIELDS}}
+                n = {'group_id': i['owner_id'],
+                     'date': i['date'],
+                     'inner_type': i['inner_type'],
+                     'type': i['type'],
+                     'text': i['text'],
+                     'comments': i['comments']['count'],
+                     'likes': i['likes']['count']}
+                yield {**w, **n}
+
     def get_records(
             self,
             context: Context | None,
     ) -> t.Iterable[dict]:
-        # Ваш токен доступа
-        params = self.config.get("params") or {}
-        token = self.config.get('token')
-        vk_session = VkApi(token=token)
-
-        # Получаем объект VK_API
-        vk = vk_session.get_api()
-        owner_id = 0 - int(self.config.get('group_id'))
-        wall_posts = vk.wall.get(owner_id=owner_id, count=100)
-        wall_posts_2 = vk.wall.get(owner_id=owner_id, offset=100, count=100)
-        posts = wall_posts['items'] + wall_posts_2['items']
-        stat = []
-        for i in posts:
-            try:
-                wall = vk.wall.getComments(owner_id=owner_id, post_id=i['id'], need_likes=1, count=100, sort='desc')
-                for j in wall['items']:
-                    w = {'comment_id': j['id'],
-                         'post_id': i['id'],
-                         'group_id': owner_id,
-                         'from_id': j['from_id'],
-                         'date': j['date'],
-                         'text': j['text'],
-                         'reply_to_user': j.get('reply_to_user', 0),
-                         'reply_to_comment': j.get('reply_to_comment', 0),
-                         'likes': j.get('likes', {}).get('count', 0)
-                         }
-                    stat.append(w)
-            except ApiError:
-                pass
-        yield from extract_jsonpath(self.records_jsonpath, input=stat)
-
-
-class GroupPostsStream(VkStream):
+        """Return the posts of a partition and prune the comment count index.
+
+        Posts that were not read during this run are outside the refresh
+        window and will not be read again, so their counts are dropped.
+        """
+        self._seen_posts: set[str] = set()
+        yield from super().get_records(context)
+        counts = self.get_context_state(context).get('comment_counts')
+        if counts:
+            for post_id in set(counts) - self._seen_posts:
+                del counts[post_id]
+        # Страницы постов, отброшенных маппером, больше не понадобятся
+        self._tap.comment_first_pages.pop(self.get_group_id(context), None)
+
+    def changed_records(
+            self,
+            records: t.Iterable[dict],
+            context: Context | None,
+    ) -> t.Iterable[dict]:
+        """Drop unchanged posts, still counting them as read from the wall."""
+        def seen(records: t.Iterable[dict]) -> t.Iterator[dict]:
+            for record in records:
+                self._seen_posts.add(str(record['post_id']))
+                yield record
+
+        return super().changed_records(seen(records), context)
+
+    def get_child_context(
+            self,
+            record: dict,
+            context: Context | None,  # noqa: ARG002
+    ) -> dict:
+        """Return the context of the comments of one post."""
+        return {'group_id': abs(record['group_id']), 'post_id': record['post_id']}
+
+    def generate_child_contexts(
+            self,
+            record: dict,
+            context: Context | None,
+    ) -> t.Iterable[dict]:
+        """Sync comments only for posts whose comment count has changed.
+
+        The last seen ``comments.count`` of every post is kept in the
+        partition state under ``comment_counts``.
+        """
+        if not self.has_selected_descendents:
+            return
+        counts = self.get_context_state(context).setdefault('comment_counts', {})
+        post_id = str(record['post_id'])
+        if counts.get(post_id) == record['comments']:
+            return
+        child_context = self.get_child_context(record, context)
+        yield child_context
+        # Запоминаем счётчик только после полной выгрузки комментариев
+        unfinished = self._tap.unfinished_comment_posts
+        key = (child_context['group_id'], child_context['post_id'])
+        if key in unfinished:
+            unfinished.discard(key)
+        else:
+            counts[post_id] = record['comments']
+
+
+class GroupPostsCommentsStream(VkStream):
     """Define custom stream."""
 
-    name = "group_posts"
-    primary_keys = ["post_id", "group_id"]
+    name = "group_posts_comments"
+    primary_keys = ["post_id", "group_id", "comment_id"]
+    parent_stream_type = GroupPostsStream
+    builds_records = True
+    supports_batch = True
+    # Состояние храним по сообществу, а не по каждому посту
+    state_partitioning_keys = ["group_id"]  # noqa: RUF012
     cont = []
 
     schema = th.PropertiesList(
@@ -109,71 +382,344 @@ class GroupPostsStream(VkStream):
             th.IntegerType,
             description="The group's system ID",
         ),
-        th.Property("inner_type", th.StringType),
-        th.Property("type", th.StringType),
+        th.Property(
+            "comment_id",
+            th.IntegerType,
+            description="The comment's system ID",
+        ),
+        th.Property("from_id", th.IntegerType),
+        th.Property("date", th.StringType),
         th.Property("text", th.StringType),
-        th.Property("comments", th.IntegerType),
+        th.Property("reply_to_user", th.IntegerType),
+        th.Property("reply_to_comment", th.IntegerType),
         th.Property("likes", th.IntegerType),
-        th.Property("hide", th.IntegerType),
-        th.Property("join_group", th.IntegerType),
-        th.Property("links", th.IntegerType),
-        th.Property("reach_subscribers", th.IntegerType),
-        th.Property("reach_total", th.IntegerType),
-        th.Property("reach_viral", th.IntegerType),
-        th.Property("reach_ads", th.IntegerType),
-        th.Property("report", th.IntegerType),
-        th.Property("to_group", th.IntegerType),
-        th.Property("unsubscribe", th.IntegerType),
-        th.Property("date", th.IntegerType),
+        th.Property(
+            "parent_comment_id",
+            th.IntegerType,
+            description=(
+                "ID of the top-level comment of the thread, 0 for top-level comments"
+            ),
+        ),
+        th.Property(
+            "thread_depth",
+            th.IntegerType,
+            description="0 for comments to the post, 1 for replies in a thread",
+        ),
     ).to_dict()
 
-    def get_records(
+    # Сколько ответов VK отдаёт вместе с комментарием (максимум 10)
+    thread_items_count = 10
+    # Комментариев на странице wall.getComments (максимум 100)
+    page_size = 100
+
+    def comment_params(self, owner_id: int, post_id: int) -> dict:
+        """Return the ``wall.getComments`` parameters of a post's comments."""
+        return {
+            'owner_id': owner_id,
+            'post_id': post_id,
+            'need_likes': int(self.is_property_selected('likes')),
+            'sort': 'asc',
+        }
+
+    def fetch_first_pages(self, owner_id: int, posts: list[dict]) -> None:
+        """Request the first comment page of ``posts`` in ``execute`` batches.
+
+        Called from the fetch stage of ``group_posts``, so the pages of up to
+        25 posts share a request, :attr:`concurrency` requests run at once
+        and all of it overlaps with the output of earlier posts. Most posts
+        fit on one page and their sync makes no calls of its own. A page
+        that failed is left out: the post requests it again and handles the
+        error itself.
+
+        Args:
+            owner_id: Wall owner, negative for communities.
+            posts: Posts as returned by ``wall.get``.
+        """
+        pages = self._tap.comment_first_pages.setdefault(abs(owner_id), {})
+        calls = []
+        with self.client.batch(self.concurrency) as batch:
+            for post in posts:
+                if not post['comments']['count']:
+                    # Пустую страницу запрашивать незачем
+                    pages[post['id']] = {'count': 0, 'items': []}
+                    continue
+                values = {
+                    **self.comment_params(owner_id, post['id']),
+                    'thread_items_count': self.thread_items_count,
+                    'offset': 0,
+                    'count': self.page_size,
+                }
+                calls.append((post['id'], batch.method('wall.getComments', values)))
+        for post_id, call in calls:
+            if call.ok:
+                pages[post_id] = call.result
+
+    def iter_comments(
+            self,
+            owner_id: int,
+            post_id: int,
+            first_page: dict | None = None,
+    ) -> t.Iterator[tuple[dict, int, int]]:
+        """Walk all comments of a post together with their threads.
+
+        Pages are requested lazily, so only one page of comments is held in
+        memory at a time. Posts with more than one page of comments and
+        threads longer than ``thread_items_count`` are read page by page in
+        the caller's thread, the latter with separate ``comment_id``
+        requests. API errors of any page, including a thread page, are
+        raised to the caller.
+
+        Args:
+            owner_id: Wall owner, negative for communities.
+            post_id: Post ID.
+            first_page: First page of the comments if it has already been
+                fetched by :meth:`fetch_first_pages`.
+
+        Yields:
+            Tuples of comment, parent comment ID and thread depth.
+        """
+        params = self.comment_params(owner_id, post_id)
+        top_level = self.client.paginate(
+            'wall.getComments',
+            {**params, 'thread_items_count': self.thread_items_count},
+            page_size=self.page_size,
+            first_page=first_page,
+        )
+        for comment in top_level:
+            yield comment, 0, 0
+            thread = comment.get('thread') or {}
+            replies = thread.get('items', [])
+            if thread.get('count', 0) > len(replies):
+                replies = self.client.paginate(
+                    'wall.getComments', {**params, 'comment_id': comment['id']}
+                )
+            for reply in replies:
+                yield reply, comment['id'], 1
+
+    def fetch_group_items(
+            self,
+            context: Context | None,
+    ) -> t.Iterable[tuple[dict, int, int]]:
+        """Yield the comments of the post with their thread position.
+
+        Comments that are closed or belong to a deleted post end the post
+        quietly, any other API error is raised. A post whose comments became
+        unavailable part-way is recorded in ``unfinished_comment_posts`` so
+        that its comment count is not stored and it is read again next run.
+        """
+        # Комментарии всегда читаются в контексте поста
+        context = t.cast('Context', context)
+        owner_id = 0 - self.get_group_id(context)
+        post_id = context['post_id']
+        pages = self._tap.comment_first_pages.get(context['group_id'], {})
+        first_page = pages.pop(post_id, None)
+        read = 0
+        try:
+            for item in self.iter_comments(owner_id, post_id, first_page):
+                read += 1
+                yield item
+        except ApiError as e:
+            if e.code not in COMMENTS_UNAVAILABLE_CODES:
+                raise
+            self.logger.info(
+                "Comments of post %d_%d are unavailable after %d rows: %s",
+                owner_id,
+                post_id,
+                read,
+                e,
+            )
+            if read:
+                unfinished = self._tap.unfinished_comment_posts
+                unfinished.add((context['group_id'], post_id))
+
+    def transform_items(
             self,
+            items: t.Iterable[tuple[dict, int, int]],
             context: Context | None,
     ) -> t.Iterable[dict]:
-        # Ваш токен доступа
-        params = self.config.get("params") or {}
-        token = self.config.get('token')
-        vk_session = VkApi(token=token)
-
-        # Получаем объект VK_API
-        vk = vk_session.get_api()
-        owner_id = 0 - int(self.config.get('group_id'))
-        wall_posts = vk.wall.get(owner_id=owner_id, count=100)
-        wall_posts_2 = vk.wall.get(owner_id=owner_id, offset=100, count=100)
-        posts = wall_posts['items'] + wall_posts_2['items']
-        stat = []
-        for i in posts:
-            try:
-                wall = vk.stats.getPostReach(owner_id=owner_id, post_ids=i['id'])
-                w = wall[0]
-            except ApiError:
-                w = {"post_id": i['id'],
-                     "hide": 0,
-                     "join_group": 0,
-                     "links": 0,
-                     "reach_subscribers": 0,
-                     "reach_total": 0,
-                     "reach_viral": 0,
-                     "reach_ads": 0,
-                     "report": 0,
-                     "to_group": 0,
-                     "unsubscribe": 0
-                     }
-            n = {'group_id': i['owner_id'],
-                 'date': i['date'],
-                 'inner_type': i['inner_type'],
-                 'type': i['type'],
-                 'text': i['text'],
-                 'comments': i['comments']['count'],
-                 'likes': i['likes']['count']}
-            merged_dictionary = {**w, **n}
-            stat.append(merged_dictionary)
-        #   yield record.to_dict()
-        yield from extract_jsonpath(self.records_jsonpath, input=stat)
-
-
-class StoryStream(VkStream):
+        """Build comment records and collect their authors."""
+        owner_id = 0 - self.get_group_id(context)
+        post_id = t.cast('Context', context)['post_id']
+        # Авторов потом разрешает поток comment_authors
+        authors = self._tap.comment_author_ids
+        for j, parent_comment_id, thread_depth in items:
+            if j.get('from_id'):
+                authors.add(j['from_id'])
+            yield {'comment_id': j['id'],
+                   'post_id': post_id,
+                   'group_id': owner_id,
+                   'from_id': j.get('from_id', 0),
+                   # В схеме дата комментария объявлена строкой
+                   'date': str(j['date']),
+                   'text': j.get('text', ''),
+                   'reply_to_user': j.get('reply_to_user', 0),
+                   'reply_to_comment': j.get('reply_to_comment', 0),
+                   'likes': j.get('likes', {}).get('count', 0),
+                   'parent_comment_id': parent_comment_id,
+                   'thread_depth': thread_depth,
+                   }
+
+
+class CommentAuthorsStream(VkStream):
+    """Profiles of the users and communities who wrote the synced comments."""
+
+    name = "comment_authors"
+    primary_keys = ["id"]  # noqa: RUF012
+    builds_records = True
+    # Авторы собираются со всех сообществ сразу
+    partitions = None
+
+    schema = th.PropertiesList(
+        th.Property(
+            "id",
+            th.IntegerType,
+            description="The author's ID as in from_id, negative for communities",
+        ),
+        th.Property("type", th.StringType, description="user or group"),
+        th.Property("first_name", th.StringType),
+        th.Property("last_name", th.StringType),
+        th.Property("name", th.StringType),
+        th.Property("screen_name", th.StringType),
+        th.Property("photo_100", th.StringType),
+        th.Property("deactivated", th.StringType),
+        th.Property("is_closed", th.IntegerType),
+    ).to_dict()
+
+    # Максимум ID за один вызов users.get и groups.getById
+    users_batch_size = 1000
+    groups_batch_size = 500
+    # Необязательные поля users.get, остальные VK отдаёт всегда
+    user_fields: t.ClassVar[dict[str, str]] = {
+        'screen_name': 'screen_name',
+        'photo_100': 'photo_100',
+    }
+
+    @staticmethod
+    def user_record(user: dict) -> dict:
+        """Build a record from a ``users.get`` item."""
+        return {'id': user['id'],
+                'type': 'user',
+                'first_name': user.get('first_name'),
+                'last_name': user.get('last_name'),
+                'screen_name': user.get('screen_name'),
+                'photo_100': user.get('photo_100'),
+                'deactivated': user.get('deactivated'),
+                'is_closed': int(user.get('is_closed', False)),
+                }
+
+    @staticmethod
+    def group_record(group: dict) -> dict:
+        """Build a record from a ``groups.getById`` item."""
+        return {'id': -group['id'],
+                'type': 'group',
+                'name': group.get('name'),
+                'screen_name': group.get('screen_name'),
+                'photo_100': group.get('photo_100'),
+                'deactivated': group.get('deactivated'),
+                'is_closed': group.get('is_closed', 0),
+                }
+
+    def fetch_users(self, user_ids: list[int]) -> list[dict]:
+        """Resolve one batch of user IDs."""
+        fields = self.selected_fields(self.user_fields)
+        users = self.vk.users.get(user_ids=user_ids, fields=fields)
+        return [self.user_record(user) for user in users]
+
+    def fetch_groups(self, group_ids: list[int]) -> list[dict]:
+        """Resolve one batch of community IDs (positive)."""
+        groups = self.vk.groups.getById(group_ids=group_ids)
+        return [self.group_record(group) for group in groups]
+
+    def resolve(self, author_ids: list[int]) -> dict[int, dict]:
+        """Return the profiles of ``author_ids``, from the cache where possible."""
+        cache = self._tap.profile_cache
+        # Профиль из кэша подходит, только если в нём есть все выбранные поля
+        fields = self.selected_fields(self.user_fields).split(',')
+        profiles = cache.get_many(author_ids, fields)
+        missing = [author_id for author_id in author_ids if author_id not in profiles]
+        self.logger.info(
+            "Resolving %d comment authors, %d from the cache",
+            len(author_ids),
+            len(profiles),
+        )
+        user_ids = sorted(i for i in missing if i > 0)
+        group_ids = sorted(-i for i in missing if i < 0)
+        jobs = [
+            (self.fetch_users, chunk)
+            for chunk in chunked(user_ids, self.users_batch_size)
+        ] + [
+            (self.fetch_groups, chunk)
+            for chunk in chunked(group_ids, self.groups_batch_size)
+        ]
+        results = self.client.map(lambda job: job[0](job[1]), jobs, self.concurrency)
+        for records in results:
+            resolved = {record['id']: record for record in records}
+            cache.put_many(resolved, fields)
+            profiles.update(resolved)
+        return profiles
+
+    def get_group_records(
+            self,
+            context: Context | None,
+    ) -> t.Iterable[dict]:
+        """Return the profiles of the comment authors collected this run."""
+        author_ids = sorted(self._tap.comment_author_ids)
+        if not author_ids:
+            self.logger.info(
+                "No comment authors to resolve, is group_posts_comments selected?"
+            )
+            return
+        profiles = self.resolve(author_ids)
+        for author_id in author_ids:
+            if author_id in profiles:
+                yield profiles[author_id]
+
+
+class StoriesStream(VkStream):
+    """Base class for streams of community stories with their statistics."""
+
+    metric_fields = (
+        'likes_count', 'new_reactions', 'narratives_count', *STORY_STATS_FIELDS,
+    )
+    builds_records = True
+    enrichments: t.ClassVar[dict[str, tuple[str, ...]]] = {
+        'stories.getStats': STORY_STATS_FIELDS,
+    }
+
+    def story_records(
+            self,
+            owner_id: int,
+            stories: t.Iterable[dict],
+    ) -> t.Iterator[dict]:
+        """Join ``stories.getStats`` to the stories and build the records.
+
+        Stories whose statistics are not available are skipped. When no
+        statistics field is selected the stats are not requested at all.
+
+        Args:
+            owner_id: Story owner, negative for communities.
+            stories: Story objects as returned by ``stories.get``/``getById``.
+        """
+        if not self.needs('stories.getStats'):
+            for story in stories:
+                yield story_record(story, {}, abs(owner_id))
+            return
+        for chunk in chunked(stories, self.detail_chunk_size):
+            with self.client.batch(self.concurrency) as batch:
+                batch_vk = batch.get_api()
+                stats = [
+                    batch_vk.stories.getStats(owner_id=owner_id, story_id=j['id'])
+                    for j in chunk
+                ]
+            for j, response in zip(chunk, stats):
+                try:
+                    st = response.result
+                except ApiError:
+                    continue
+                yield story_record(j, st, abs(owner_id))
+
+
+class StoryStream(StoriesStream):
     """Define custom stream."""
 
     name = "story"
@@ -204,7 +750,7 @@ class StoryStream(VkStream):
         th.Property("link", th.StringType)
     ).to_dict()
 
-    def get_records(
+    def get_group_records(
             self,
             context: Context | None,
     ) -> t.Iterable[dict]:
@@ -220,52 +766,19 @@ class StoryStream(VkStream):
         Raises:
             NotImplementedError: If the implementation is TODO
         """
-        # Ваш токен доступа
-        params = self.config.get("params") or {}
-        token = self.config.get('token')
-        vk_session = VkApi(token=token)
-
-        # Получаем объект VK_API
-        vk = vk_session.get_api()
-        owner_id = 0 - self.config.get('group_id')
+        vk = self.vk
+        owner_id = 0 - self.get_group_id(context)
         stories = vk.stories.get(owner_id=owner_id)
-        stat = []
-        for i in stories['items']:
-            for j in i:
-
-                try:
-                    st = vk.stories.getStats(owner_id=owner_id, story_id=j['id'])
-                    logging.error(st)
-                    if len(j.get('clickable_stickers', {}).get('clickable_stickers', [])) != 0:
-                        link = j.get('clickable_stickers', {}).get('clickable_stickers', [])[0].get('link_object',
-                                                                                                    {}).get('url', '-')
-                    else:
-                        link = '-'
-                    w = {'id': j['id'],
-                         'group_id': abs(owner_id),
-                         'date': j['date'],
-                         'expires_at': j['expires_at'],
-                         'type': j.get('type', '-'),
-                         'track_code': j.get('track_code', '-'),
-                         'views': st.get('views', {}).get('count', 0),
-                         'replies': st.get('replies', {}).get('count', 0),
-                         'likes_count': j.get('likes_count', 0),
-                         'new_reactions': len(j.get('new_reactions', [])),
-                         'narratives_count': j.get('narratives_count', 0),
-                         'answer': st.get('answer', {}).get('count', 0),
-                         'shares': st.get('shares', {}).get('count', 0),
-                         'subscribers': st.get('subscribers', {}).get('count', 0),
-                         'bans': st.get('bans', {}).get('count', 0),
-                         'open_link': st.get('open_link', {}).get('count', 0),
-                         'link': link
-                         }
-                    stat.append(w)
-                except ApiError:
-                    pass
-        yield from extract_jsonpath(self.records_jsonpath, input=stat)
+        items = [j for i in stories['items'] for j in i]
+        # Известные истории нужны story_history, чтобы не сканировать таблицу
+        story_ids = self._tap.story_ids.get(abs(owner_id))
+        for j in items:
+            story_ids.add(j['id'], j.get('expires_at'))
+        story_ids.save()
+        yield from self.story_records(owner_id, items)
 
 
-class StoryHistoryStream(VkStream):
+class StoryHistoryStream(StoriesStream):
     """Define custom stream."""
 
     name = "story_history"
@@ -296,48 +809,112 @@ class StoryHistoryStream(VkStream):
         th.Property("link", th.StringType)
     ).to_dict()
 
-    @staticmethod
+    # stories.getById принимает не больше 100 историй за раз
+    get_by_id_size = 100
+
+    @classmethod
     def fetch_ids(
-            host: str,
-            port: int,
-            dbname: str,
-            user: str,
-            password: str,
+            cls,
+            conn: psycopg2.extensions.connection,
             id_group: int,
-    ) -> List[Any]:
-        conn = None
+            after_id: int = 0,
+            itersize: int = 2000,
+    ) -> t.Iterator[tuple[int, int | None]]:
+        """Stream the community's stories stored in Postgres above ``after_id``.
+
+        A server-side (named) cursor is used, so only ``itersize`` rows are
+        held in memory at a time.
+
+        Args:
+            conn: Connection borrowed from the tap's pool.
+            id_group: Story owner ID (negative for communities).
+            after_id: Only return stories with a greater ID.
+            itersize: Number of rows fetched from the server per round trip.
+
+        Yields:
+            Tuples of story ID and ``expires_at``.
+        """
+        query = sql.SQL(
+            "SELECT id, max(expires_at) FROM raw_vk.story "
+            "WHERE group_id = %s AND id > %s GROUP BY id"
+        )
         try:
-            # Устанавливаем соединение
-            conn = psycopg2.connect(
-                host=host,
-                port=port,
-                dbname=dbname,
-                user=user,
-                password=password
-            )
-            # Открываем курсор
-            with conn.cursor() as cur:
-                # Формируем безопасный SQL-запрос
-                group_id = -1 * id_group
-                cur.execute(f"SELECT distinct id FROM raw_vk.story where group_id={group_id}")
-                # Извлекаем все строки
-                rows = cur.fetchall()
-                # rows имеет вид [(1,), (2,), ...] — превращаем в плоский список
-                if len(rows) == 0:
-                    return []
-                ids = [str(id_group) + '_' + str(row[0]) for row in rows]
-                return ids
-
-        except psycopg2.Error as e:
-            # В случае ошибки выводим её в лог и пробрасываем дальше
-            print(f"Error fetching ids: {e}")
+            # Именованный курсор живёт только внутри транзакции
+            with conn, conn.cursor(name='story_history_ids') as cur:
+                cur.itersize = itersize
+                cur.execute(query, [-1 * id_group, after_id])
+                for row in cur:
+                    yield row[0], row[1]
+
+        except psycopg2.Error:
+            # В случае ошибки пишем её в лог и пробрасываем дальше
+            cls.logger.exception("Error fetching story ids of %d", id_group)
             raise
 
-        finally:
-            if conn:
-                conn.close()
+    def get_story_ids(self, owner_id: int) -> list[int]:
+        """Return the stories to refresh, updating the local index from Postgres.
 
-    def get_records(
+        Only rows above the index high-water mark are read from the database.
+        Without ``params.host`` only stories seen by the ``story`` stream are
+        refreshed.
+        """
+        index = self._tap.story_ids.get(abs(owner_id))
+        if (self.config.get("params") or {}).get("host"):
+            with self._tap.db_connection() as conn:
+                ids = self.fetch_ids(conn, owner_id, index.db_high_water)
+                added = index.merge_from_db(ids)
+            index.save()
+            self.logger.info(
+                "Read %d new stories of group %d from Postgres", added, abs(owner_id)
+            )
+        return index.ids(self.get_expires_since())
+
+    def fetch_stories(self, owner_id: int, story_ids: list[int]) -> list[dict]:
+        """Return the ``stories.getById`` items of ``story_ids``.
+
+        A request that fails is split in half and sent again, so a story VK
+        refuses only loses itself. Stories that fail on their own, and
+        throttled requests the client has already retried, are logged and
+        skipped.
+
+        Args:
+            owner_id: Story owner, negative for communities.
+            story_ids: Stories to request, at most :attr:`get_by_id_size`.
+        """
+        stories = []
+        pending = [story_ids]
+        while pending:
+            ids = pending.pop(0)
+            try:
+                response = self.vk.stories.getById(
+                    stories=[f"{owner_id}_{story_id}" for story_id in ids]
+                )
+            except ApiError as e:
+                if len(ids) > 1 and e.code not in THROTTLING_CODES:
+                    half = len(ids) // 2
+                    # Половины встают в начало очереди, порядок историй не меняется
+                    pending[:0] = [ids[:half], ids[half:]]
+                    continue
+                self.logger.warning(
+                    "Skipping stories %d_%d..%d_%d: %s",
+                    owner_id,
+                    ids[0],
+                    owner_id,
+                    ids[-1],
+                    e,
+                )
+                continue
+            stories += response['items']
+        return stories
+
+    def get_expires_since(self) -> int | None:
+        """Return the lower ``expires_at`` bound from ``story_history_window_days``."""
+        days = self.config.get("story_history_window_days")
+        if days is None:
+            return None
+        return int(time.time()) - days * 24 * 60 * 60
+
+    def get_group_records(
             self,
             context: Context | None,
     ) -> t.Iterable[dict]:
@@ -353,59 +930,11 @@ class StoryHistoryStream(VkStream):
         Raises:
             NotImplementedError: If the implementation is TODO
         """
-        # Ваш токен доступа
-        params = self.config.get("params") or {}
-        token = self.config.get('token')
-        vk_session = VkApi(token=token)
-
-        # Получаем объект VK_API
-        vk = vk_session.get_api()
-        owner_id = 0 - self.config.get('group_id')
-        stories_all_list = self.fetch_ids(host=params.get('host'),
-                                          port=params.get('port'),
-                                          dbname=params.get('database'),
-                                          user=params.get('user'),
-                                          password=params.get('password'),
-                                          id_group=owner_id)
-        stat = []
-        if len(stories_all_list) == 0:
-            return extract_jsonpath(self.records_jsonpath, input=stat)
-        logging.error(stories_all_list)
-        try:
-            stories = vk.stories.getById(stories=stories_all_list[:100])
-        except ApiError:
-            return extract_jsonpath(self.records_jsonpath, input=stat)
-        for i in stories['items']:
-            try:
-                # logging.info(i)
-                st = vk.stories.getStats(owner_id=owner_id, story_id=i['id'])
-                if len(i.get('clickable_stickers', {}).get('clickable_stickers', [])) != 0:
-                    link = i.get('clickable_stickers', {}).get('clickable_stickers', [])[0].get('link_object', {}).get(
-                        'url', '-')
-                else:
-                    link = '-'
-                w = {'id': i['id'],
-                     'group_id': abs(owner_id),
-                     'date': i['date'],
-                     'expires_at': i['expires_at'],
-                     'type': i.get('type', '-'),
-                     'track_code': i.get('track_code', '-'),
-                     'views': st.get('views', {}).get('count', 0),
-                     'replies': st.get('replies', {}).get('count', 0),
-                     'likes_count': i.get('likes_count', 0),
-                     'new_reactions': len(i.get('new_reactions', [])),
-                     'narratives_count': i.get('narratives_count', 0),
-                     'answer': st.get('answer', {}).get('count', 0),
-                     'shares': st.get('shares', {}).get('count', 0),
-                     'subscribers': st.get('subscribers', {}).get('count', 0),
-                     'bans': st.get('bans', {}).get('count', 0),
-                     'open_link': st.get('open_link', {}).get('count', 0),
-                     'link': link
-                     }
-                stat.append(w)
-            except ApiError:
-                return extract_jsonpath(self.records_jsonpath, input=stat)
-        yield from extract_jsonpath(self.records_jsonpath, input=stat)
+        owner_id = 0 - self.get_group_id(context)
+        story_ids = self.get_story_ids(owner_id)
+        for ids in chunked(story_ids, self.get_by_id_size):
+            stories = self.fetch_stories(owner_id, ids)
+            yield from self.story_records(owner_id, stories)
 
 
 class GroupsStream(VkStream):
@@ -413,6 +942,8 @@ class GroupsStream(VkStream):
 
     name = "group"
     primary_keys = ["id"]
+    # groups.getById принимает все сообщества сразу, поэтому без партиций
+    partitions = None
 
     schema = th.PropertiesList(
         th.Property(
@@ -434,7 +965,13 @@ class GroupsStream(VkStream):
         th.Property("members_count", th.IntegerType),
     ).to_dict()
 
-    def get_records(
+    # Необязательные поля groups.getById, остальные VK отдаёт всегда
+    group_fields: t.ClassVar[dict[str, str]] = {
+        'site': 'site',
+        'members_count': 'members_count',
+    }
+
+    def get_group_records(
             self,
             context: Context | None,
     ) -> t.Iterable[dict]:
@@ -450,18 +987,11 @@ class GroupsStream(VkStream):
         Raises:
             NotImplementedError: If the implementation is TODO
         """
-        # Ваш токен доступа
-        params = self.config.get("params") or {}
-        token = self.config.get('token')
-        vk_session = VkApi(token=token)
-
-        # Получаем объект VK_API
-        vk = vk_session.get_api()
-
-        stat = vk.groups.getById(group_id=self.config.get('group_id'), fields='members_count', extended=1)
-
-        #   yield record.to_dict()
-        yield from extract_jsonpath(self.records_jsonpath, input=stat)
+        yield from self.vk.groups.getById(
+            group_ids=self.group_ids,
+            fields=self.selected_fields(self.group_fields),
+            extended=1,
+        )
 
 
 class GroupStatStream(VkStream):
@@ -470,6 +1000,9 @@ class GroupStatStream(VkStream):
     name = "groupStat"
     primary_keys = ["id", "period_from", "dimension", "source"]
     replication_key = "period_from"
+    partition_key = "id"
+    builds_records = True
+    supports_batch = True
     schema = th.PropertiesList(
         th.Property("id", th.IntegerType),
         th.Property("period_from", th.IntegerType),
@@ -492,161 +1025,120 @@ class GroupStatStream(VkStream):
         th.Property("source", th.StringType),
     ).to_dict()
 
+    def get_start(self, context: Context | None) -> int:
+        """Return the unix time (a midnight) the extraction starts from.
+
+        The bookmark moved back by ``stats_lookback_days`` to pick up late
+        statistics, ``start_date`` on the first run, or 22 days ago.
+        """
+        start = self.get_start_timestamp(context)
+        if isinstance(self.get_start_value(context), int):
+            lookback = self.config.get(
+                "stats_lookback_days", DEFAULT_STATS_LOOKBACK_DAYS
+            )
+            start -= lookback * 24 * 60 * 60
+        if start is None:
+            day = datetime.datetime.today() - datetime.timedelta(days=22)
+        else:
+            # Окна начинаются в полночь по местному времени, как и без закладки
+            day = datetime.datetime.fromtimestamp(start)  # noqa: DTZ006
+        return int(datetime.datetime.combine(day, datetime.time(0)).timestamp())
+
+    def get_windows(self, context: Context | None) -> list[tuple[int, int]]:
+        """Split the period from :meth:`get_start` until now into date windows."""
+        days = self.config.get("stats_window_days", DEFAULT_STATS_WINDOW_DAYS)
+        window = days * 24 * 60 * 60
+        start = self.get_start(context)
+        now = int(time.time())
+        return [
+            (window_from, min(window_from + window, now))
+            for window_from in range(start, now, window)
+        ]
+
+    def fetch_window(self, group_id: int, window: tuple[int, int]) -> list[dict]:
+        """Return the daily ``stats.get`` payload of one date window."""
+        timestamp_from, timestamp_to = window
+        return self.vk.stats.get(group_id=group_id, app_id=self.config.get('app_id'),
+                                 timestamp_from=timestamp_from,
+                                 timestamp_to=timestamp_to - 1,
+                                 interval='day', extended=1)
+
     @staticmethod
-    def transform_to_flat_structure(data):
-        rows = []
+    def transform_to_flat_structure(
+            data: t.Iterable[dict],
+            dimensions: t.Sequence[tuple[str, str, str, str]] = STAT_DIMENSIONS,
+            extra: dict | None = None,
+    ) -> t.Iterator[dict]:
+        """Flatten a ``stats.get`` payload into one row per demographic bucket.
 
-        for record in data:
-            # Общие поля (1 уровень вложенности)
-            if record.get('activity'):
-                base_record = {
-                    'period_from': record['period_from'],
-                    'period_to': record['period_to'],
-                    **{f'activity_{k}': v for k, v in record.get('activity').items()},
-                    'mobile_reach': record['reach']['mobile_reach'],
-                    'total_reach': record['reach']['reach'],
-                    'reach_subscribers': record['reach']['reach_subscribers'],
-                    'mobile_views': record['visitors']['mobile_views'],
-                    'total_views': record['visitors']['views'],
-                    'total_visitors': record['visitors']['visitors'],
-                }
-            else:
-                base_record = {
-                    'period_from': record['period_from'],
-                    'period_to': record['period_to'],
-                    'mobile_reach': record['reach']['mobile_reach'],
-                    'total_reach': record['reach']['reach'],
-                    'reach_subscribers': record['reach']['reach_subscribers'],
-                    'mobile_views': record['visitors']['mobile_views'],
-                    'total_views': record['visitors']['views'],
-                    'total_visitors': record['visitors']['visitors'],
-                }
+        Args:
+            data: Daily records returned by ``stats.get``.
+            dimensions: ``(source, dimension, list key, value key)`` spec of
+                the buckets to emit, see :data:`STAT_DIMENSIONS`.
+            extra: Constant fields added to every row.
 
-            # Вложенность 2 уровня -> новые строки
-            # Reach -> Age
-            for age_group in record.get('reach', {}).get('age', []):
-                row = base_record.copy()
-                row.update({
-                    'dimension': 'age',
-                    'dimension_value': age_group['value'],
-                    'count': age_group['count'],
-                    'source': 'reach',
-                })
-                rows.append(row)
-
-            # Reach -> Cities
-            for city in record.get('reach', {}).get('cities', []):
-                row = base_record.copy()
-                row.update({
-                    'dimension': 'city',
-                    'dimension_value': city['name'],
-                    'count': city['count'],
-                    'source': 'reach',
-                })
-                rows.append(row)
-
-            # Reach -> Countries
-            for country in record.get('reach', {}).get('countries', []):
-                row = base_record.copy()
-                row.update({
-                    'dimension': 'country',
-                    'dimension_value': country['name'],
-                    'count': country['count'],
-                    'source': 'reach',
-                })
-                rows.append(row)
-
-            # Reach -> Sex
-            for sex_group in record.get('reach', {}).get('sex', []):
-                row = base_record.copy()
-                row.update({
-                    'dimension': 'sex',
-                    'dimension_value': sex_group['value'],
-                    'count': sex_group['count'],
-                    'source': 'reach',
-                })
-                rows.append(row)
-
-            # Visitors -> Age
-            for age_group in record.get('visitors', {}).get('age', []):
-                row = base_record.copy()
-                row.update({
-                    'dimension': 'age',
-                    'dimension_value': age_group['value'],
-                    'count': age_group['count'],
-                    'source': 'visitors',
-                })
-                rows.append(row)
-
-            # Visitors -> Cities
-            for city in record.get('visitors', {}).get('cities', []):
-                row = base_record.copy()
-                row.update({
-                    'dimension': 'city',
-                    'dimension_value': city['name'],
-                    'count': city['count'],
-                    'source': 'visitors',
-                })
-                rows.append(row)
-
-            # Visitors -> Countries
-            for country in record.get('visitors', {}).get('countries', []):
-                row = base_record.copy()
-                row.update({
-                    'dimension': 'country',
-                    'dimension_value': country['name'],
-                    'count': country['count'],
-                    'source': 'visitors',
-                })
-                rows.append(row)
-
-            # Visitors -> Sex
-            for sex_group in record.get('visitors', {}).get('sex', []):
-                row = base_record.copy()
-                row.update({
-                    'dimension': 'sex',
-                    'dimension_value': sex_group['value'],
-                    'count': sex_group['count'],
-                    'source': 'visitors',
-                })
-                rows.append(row)
-
-        return rows
+        Yields:
+            Flat rows with the day totals, dimension name, value and count.
+        """
+        extra = extra or {}
+        for record in data:
+            reach = record.get('reach') or {}
+            visitors = record.get('visitors') or {}
+            activity = record.get('activity') or {}
+            # Общие поля (1 уровень вложенности) собираются один раз на день
+            base_record = {
+                **extra,
+                'period_from': record['period_from'],
+                'period_to': record['period_to'],
+                **{
+                    f'activity_{k}': activity[k]
+                    for k in STAT_ACTIVITY
+                    if k in activity
+                },
+                'mobile_reach': reach['mobile_reach'],
+                'total_reach': reach['reach'],
+                'reach_subscribers': reach['reach_subscribers'],
+                'mobile_views': visitors['mobile_views'],
+                'total_views': visitors['views'],
+                'total_visitors': visitors['visitors'],
+            }
+            # Вложенность 2 уровня -> новые строки. Шаблон строки готовится
+            # один раз на разрез, dict.copy() дешевле сборки словаря с нуля.
+            for source, dimension, key, value_key in dimensions:
+                buckets = (record.get(source) or {}).get(key)
+                if not buckets:
+                    continue
+                template = {**base_record, 'dimension': dimension, 'source': source}
+                for bucket in buckets:
+                    row = template.copy()
+                    row['dimension_value'] = bucket[value_key]
+                    row['count'] = bucket['count']
+                    yield row
+
+    def fetch_group_items(
+            self,
+            context: Context | None,
+    ) -> t.Iterable[list[dict]]:
+        """Yield the ``stats.get`` payload of every date window."""
+        fetch = functools.partial(self.fetch_window, self.get_group_id(context))
+        # Окна запрашиваются параллельно, а отдаются строго по порядку
+        return self.client.map(fetch, self.get_windows(context), self.concurrency)
 
-    def get_records(
+    def transform_items(
             self,
+            items: t.Iterable[list[dict]],
             context: Context | None,
     ) -> t.Iterable[dict]:
-        """Return a generator of record-type dictionary objects.
-
-        The optional `context` argument is used to identify a specific slice of the
-        stream if partitioning is required for the stream. Most implementations do not
-        require partitioning and should ignore the `context` argument.
-
-        Args:
-            context: Stream partition or context dictionary.
-
-        Raises:
-            NotImplementedError: If the implementation is TODO
-        """
-        # Ваш токен доступа
-        params = self.config.get("params") or {}
-        token = self.config.get('token')
-        vk_session = VkApi(token=token)
-
-        # Получаем объект VK_API
-        vk = vk_session.get_api()
-        today = datetime.datetime.today()
-        one_day = datetime.timedelta(days=22)
-        yesterday = today - one_day
-        time1 = datetime.time(0)  # 00:00
-        date_time_1 = datetime.datetime.combine(yesterday, time1)
-        timestamp_from = date_time_1.timestamp()
-        stat = vk.stats.get(group_id=self.config.get('group_id'), app_id=self.config.get('app_id'),
-                            timestamp_from=int(timestamp_from), interval='day', extended=1)
-        stat = self.transform_to_flat_structure(stat)
-        for record in stat:
-            record.update({'id': self.config.get('group_id')})
-
-        #   yield record.to_dict()
-        yield from extract_jsonpath(self.records_jsonpath, input=stat)
+        """Flatten the payloads into one row per demographic bucket."""
+        dimensions = STAT_DIMENSIONS + tuple(
+            (
+                item['source'],
+                item['dimension'],
+                item['key'],
+                item.get('value_key', 'value'),
+            )
+            for item in self.config.get('stats_extra_dimensions') or []
+        )
+        extra = {'id': self.get_group_id(context)}
+        for stat in items:
+            yield from self.transform_to_flat_structure(stat, dimensions, extra)
@@ -2,11 +2,53 @@
 
 from __future__ import annotations
 
+import typing as t
+from contextlib import contextmanager
+from functools import cached_property
+from pathlib import Path
+
+from psycopg2.pool import ThreadedConnectionPool
 from singer_sdk import Tap
+from singer_sdk._singerlib import StateMessage
 from singer_sdk import typing as th  # JSON schema typing helpers
 
 # TODO: Import your custom stream types here:
 from tap_vk import streams
+from tap_vk.storage import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_FULL_REFRESH_DAYS,
+    DEFAULT_PROFILE_TTL_DAYS,
+    DEFAULT_RESPONSE_CACHE_MB,
+    ProfileCache,
+    ResponseCache,
+    StoryIdCache,
+)
+from tap_vk.streams import (
+    DEFAULT_REFRESH_WINDOW_DAYS,
+    DEFAULT_STATS_LOOKBACK_DAYS,
+    DEFAULT_STATS_WINDOW_DAYS,
+)
+from tap_vk.batch import DEFAULT_BATCH_FILE_MB, RotatingBatchWriter
+from tap_vk.output import DEFAULT_OUTPUT_BUFFER_KB, MessageWriter
+from tap_vk.pipeline import DEFAULT_PIPELINE_QUEUE_SIZE
+from tap_vk.ratelimit import RateLimiter
+from tap_vk.tokens import PooledToken, TokenPool
+from tap_vk.transport import TRANSPORT_MODES, make_adapter
+from tap_vk.client import (
+    API_URL,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_GROUP_CONCURRENCY,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_SIZE,
+    VkClient,
+    VkStream,
+)
+
+if t.TYPE_CHECKING:
+    from singer_sdk._singerlib import Message
+    from singer_sdk.streams import Stream
+
+    from tap_vk.storage import FingerprintStore
 
 
 class TapVk(Tap):
@@ -19,10 +61,46 @@ class TapVk(Tap):
         th.Property(
             "token",
             th.StringType,
-            required=True,
             secret=True,  # Flag config as protected.
             title="Auth Token",
-            description="The token to authenticate against the API service",
+            description="The token to authenticate against the API service. "
+                        "Required unless `tokens` is set",
+        ),
+        th.Property(
+            "token_type",
+            th.StringType,
+            default="user",
+            allowed_values=["user", "community", "service"],
+            title="Token type",
+            description="Type of the token, defines the VK requests per second limit",
+        ),
+        th.Property(
+            "tokens",
+            th.ArrayType(
+                th.ObjectType(
+                    th.Property("token", th.StringType, required=True, secret=True),
+                    th.Property(
+                        "token_type",
+                        th.StringType,
+                        default="user",
+                        allowed_values=["user", "community", "service"],
+                    ),
+                    th.Property(
+                        "group_ids",
+                        th.ArrayType(th.IntegerType),
+                        description="Communities the token may be used for, "
+                                    "all by default",
+                    ),
+                    th.Property(
+                        "daily_quota",
+                        th.IntegerType,
+                        description="Maximum number of requests per day",
+                    ),
+                )
+            ),
+            title="Token pool",
+            description="Tokens the calls are spread over, each with its own rate "
+                        "limit. `token` is added to the pool if both are set",
         ),
         th.Property(
             "group_id",
@@ -30,12 +108,281 @@ class TapVk(Tap):
             title="Аккаунт в vk",
             description="Аккаунт в vk",
         ),
+        th.Property(
+            "group_ids",
+            th.ArrayType(th.IntegerType),
+            title="Сообщества в vk",
+            description="Список сообществ для выгрузки, используется вместо `group_id`",
+        ),
+        th.Property(
+            "group_concurrency",
+            th.IntegerType,
+            default=DEFAULT_GROUP_CONCURRENCY,
+            title="Group concurrency",
+            description="Number of communities extracted at the same time",
+        ),
+        th.Property(
+            "start_date",
+            th.DateTimeType,
+            title="Start date",
+            description="Earliest post date to extract when there is no bookmark yet",
+        ),
+        th.Property(
+            "refresh_window_days",
+            th.IntegerType,
+            default=DEFAULT_REFRESH_WINDOW_DAYS,
+            title="Refresh window",
+            description="Posts younger than this many days are re-read on every run "
+                        "to update their counters and reach",
+        ),
+        th.Property(
+            "story_history_window_days",
+            th.IntegerType,
+            title="Story history window",
+            description="Only refresh stored stories that expired within this many "
+                        "days. All stored stories are refreshed when not set",
+        ),
+        th.Property(
+            "stats_lookback_days",
+            th.IntegerType,
+            default=DEFAULT_STATS_LOOKBACK_DAYS,
+            title="Stats lookback",
+            description="Days before the groupStat bookmark that are requested again "
+                        "to pick up late statistics",
+        ),
+        th.Property(
+            "stats_window_days",
+            th.IntegerType,
+            default=DEFAULT_STATS_WINDOW_DAYS,
+            title="Stats window",
+            description="Size in days of the date windows a groupStat backfill is "
+                        "split into",
+        ),
+        th.Property(
+            "stats_extra_dimensions",
+            th.ArrayType(
+                th.ObjectType(
+                    th.Property("source", th.StringType, required=True),
+                    th.Property("dimension", th.StringType, required=True),
+                    th.Property("key", th.StringType, required=True),
+                    th.Property("value_key", th.StringType),
+                ),
+            ),
+            title="Extra stats dimensions",
+            description="Additional stats.get breakdowns to flatten into groupStat "
+                        "rows, e.g. {source: reach, dimension: sex_age, key: sex_age}",
+        ),
         th.Property(
             "app_id",
             th.IntegerType,
             title="Приложение в vk",
             description="Приложение в vk",
         ),
+        th.Property(
+            "api_url",
+            th.StringType,
+            default=API_URL,
+            title="API URL",
+            description="Base URL of VK API methods, e.g. a local stand-in "
+                        "started with `python -m tap_vk.standin`",
+        ),
+        th.Property(
+            "transport",
+            th.StringType,
+            default="live",
+            allowed_values=list(TRANSPORT_MODES),
+            title="Transport",
+            description="`live` calls the API, `record` also saves every response "
+                        "to `fixtures_path`, `replay` answers from that file offline",
+        ),
+        th.Property(
+            "fixtures_path",
+            th.StringType,
+            title="Fixtures path",
+            description="Gzip-compressed JSON Lines file used by the record "
+                        "and replay transports",
+        ),
+        th.Property(
+            "requests_per_second",
+            th.NumberType,
+            title="Requests per second",
+            description="Overrides the VK limit of the token type, e.g. for a local "
+                        "stand-in. Replayed runs are not limited",
+        ),
+        th.Property(
+            "http_pool_size",
+            th.IntegerType,
+            default=DEFAULT_POOL_SIZE,
+            title="HTTP pool size",
+            description="Maximum number of keep-alive connections to the VK API",
+        ),
+        th.Property(
+            "max_retries",
+            th.IntegerType,
+            default=DEFAULT_MAX_RETRIES,
+            title="Max retries",
+            description="How many times a call throttled by VK (errors 6, 9, 29) "
+                        "is repeated",
+        ),
+        th.Property(
+            "concurrency",
+            th.IntegerType,
+            default=DEFAULT_CONCURRENCY,
+            title="Concurrency",
+            description="Number of per-item detail requests kept in flight by a stream",
+        ),
+        th.Property(
+            "pipeline_queue_size",
+            th.IntegerType,
+            default=DEFAULT_PIPELINE_QUEUE_SIZE,
+            title="Pipeline queue size",
+            description="Maximum number of items buffered between the fetch, transform "
+                        "and output stages of a stream, 0 runs the stages one after "
+                        "another in a single thread",
+        ),
+        th.Property(
+            "stream_concurrency",
+            th.ObjectType(additional_properties=th.IntegerType),
+            title="Concurrency per stream",
+            description="Overrides `concurrency` for the given stream names",
+        ),
+        th.Property(
+            "cache_dir",
+            th.StringType,
+            default=DEFAULT_CACHE_DIR,
+            title="Cache directory",
+            description="Directory for the tap's local caches and indexes",
+        ),
+        th.Property(
+            "response_cache",
+            th.BooleanType,
+            default=False,
+            title="Response cache",
+            description="Keep responses of slow-changing methods (groups.getById, "
+                        "users.get) in `cache_dir` and reuse them between runs",
+        ),
+        th.Property(
+            "response_cache_ttls",
+            th.ObjectType(additional_properties=th.IntegerType),
+            title="Response cache TTLs",
+            description="Seconds to keep responses per VK method, e.g. "
+                        '{"groups.getById": 86400}. 0 disables caching of a method',
+        ),
+        th.Property(
+            "response_cache_max_mb",
+            th.IntegerType,
+            default=DEFAULT_RESPONSE_CACHE_MB,
+            title="Response cache size",
+            description="Size of the response cache in megabytes before the least "
+                        "recently used entries are evicted",
+        ),
+        th.Property(
+            "skip_unchanged_records",
+            th.BooleanType,
+            default=False,
+            title="Skip unchanged records",
+            description="Do not emit group_posts, story and story_history rows "
+                        "identical to those emitted by the previous run",
+        ),
+        th.Property(
+            "full_refresh_days",
+            th.NumberType,
+            default=DEFAULT_FULL_REFRESH_DAYS,
+            title="Full refresh period",
+            description="With `skip_unchanged_records`, emit every row again once "
+                        "this many days have passed since the last full refresh",
+        ),
+        th.Property(
+            "full_refresh",
+            th.BooleanType,
+            default=False,
+            title="Full refresh",
+            description="Emit every row in this run regardless of "
+                        "`skip_unchanged_records`",
+        ),
+        th.Property(
+            "author_cache_ttl_days",
+            th.NumberType,
+            default=DEFAULT_PROFILE_TTL_DAYS,
+            title="Author cache TTL",
+            description="Days a resolved comment author profile is reused before "
+                        "it is requested again",
+        ),
+        th.Property(
+            "fast_output",
+            th.BooleanType,
+            default=False,
+            title="Fast output",
+            description="Serialize RECORD messages with orjson (if installed) and "
+                        "write stdout in large buffered chunks",
+        ),
+        th.Property(
+            "output_buffer_kb",
+            th.IntegerType,
+            default=DEFAULT_OUTPUT_BUFFER_KB,
+            title="Output buffer size",
+            description="Kilobytes of messages collected before they are written "
+                        "when `fast_output` is set",
+        ),
+        th.Property(
+            "skip_record_conformance",
+            th.BooleanType,
+            default=False,
+            title="Skip record conformance",
+            description="Do not conform records that the tap builds itself to the "
+                        "schema before writing them",
+        ),
+        th.Property(
+            "stream_batch_config",
+            th.ObjectType(
+                additional_properties=th.ObjectType(
+                    th.Property(
+                        "encoding",
+                        th.ObjectType(
+                            th.Property(
+                                "format",
+                                th.StringType,
+                                allowed_values=["jsonl", "parquet"],
+                            ),
+                            th.Property(
+                                "compression",
+                                th.StringType,
+                                allowed_values=["gzip", "none"],
+                            ),
+                        ),
+                    ),
+                    th.Property(
+                        "storage",
+                        th.ObjectType(
+                            th.Property("root", th.StringType),
+                            th.Property("prefix", th.StringType),
+                        ),
+                    ),
+                    th.Property(
+                        "batch_size",
+                        th.IntegerType,
+                        description="Maximum number of records in a file",
+                    ),
+                    th.Property(
+                        "max_file_mb",
+                        th.NumberType,
+                        description=f"Size in megabytes after which a file is rotated, "
+                                    f"{DEFAULT_BATCH_FILE_MB} by default",
+                    ),
+                )
+            ),
+            title="Batch config per stream",
+            description="BATCH output of `group_posts_comments` and `groupStat`, "
+                        "merged over `batch_config`. Files go to `cache_dir/batches` "
+                        "unless a storage root is set",
+        ),
+        th.Property(
+            "metrics_textfile",
+            th.StringType,
+            title="Metrics textfile",
+            description="Path of a Prometheus textfile with per-method VK API metrics, "
+                        "written at the end of the run",
+        ),
         th.Property(
             "params",
             th.ObjectType(
@@ -49,6 +396,344 @@ class TapVk(Tap):
         ),
     ).to_dict()
 
+    @cached_property
+    def client(self) -> VkClient:
+        """Return the VK API session shared by all streams.
+
+        Returns:
+            A pooled VK API client.
+        """
+        # Каждому потоку нужно своё соединение, иначе пул их выбрасывает
+        threads = (
+            self.config.get("group_concurrency", DEFAULT_GROUP_CONCURRENCY)
+            * self.config.get("concurrency", DEFAULT_CONCURRENCY)
+        )
+        pool_size = max(self.config.get("http_pool_size", DEFAULT_POOL_SIZE), threads)
+        token_type = self.config.get("token_type", "user")
+        transport = self.config.get("transport", "live")
+        rps = self.config.get("requests_per_second")
+        if rps is None and transport == "replay":
+            rps = float("inf")
+        elif rps is not None:
+            # Из файла конфига SDK читает дробные числа как Decimal
+            rps = float(rps)
+        tokens = self.token_pool
+        limiter = None
+        if rps is not None:
+            token_types = {token.token_type for token in tokens.tokens}
+            limiter = RateLimiter(dict.fromkeys(token_types, rps))
+        return VkClient(
+            self.config.get("token"),
+            token_type=token_type,
+            tokens=tokens,
+            pool_size=pool_size,
+            max_retries=self.config.get("max_retries", DEFAULT_MAX_RETRIES),
+            api_url=self.config.get("api_url", API_URL),
+            limiter=limiter,
+            transport=make_adapter(
+                transport,
+                self.config.get("fixtures_path"),
+                pool_size=pool_size,
+            ),
+            cache=self.response_cache,
+            logger=self.logger,
+        )
+
+    @cached_property
+    def token_pool(self) -> TokenPool:
+        """Return the tokens from ``token`` and ``tokens``.
+
+        Daily usage is kept in ``cache_dir`` between runs.
+
+        Returns:
+            The token pool used by :attr:`client`.
+        """
+        tokens = []
+        if self.config.get("token"):
+            token_type = self.config.get("token_type", "user")
+            tokens.append(PooledToken(
+                self.config["token"],
+                token_type=token_type,
+                name=f"token ({token_type})",
+            ))
+        for index, entry in enumerate(self.config.get("tokens") or [], start=1):
+            token_type = entry.get("token_type", "user")
+            tokens.append(PooledToken(
+                entry["token"],
+                token_type=token_type,
+                group_ids=entry.get("group_ids"),
+                daily_quota=entry.get("daily_quota"),
+                name=f"tokens[{index}] ({token_type})",
+            ))
+        cache_dir = Path(self.config.get("cache_dir", DEFAULT_CACHE_DIR))
+        return TokenPool(tokens, usage_path=cache_dir / "token_usage.json")
+
+    @cached_property
+    def response_cache(self) -> ResponseCache | None:
+        """Return the on-disk API response cache if it is enabled.
+
+        Returns:
+            The response cache, or ``None`` unless ``response_cache`` is set.
+        """
+        if not self.config.get("response_cache"):
+            return None
+        cache_dir = Path(self.config.get("cache_dir", DEFAULT_CACHE_DIR))
+        max_mb = self.config.get("response_cache_max_mb", DEFAULT_RESPONSE_CACHE_MB)
+        return ResponseCache(
+            cache_dir / "responses.sqlite",
+            self.config.get("response_cache_ttls"),
+            max_bytes=max_mb * 1024 * 1024,
+        )
+
+    @cached_property
+    def db_pool(self) -> ThreadedConnectionPool:
+        """Return the Postgres connection pool, created on first use.
+
+        Connection settings are taken from ``params``.
+
+        Returns:
+            A thread-safe psycopg2 connection pool.
+        """
+        params = self.config.get("params") or {}
+        return ThreadedConnectionPool(
+            1,
+            max(self.config.get("group_concurrency", DEFAULT_GROUP_CONCURRENCY), 1),
+            host=params.get("host"),
+            port=params.get("port"),
+            dbname=params.get("database"),
+            user=params.get("user"),
+            password=params.get("password"),
+        )
+
+    @contextmanager
+    def db_connection(self) -> t.Iterator:
+        """Borrow a connection from :attr:`db_pool`.
+
+        Yields:
+            A psycopg2 connection, returned to the pool on exit.
+        """
+        conn = self.db_pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.db_pool.putconn(conn)
+
+    @cached_property
+    def story_ids(self) -> StoryIdCache:
+        """Return the on-disk cache of known story IDs.
+
+        Returns:
+            Story ID indexes per community.
+        """
+        return StoryIdCache(self.config.get("cache_dir", DEFAULT_CACHE_DIR))
+
+    @cached_property
+    def comment_author_ids(self) -> set[int]:
+        """Return the ``from_id`` values collected by the comments stream.
+
+        Returns:
+            A set filled in during the run.
+        """
+        return set()
+
+    @cached_property
+    def unfinished_comment_posts(self) -> set[tuple[int, int]]:
+        """Return the posts whose comments were read only in part.
+
+        Returns:
+            A set of ``(group_id, post_id)`` filled in by the comments stream.
+        """
+        return set()
+
+    @cached_property
+    def comment_first_pages(self) -> dict[int, dict[int, dict]]:
+        """Return the first comment pages requested ahead by ``group_posts``.
+
+        Returns:
+            ``wall.getComments`` responses by community and post ID, taken
+            by the comments stream when it syncs the post.
+        """
+        return {}
+
+    @cached_property
+    def profile_cache(self) -> ProfileCache:
+        """Return the on-disk cache of resolved comment authors.
+
+        Returns:
+            Profiles by author ID.
+        """
+        cache_dir = Path(self.config.get("cache_dir", DEFAULT_CACHE_DIR))
+        # Дробное число дней из файла конфига приходит как Decimal
+        days = float(
+            self.config.get("author_cache_ttl_days", DEFAULT_PROFILE_TTL_DAYS)
+        )
+        return ProfileCache(cache_dir / "profiles.sqlite", ttl=days * 24 * 60 * 60)
+
+    @cached_property
+    def message_writer(self) -> MessageWriter | None:
+        """Return the buffered writer used with ``fast_output``.
+
+        Returns:
+            The writer, or ``None`` to write through the SDK.
+        """
+        if not self.config.get("fast_output"):
+            return None
+        buffer_kb = self.config.get("output_buffer_kb", DEFAULT_OUTPUT_BUFFER_KB)
+        return MessageWriter(buffer_kb * 1024)
+
+    @cached_property
+    def batch_writers(self) -> dict[str, RotatingBatchWriter]:
+        """Return the open batch file writers by stream name."""
+        return {}
+
+    def flush_batches(self) -> int:
+        """Close the open batch files and emit their BATCH messages.
+
+        Returns:
+            Number of files closed.
+        """
+        closed = 0
+        for name, writer in self.batch_writers.items():
+            manifest = writer.flush()
+            if manifest:
+                self.streams[name]._write_batch_message(writer.encoding, manifest)  # noqa: SLF001
+                closed += 1
+        return closed
+
+    @cached_property
+    def pending_fingerprints(self) -> list[tuple[FingerprintStore, bool]]:
+        """Return the fingerprints of partitions waiting for a STATE message.
+
+        Returns:
+            ``(store, full_refresh)`` pairs filled in by the streams.
+        """
+        return []
+
+    def save_fingerprints(self) -> None:
+        """Save the fingerprints of the partitions read so far.
+
+        Called after every STATE message: the rows behind a fingerprint are
+        then covered by a checkpoint, so a run that fails earlier emits them
+        again instead of skipping them as unchanged.
+        """
+        pending = self.pending_fingerprints
+        while pending:
+            store, full_refresh = pending.pop(0)
+            store.save(full_refresh=full_refresh)
+
+    def write_message(self, message: Message) -> None:
+        """Write a Singer message, through :attr:`message_writer` if enabled.
+
+        Open batch files are closed before a STATE message, so the
+        checkpoint only covers records already announced in BATCH messages.
+        Pending fingerprints are saved after it.
+
+        Args:
+            message: The message to write.
+        """
+        if isinstance(message, StateMessage) and self.batch_writers:
+            self.flush_batches()
+        writer = self.message_writer
+        if writer is None:
+            super().write_message(message)
+        else:
+            writer.write(message)
+        if isinstance(message, StateMessage) and self.pending_fingerprints:
+            self.save_fingerprints()
+
+    @classmethod
+    def invoke(  # type: ignore[override]
+            cls,
+            *,
+            about: bool = False,
+            about_format: str | None = None,
+            config: tuple[str, ...] = (),
+            state: Path | None = None,
+            catalog: Path | None = None,
+    ) -> None:
+        """Invoke the tap's command line interface.
+
+        Same as the SDK's ``Tap.invoke``, with :meth:`teardown` after the sync,
+        whether it succeeded or not.
+
+        Args:
+            about: Display package metadata and settings.
+            about_format: Specify output style for `--about`.
+            config: Configuration file location or 'ENV' to use environment
+                variables. Accepts multiple inputs as a tuple.
+            state: Use a bookmarks file for incremental replication.
+            catalog: Use a Singer catalog file with the tap.
+        """
+        super(Tap, cls).invoke(about=about, about_format=about_format)
+        cls.print_version(print_fn=cls.logger.info)
+        config_files, parse_env_config = cls.config_from_cli_args(*config)
+
+        tap = cls(
+            config=config_files,  # type: ignore[arg-type]
+            state=state,
+            catalog=catalog,
+            parse_env_config=parse_env_config,
+            validate_config=True,
+        )
+        try:
+            tap.sync_all()
+        except BaseException:
+            tap.teardown(completed=False)
+            raise
+        tap.teardown()
+
+    def teardown(self, *, completed: bool = True) -> None:
+        """Finish a sync: write out buffered output and release shared resources.
+
+        Emits the BATCH messages of files still open, flushes
+        :attr:`message_writer`, reports connection reuse, API and pipeline
+        metrics, saves the token usage and closes the client, the Postgres
+        pool and the profile cache. ``sync_all`` is final in the SDK, so the
+        CLI (:meth:`invoke`) calls this after it; programmatic callers of
+        ``sync_all`` should call it too.
+
+        Args:
+            completed: ``False`` after a failed sync: files are still
+                announced, but no final STATE message is written.
+        """
+        # Последние файлы батчей закрываются вместе с итоговым состоянием
+        if self.flush_batches() and completed:
+            self.write_message(StateMessage(value=self.state))
+        for writer in self.batch_writers.values():
+            writer.close()
+        if self.message_writer is not None:
+            self.message_writer.flush()
+        self.client.log_connection_stats()
+        self.client.metrics.log()
+        self.client.log_token_stats()
+        for stream in self.streams.values():
+            t.cast("VkStream", stream).log_pipeline_stats()
+        if self.config.get("metrics_textfile"):
+            self.client.metrics.write_prometheus(self.config["metrics_textfile"])
+        self.client.close()
+        if "db_pool" in self.__dict__:
+            self.db_pool.closeall()
+        if "profile_cache" in self.__dict__:
+            self.profile_cache.close()
+
+    @property
+    def streams(self) -> dict[str, Stream]:
+        """Return the streams in sync order.
+
+        The SDK sorts streams by name; ``comment_authors`` resolves the authors
+        collected by ``group_posts_comments`` and has to be synced after it.
+
+        Returns:
+            Streams by name.
+        """
+        tap_streams = super().streams
+        if (
+            "comment_authors" in tap_streams
+            and next(reversed(tap_streams)) != "comment_authors"
+        ):
+            tap_streams["comment_authors"] = tap_streams.pop("comment_authors")
+        return tap_streams
+
     def discover_streams(self) -> list[streams.VkStream]:
         """Return a list of discovered streams.
 
@@ -60,6 +745,7 @@ class TapVk(Tap):
            streams.GroupsStream(self),
            streams.GroupPostsStream(self),
            streams.GroupPostsCommentsStream(self),
+           streams.CommentAuthorsStream(self),
            streams.StoryStream(self),
            streams.StoryHistoryStream(self),
         ]
@@ -0,0 +1,300 @@
+"""Pool of VK access tokens shared by all streams of the tap."""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+from tap_vk.ratelimit import FLOOD_CONTROL_CODE, RATE_LIMIT_CODE, TOO_MANY_RPS_CODE
+from tap_vk.storage import write_json_atomic
+
+if t.TYPE_CHECKING:
+    import os
+
+AUTH_FAILED_CODE = 5
+# На сколько секунд токен выводится из ротации после ошибки VK
+QUARANTINE_SECONDS = {
+    TOO_MANY_RPS_CODE: 1.0,
+    FLOOD_CONTROL_CODE: 60.0,
+    RATE_LIMIT_CODE: 60.0 * 60,
+    AUTH_FAILED_CODE: float("inf"),
+}
+
+_OWNER_ID = re.compile(r'"(?:owner_id|group_id)":\s*"?(-?\d+)')
+_OBJECT_OWNER = re.compile(r"(-?\d+)_\d+")
+
+
+class NoTokenAvailableError(Exception):
+    """Every token allowed for a call is revoked or out of its daily quota."""
+
+
+class PooledToken:
+    """One access token with its permissions and usage counters."""
+
+    def __init__(
+            self,
+            token: str,
+            *,
+            token_type: str = "user",  # noqa: S107
+            group_ids: t.Iterable[int] | None = None,
+            daily_quota: int | None = None,
+            name: str | None = None,
+    ) -> None:
+        """Create the token entry.
+
+        Args:
+            token: VK access token.
+            token_type: ``user``, ``community`` or ``service``.
+            group_ids: Communities the token may be used for, all if ``None``.
+            daily_quota: Maximum number of requests per day, unlimited if ``None``.
+            name: Label used in logs instead of the token itself.
+        """
+        self.token = token
+        self.token_type = token_type
+        self.group_ids = None
+        if group_ids is not None:
+            self.group_ids = frozenset(abs(int(i)) for i in group_ids)
+        self.daily_quota = daily_quota
+        self.name = name or f"{token_type} token"
+        self.key = hashlib.sha256(token.encode()).hexdigest()[:16]
+        self.in_flight = 0
+        self.day = ""
+        self.used_today = 0
+        self.quarantined_until = 0.0
+        self.last_error: int | None = None
+
+    def allows(self, groups: frozenset[int]) -> bool:
+        """Return ``True`` if the token may be used for all ``groups``."""
+        return self.group_ids is None or groups <= self.group_ids
+
+    @property
+    def load(self) -> tuple[int, float, int]:
+        """Sort key of the least-loaded token: requests in flight, then quota used."""
+        share = self.used_today / self.daily_quota if self.daily_quota else 0.0
+        return self.in_flight, share, self.used_today
+
+    def __repr__(self) -> str:
+        """Name the token without revealing it."""
+        return f"<PooledToken {self.name}>"
+
+
+class TokenPool:
+    """Dispatcher choosing a token for every VK API call.
+
+    Each call goes to the least-loaded token allowed for the communities it
+    touches. Tokens that VK rejects (authorization failed) are dropped for
+    the rest of the run; tokens that hit rate limits are kept out of
+    rotation for a while, see :data:`QUARANTINE_SECONDS`. When every
+    allowed token is quarantined for rate limits, the one released soonest
+    is used, so a single-token pool behaves like a plain token.
+    """
+
+    def __init__(
+            self,
+            tokens: t.Sequence[PooledToken],
+            *,
+            usage_path: str | os.PathLike | None = None,
+            clock: t.Callable[[], float] = time.time,
+    ) -> None:
+        """Create the pool.
+
+        Args:
+            tokens: Tokens in order of preference.
+            usage_path: JSON file keeping the daily usage between runs.
+            clock: Wall clock, replaceable in tests.
+
+        Raises:
+            ValueError: If ``tokens`` is empty.
+        """
+        if not tokens:
+            msg = "At least one VK access token is required"
+            raise ValueError(msg)
+        self.tokens = list(tokens)
+        self.usage_path = Path(usage_path) if usage_path else None
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._load_usage()
+
+    @classmethod
+    def single(
+            cls,
+            token: str | None,
+            token_type: str = "user",  # noqa: S107
+    ) -> TokenPool:
+        """Return a pool with one unrestricted token."""
+        name = f"{token_type} token"
+        return cls([PooledToken(token or "", token_type=token_type, name=name)])
+
+    @property
+    def scope(self) -> str:
+        """Fingerprint of the pool, used to separate cached responses."""
+        return "+".join(sorted(token.key for token in self.tokens))
+
+    def _today(self) -> str:
+        now = datetime.datetime.fromtimestamp(self._clock(), datetime.timezone.utc)
+        return now.date().isoformat()
+
+    def _read_usage(self) -> dict:
+        if self.usage_path is None or not self.usage_path.exists():
+            return {}
+        return json.loads(self.usage_path.read_text(encoding="utf-8"))
+
+    def _load_usage(self) -> None:
+        usage = self._read_usage()
+        today = self._today()
+        for token in self.tokens:
+            entry = usage.get(token.key)
+            if entry and entry.get("day") == today:
+                token.day = today
+                token.used_today = entry.get("used", 0)
+
+    def save_usage(self) -> None:
+        """Write the daily usage of every token to :attr:`usage_path`.
+
+        Entries of tokens missing from this pool are kept until their day is over.
+        """
+        if self.usage_path is None:
+            return
+        today = self._today()
+        usage = {
+            key: entry
+            for key, entry in self._read_usage().items()
+            if entry.get("day") == today
+        }
+        with self._lock:
+            usage.update(
+                (token.key, {"day": token.day, "used": token.used_today})
+                for token in self.tokens
+                if token.day
+            )
+        write_json_atomic(self.usage_path, usage)
+
+    @staticmethod
+    def call_groups(values: dict | None) -> frozenset[int]:
+        """Return the communities a call touches, as far as its parameters tell."""
+        values = values or {}
+        groups: set[int] = set()
+        for key in ("owner_id", "group_id"):
+            if values.get(key):
+                groups.add(abs(int(values[key])))
+        if values.get("group_ids"):
+            ids = values["group_ids"]
+            ids = ids.split(",") if isinstance(ids, str) else ids
+            groups.update(abs(int(i)) for i in ids)
+        if values.get("stories"):
+            ids = values["stories"]
+            ids = ids if isinstance(ids, str) else ",".join(ids)
+            groups.update(abs(int(i)) for i in _OBJECT_OWNER.findall(ids))
+        if values.get("code"):
+            groups.update(abs(int(i)) for i in _OWNER_ID.findall(values["code"]))
+        return frozenset(groups)
+
+    def acquire(self, values: dict | None = None) -> PooledToken:
+        """Choose a token for a call and mark it busy.
+
+        Args:
+            values: Call parameters, used to find the communities involved.
+
+        Raises:
+            NoTokenAvailableError: If no allowed token is usable any more.
+        """
+        groups = self.call_groups(values)
+        now = self._clock()
+        today = self._today()
+        with self._lock:
+            allowed = [token for token in self.tokens if token.allows(groups)]
+            if not allowed:
+                msg = f"No token is allowed for communities {sorted(groups)}"
+                raise NoTokenAvailableError(msg)
+            usable = []
+            for token in allowed:
+                if token.day != today:
+                    token.day = today
+                    token.used_today = 0
+                if token.quarantined_until == float("inf"):
+                    continue
+                quota = token.daily_quota
+                if quota is not None and token.used_today >= quota:
+                    continue
+                usable.append(token)
+            if not usable:
+                msg = "Every token is revoked or out of its daily quota: " + ", ".join(
+                    f"{token.name} (error {token.last_error}, "
+                    f"{token.used_today} calls today)"
+                    for token in allowed
+                )
+                raise NoTokenAvailableError(msg)
+            ready = [token for token in usable if token.quarantined_until <= now]
+            if ready:
+                token = min(ready, key=lambda token: token.load)
+            else:
+                token = min(usable, key=lambda token: token.quarantined_until)
+            token.in_flight += 1
+            token.used_today += 1
+            return token
+
+    def release(
+            self,
+            token: PooledToken,
+            error_code: int | None = None,
+            values: dict | None = None,
+    ) -> bool:
+        """Return a token to the pool after a call.
+
+        Args:
+            token: Token returned by :meth:`acquire`.
+            error_code: VK error code if the call failed.
+            values: Parameters of the call, used to find the tokens allowed
+                to repeat it.
+
+        Returns:
+            ``True`` if the token was quarantined and another token allowed
+            for the call is ready to repeat it.
+        """
+        with self._lock:
+            token.in_flight -= 1
+            quarantine = None
+            if error_code is not None:
+                quarantine = QUARANTINE_SECONDS.get(error_code)
+            if quarantine is None:
+                return False
+            token.last_error = error_code
+            now = self._clock()
+            token.quarantined_until = max(token.quarantined_until, now + quarantine)
+            # Переключаться есть смысл, только если acquire выдаст другой
+            # токен: разрешённый для тех же сообществ, свободный и с квотой
+            groups = self.call_groups(values)
+            today = self._today()
+            return any(
+                other is not token
+                and other.allows(groups)
+                and other.quarantined_until <= now
+                and (
+                    other.daily_quota is None
+                    or other.day != today
+                    or other.used_today < other.daily_quota
+                )
+                for other in self.tokens
+            )
+
+    def stats(self) -> list[dict]:
+        """Return the usage of every token for logging."""
+        now = self._clock()
+        with self._lock:
+            return [
+                {
+                    "name": token.name,
+                    "token_type": token.token_type,
+                    "used_today": token.used_today,
+                    "daily_quota": token.daily_quota,
+                    "quarantined": token.quarantined_until > now,
+                    "last_error": token.last_error,
+                }
+                for token in self.tokens
+            ]
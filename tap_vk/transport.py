@@ -0,0 +1,221 @@
+"""Pluggable HTTP transports: live, recording to fixtures and replaying them."""
+
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import threading
+import typing as t
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+TRANSPORT_MODES = ("live", "record", "replay")
+
+
+def request_key(request: requests.PreparedRequest) -> tuple[str, str]:
+    """Return the ``(method, normalized params)`` key of a VK API request.
+
+    The access token is left out, so fixtures recorded with one token can be
+    replayed with any other.
+    """
+    method = urlsplit(request.url or "").path.rstrip("/").rsplit("/", 1)[-1]
+    body = request.body or ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    params = sorted(
+        (key, value)
+        for key, value in parse_qsl(body, keep_blank_values=True)
+        if key != "access_token"
+    )
+    return method, json.dumps(params, ensure_ascii=False, separators=(",", ":"))
+
+
+class FixtureStore:
+    """Recorded VK API responses kept in a gzip-compressed JSON Lines file.
+
+    Every line holds one exchange: method, normalized parameters, HTTP status
+    and response body. Identical requests are replayed in the order they were
+    recorded, the last response is repeated once they run out. Requests that
+    were never recorded get the exchange of the same method sharing the most
+    parameters, since some of them (``timestamp_to`` of ``stats.get``) depend
+    on the time of the run.
+    """
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        """Load the fixtures from ``path`` if it exists.
+
+        Args:
+            path: Fixture file, usually ``*.jsonl.gz``.
+        """
+        self.path = Path(path)
+        self.exchanges: list[dict] = []
+        self._lock = threading.Lock()
+        self._replayed: dict[tuple[str, str], int] = {}
+        self._index: dict[tuple[str, str], list[dict]] = {}
+        self._methods: dict[str, list[tuple[frozenset, tuple[str, str]]]] = {}
+        if self.path.exists():
+            with gzip.open(self.path, "rt", encoding="utf-8") as fixture_file:
+                for line in fixture_file:
+                    if line.strip():
+                        self._append(json.loads(line))
+
+    def _append(self, exchange: dict) -> None:
+        self.exchanges.append(exchange)
+        key = (exchange["method"], exchange["params"])
+        if key not in self._index:
+            params = frozenset(tuple(pair) for pair in json.loads(exchange["params"]))
+            self._methods.setdefault(exchange["method"], []).append((params, key))
+        self._index.setdefault(key, []).append(exchange)
+
+    def _closest(self, key: tuple[str, str]) -> tuple[str, str] | None:
+        method, params = key
+        wanted = frozenset(tuple(pair) for pair in json.loads(params))
+        candidates = self._methods.get(method)
+        if not candidates:
+            return None
+        return max(candidates, key=lambda candidate: len(candidate[0] & wanted))[1]
+
+    def add(self, key: tuple[str, str], status: int, body: str) -> None:
+        """Record one exchange."""
+        method, params = key
+        with self._lock:
+            self._append(
+                {"method": method, "params": params, "status": status, "body": body}
+            )
+
+    def next(self, key: tuple[str, str]) -> dict | None:
+        """Return the next recorded exchange for ``key``.
+
+        Returns:
+            The exchange, or ``None`` if the method was never recorded.
+        """
+        with self._lock:
+            if key not in self._index:
+                closest = self._closest(key)
+                if closest is None:
+                    return None
+                key = closest
+            exchanges = self._index[key]
+            position = self._replayed.get(key, 0)
+            self._replayed[key] = position + 1
+            return exchanges[min(position, len(exchanges) - 1)]
+
+    def save(self) -> None:
+        """Write all exchanges back to :attr:`path`."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with self._lock, gzip.open(tmp_path, "wt", encoding="utf-8") as fixture_file:
+            for exchange in self.exchanges:
+                fixture_file.write(json.dumps(exchange, ensure_ascii=False))
+                fixture_file.write("\n")
+        tmp_path.replace(self.path)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Pooled HTTP adapter that also stores every response in a fixture file.
+
+    The file is written when the adapter is closed, i.e. when the client's
+    session is closed at the end of the run.
+    """
+
+    def __init__(self, store: FixtureStore, **kwargs: t.Any) -> None:
+        """Create the adapter.
+
+        Args:
+            store: Fixtures the responses are added to.
+            kwargs: Passed to :class:`requests.adapters.HTTPAdapter`.
+        """
+        super().__init__(**kwargs)
+        self.store = store
+
+    def send(
+            self,
+            request: requests.PreparedRequest,
+            *args: t.Any,
+            **kwargs: t.Any,
+    ) -> requests.Response:
+        """Send the request and record the response."""
+        response = super().send(request, *args, **kwargs)
+        self.store.add(request_key(request), response.status_code, response.text)
+        return response
+
+    def close(self) -> None:
+        """Close the connections and save the fixtures."""
+        super().close()
+        self.store.save()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Adapter answering from a fixture file without touching the network."""
+
+    def __init__(self, store: FixtureStore) -> None:
+        """Create the adapter.
+
+        Args:
+            store: Fixtures to answer from.
+        """
+        super().__init__()
+        self.store = store
+
+    def send(
+            self,
+            request: requests.PreparedRequest,
+            *args: t.Any,  # noqa: ARG002
+            **kwargs: t.Any,  # noqa: ARG002
+    ) -> requests.Response:
+        """Return the recorded response for ``request``.
+
+        Raises:
+            requests.ConnectionError: If nothing was recorded for the request.
+        """
+        key = request_key(request)
+        exchange = self.store.next(key)
+        if exchange is None:
+            msg = f"No recorded response for {key[0]} with {key[1]}"
+            raise requests.ConnectionError(msg, request=request)
+        response = requests.Response()
+        response.status_code = exchange["status"]
+        response._content = exchange["body"].encode("utf-8")  # noqa: SLF001
+        response.encoding = "utf-8"
+        response.headers["Content-Type"] = "application/json; charset=utf-8"
+        response.url = request.url or ""
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+def make_adapter(
+        mode: str = "live",
+        fixtures_path: str | os.PathLike | None = None,
+        *,
+        pool_size: int = 10,
+) -> BaseAdapter:
+    """Build the transport adapter for a client.
+
+    Args:
+        mode: ``live``, ``record`` or ``replay``.
+        fixtures_path: Fixture file, required for ``record`` and ``replay``.
+        pool_size: Maximum number of keep-alive connections per host.
+
+    Raises:
+        ValueError: If the mode is unknown or the fixture file is missing.
+    """
+    if mode not in TRANSPORT_MODES:
+        expected = ", ".join(TRANSPORT_MODES)
+        msg = f"Unknown transport {mode!r}, expected one of {expected}"
+        raise ValueError(msg)
+    if mode == "live":
+        return HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    if fixtures_path is None:
+        msg = f"Transport {mode!r} needs a fixtures path"
+        raise ValueError(msg)
+    store = FixtureStore(fixtures_path)
+    if mode == "record":
+        return RecordingAdapter(store, pool_connections=1, pool_maxsize=pool_size)
+    return ReplayAdapter(store)
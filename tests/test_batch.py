@@ -0,0 +1,152 @@
+"""Rotating batch files and BATCH messages."""
+
+from __future__ import annotations
+
+import contextlib
+import gzip
+import io
+import json
+from pathlib import Path
+from urllib.parse import urlparse
+
+import pytest
+from singer_sdk.helpers._batch import BatchConfig
+
+from tap_vk import batch
+from tap_vk.batch import RotatingBatchWriter
+from tap_vk.standin import SyntheticVk, VkStandIn
+from tap_vk.tap import TapVk
+
+SCHEMA = {
+    "properties": {
+        "id": {"type": ["integer", "null"]},
+        "text": {"type": ["string", "null"]},
+        "score": {"type": ["number", "null"]},
+        "tags": {"type": ["array", "null"], "items": {"type": "string"}},
+    },
+}
+
+
+def make_writer(
+        root: Path,
+        batch_size: int = 10,
+        file_format: str = "jsonl",
+        compression: str = "gzip",
+) -> RotatingBatchWriter:
+    """Return a writer of ``stream`` files under ``root``."""
+    config = BatchConfig.from_dict({
+        "encoding": {"format": file_format, "compression": compression},
+        "storage": {"root": root.as_uri(), "prefix": "vk/"},
+        "batch_size": batch_size,
+    })
+    return RotatingBatchWriter("tap-vk", "stream", config, SCHEMA)
+
+
+def records(count: int) -> list[dict]:
+    """Return ``count`` records of :data:`SCHEMA`."""
+    return [
+        {"id": i, "text": f"text {i}", "score": i / 2, "tags": ["a", str(i)]}
+        for i in range(count)
+    ]
+
+
+def write_all(writer: RotatingBatchWriter, rows: list[dict]) -> list[list[str]]:
+    """Write ``rows`` and return the manifests of the files closed meanwhile."""
+    return [manifest for row in rows if (manifest := writer.write(row))]
+
+
+def manifest_path(manifest: list[str]) -> Path:
+    """Return the local path of a single-file manifest."""
+    (url,) = manifest
+    return Path(urlparse(url).path)
+
+
+def read_jsonl(path: Path) -> list[dict]:
+    """Read the records of a JSON Lines batch file."""
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as batch_file:
+        return [json.loads(line) for line in batch_file]
+
+
+def test_files_rotate_at_batch_size(tmp_path):
+    """A file is handed out every ``batch_size`` records, the rest on flush."""
+    writer = make_writer(tmp_path)
+    manifests = write_all(writer, records(25))
+    assert len(manifests) == 2
+    manifests.append(writer.close())
+
+    paths = [manifest_path(manifest) for manifest in manifests]
+    assert all(path.name.startswith("tap-vk--stream-") for path in paths)
+    assert all(path.name.endswith(".json.gz") for path in paths)
+    assert all(path.parent.name == "vk" for path in paths)
+    assert [row for path in paths for row in read_jsonl(path)] == records(25)
+    assert writer.close() is None
+
+
+def test_files_rotate_at_max_size(tmp_path):
+    """A file is handed out once it grows over ``max_file_mb``."""
+    writer = make_writer(tmp_path, batch_size=1000, compression="none")
+    writer.max_bytes = 500
+    manifests = write_all(writer, records(50))
+    manifests.append(writer.close())
+    paths = [manifest_path(manifest) for manifest in manifests]
+    assert len(paths) > 2
+    # Файл закрывается на первой записи, после которой он больше лимита
+    assert all(path.stat().st_size < 500 + 100 for path in paths)
+    assert [row for path in paths for row in read_jsonl(path)] == records(50)
+
+
+@pytest.mark.parametrize("compression", ["gzip", "none"])
+def test_parquet_files(tmp_path, monkeypatch, compression):
+    """Parquet files keep scalar types and store other values as JSON."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(batch, "PARQUET_ROW_GROUP_SIZE", 3)
+    writer = make_writer(tmp_path, file_format="parquet", compression=compression)
+    (manifest,) = write_all(writer, records(10))
+    path = manifest_path(manifest)
+    assert path.name.endswith(".parquet.gz" if compression == "gzip" else ".parquet")
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.metadata.num_row_groups == 4
+    assert str(parquet_file.schema_arrow.field("id").type) == "int64"
+    assert str(parquet_file.schema_arrow.field("score").type) == "double"
+    rows = parquet_file.read().to_pylist()
+    assert [{**row, "tags": json.loads(row["tags"])} for row in rows] == records(10)
+    writer.close()
+
+
+def test_batch_messages_of_a_sync(tmp_path):
+    """Comments are written to files announced in BATCH messages before STATE."""
+    data = SyntheticVk(posts=20, comments=2, replies=1)
+    with VkStandIn(data) as standin:
+        tap = TapVk(
+            config={
+                "token": "test-token",
+                "group_ids": [1, 2],
+                "api_url": standin.url,
+                "requests_per_second": 1e6,
+                "cache_dir": str(tmp_path),
+                "stream_batch_config": {
+                    "group_posts_comments": {"batch_size": 50},
+                },
+            },
+            parse_env_config=False,
+        )
+        for name, stream in tap.streams.items():
+            stream.selected = name == "group_posts_comments"
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            tap.sync_all()
+            tap.teardown()
+
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert not [message for message in messages if message["type"] == "RECORD"]
+    batches = [message for message in messages if message["type"] == "BATCH"]
+    rows = [
+        row
+        for message in batches
+        for url in message["manifest"]
+        for row in read_jsonl(Path(urlparse(url).path))
+    ]
+    assert len(rows) == 2 * 20 * 2 * 2
+    assert len({(row["group_id"], row["comment_id"]) for row in rows}) == len(rows)
+    assert messages[-1]["type"] == "STATE"
@@ -0,0 +1,428 @@
+"""VK client calls, ``execute`` batches, retries, metrics and partition prefetching."""
+
+from __future__ import annotations
+
+import io
+import json
+import re
+import threading
+import time
+import typing as t
+from urllib.parse import parse_qsl
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from singer_sdk.exceptions import ConfigValidationError
+from vk_api.exceptions import ApiError
+
+from tap_vk.client import PartitionPrefetcher, VkClient, chunked
+from tap_vk.ratelimit import FLOOD_CONTROL_CODE, TOO_MANY_RPS_CODE, RateLimiter
+from tap_vk.standin import SyntheticVk, VkStandIn
+from tap_vk.storage import ResponseCache
+from tap_vk.streams import POST_REACH_FIELDS
+from tap_vk.tap import TapVk
+from tap_vk.tokens import PooledToken, TokenPool
+
+if t.TYPE_CHECKING:
+    from pathlib import Path
+
+# Вызов внутри кода execute: API.wall.getComments({...})
+CALL_RE = re.compile(r"API\.([\w.]+)\((\{.*?\})\)")
+
+
+class FakeVk(BaseAdapter):
+    """Transport answering VK API calls with ``answer(method, params)``."""
+
+    def __init__(self, answer: t.Callable[[str, dict], dict]) -> None:
+        """Create a transport without any calls."""
+        super().__init__()
+        self.answer = answer
+        self.calls: list[str] = []
+
+    def send(
+            self,
+            request: requests.PreparedRequest,
+            *_args: t.Any,
+            **_kwargs: t.Any,
+    ) -> requests.Response:
+        """Answer a request without the network."""
+        method = (request.url or "").rsplit("/", 1)[-1]
+        self.calls.append(method)
+        params = dict(parse_qsl(str(request.body)))
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(json.dumps(self.answer(method, params)).encode())
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+def execute_calls(params: dict) -> list[tuple[str, dict]]:
+    """Return the method and parameters of every call of an ``execute``."""
+    return [
+        (method, json.loads(values))
+        for method, values in CALL_RE.findall(params["code"])
+    ]
+
+
+def make_client(
+        answer: t.Callable[[str, dict], dict],
+        cache: ResponseCache | None = None,
+) -> tuple[VkClient, FakeVk]:
+    """Return a client of ``answer`` without rate limiting or backoff delays."""
+    client = VkClient(
+        "test-token",
+        limiter=RateLimiter({"user": 1e6}),
+        backoff_factor=0,
+        max_retries=3,
+        cache=cache,
+    )
+    transport = FakeVk(answer)
+    client.http.mount("https://", transport)
+    return client, transport
+
+
+def answer_comments(method: str, params: dict) -> dict:
+    """Answer ``wall.getComments`` calls, failing those of post 999."""
+    assert method == "execute"
+    results: list[t.Any] = []
+    errors = []
+    for _, values in execute_calls(params):
+        if values["post_id"] == 999:
+            results.append(False)
+            errors.append({"error_code": 100, "error_msg": "Invalid post"})
+        else:
+            results.append({"count": 1, "items": [{"post_id": values["post_id"]}]})
+    return {"response": results, "execute_errors": errors}
+
+
+def test_method_raises_api_errors():
+    """An error object in the response is raised as :class:`ApiError`."""
+    client, _ = make_client(
+        lambda *_: {"error": {"error_code": 15, "error_msg": "Access denied"}}
+    )
+    with pytest.raises(ApiError) as error:
+        client.method("wall.get", {"owner_id": -1})
+    assert error.value.code == 15
+    client.close()
+
+
+def answer_wall(method: str, params: dict) -> dict:
+    """Answer ``wall.get`` pages of a wall with 250 posts."""
+    assert method == "wall.get"
+    offset, count = int(params["offset"]), int(params["count"])
+    items = [{"id": 250 - i} for i in range(offset, min(offset + count, 250))]
+    return {"response": {"count": 250, "items": items}}
+
+
+def throttle_first(calls: int, code: int = TOO_MANY_RPS_CODE) -> t.Callable:
+    """Return an answer throttling the first ``calls`` requests."""
+    sent = []
+
+    def answer(method: str, _params: dict) -> dict:
+        sent.append(method)
+        if len(sent) <= calls:
+            return {"error": {"error_code": code, "error_msg": "Too many requests"}}
+        return {"response": {"count": 0, "items": []}}
+
+    return answer
+
+
+def test_throttled_call_is_retried():
+    """Throttling errors are retried until the call goes through."""
+    client, transport = make_client(throttle_first(2))
+    assert client.method("wall.get", {"owner_id": -1}) == {"count": 0, "items": []}
+    assert transport.calls == ["wall.get"] * 3
+    client.close()
+
+
+def test_retries_stop_at_max_retries():
+    """After ``max_retries`` repeats the throttling error is raised."""
+    client, transport = make_client(throttle_first(10, FLOOD_CONTROL_CODE))
+    with pytest.raises(ApiError) as error:
+        client.method("wall.get", {"owner_id": -1})
+    assert error.value.code == FLOOD_CONTROL_CODE
+    assert transport.calls == ["wall.get"] * 4
+    client.close()
+
+
+def test_tokens_of_other_communities_do_not_take_over_retries():
+    """A free token not allowed for the call does not make the client switch."""
+    tokens = TokenPool([
+        PooledToken("a", group_ids=[1], name="a"),
+        PooledToken("b", group_ids=[2], name="b"),
+    ])
+    client = VkClient(
+        None,
+        tokens=tokens,
+        limiter=RateLimiter({"user": 1e6}),
+        backoff_factor=0,
+        max_retries=3,
+    )
+    transport = FakeVk(throttle_first(10, FLOOD_CONTROL_CODE))
+    client.http.mount("https://", transport)
+    with pytest.raises(ApiError):
+        client.method("wall.get", {"owner_id": -1})
+    assert transport.calls == ["wall.get"] * 4
+    client.close()
+
+
+def test_paginate_reads_all_pages():
+    """Every page is requested once, until ``count`` items were read."""
+    client, transport = make_client(answer_wall)
+    posts = list(client.paginate("wall.get", {"owner_id": -1}))
+    assert [post["id"] for post in posts] == list(range(250, 0, -1))
+    assert transport.calls == ["wall.get"] * 3
+    client.close()
+
+
+def test_paginate_is_lazy():
+    """Pages after the one being consumed are not requested."""
+    client, transport = make_client(answer_wall)
+    pages = client.paginate("wall.get", {"owner_id": -1})
+    next(pages)
+    pages.close()
+    assert transport.calls == ["wall.get"]
+    client.close()
+
+
+def test_batch_keeps_errors_per_call():
+    """A failed call inside ``execute`` does not affect its neighbours."""
+    client, transport = make_client(answer_comments)
+    with client.batch() as batch:
+        vk = batch.get_api()
+        good = vk.wall.getComments(owner_id=-1, post_id=1)
+        bad = vk.wall.getComments(owner_id=-1, post_id=999)
+    assert good.ok
+    assert good.result["items"] == [{"post_id": 1}]
+    assert not bad.ok
+    with pytest.raises(ApiError):
+        _ = bad.result
+    assert transport.calls == ["execute"]
+    client.close()
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_batch_sends_25_calls_per_execute(concurrency):
+    """Calls are split into ``execute`` requests of 25 and keep their order."""
+    client, transport = make_client(answer_comments)
+    with client.batch(concurrency) as batch:
+        vk = batch.get_api()
+        results = [vk.wall.getComments(owner_id=-1, post_id=i) for i in range(60)]
+    assert transport.calls == ["execute"] * 3
+    assert [result.result["items"][0]["post_id"] for result in results] == list(
+        range(60)
+    )
+    client.close()
+
+
+def test_batch_resends_throttled_calls():
+    """Only the calls of an ``execute`` that were throttled are sent again."""
+    throttled = {1, 3}
+
+    def answer(_: str, params: dict) -> dict:
+        results: list[t.Any] = []
+        errors = []
+        for _, values in execute_calls(params):
+            post_id = values["post_id"]
+            if post_id in throttled:
+                throttled.discard(post_id)
+                results.append(False)
+                errors.append({"error_code": FLOOD_CONTROL_CODE, "error_msg": "Flood"})
+            else:
+                results.append(post_id)
+        return {"response": results, "execute_errors": errors}
+
+    client, transport = make_client(answer)
+    with client.batch() as batch:
+        vk = batch.get_api()
+        results = [vk.wall.getComments(owner_id=-1, post_id=i) for i in range(5)]
+    assert [result.result for result in results] == list(range(5))
+    assert transport.calls == ["execute"] * 2
+    client.close()
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_map_keeps_the_order_of_items(concurrency):
+    """Results follow the order of the items, whichever call finishes first."""
+    def slow_double(item: int) -> int:
+        time.sleep((10 - item) / 1000)
+        return item * 2
+
+    results = VkClient.map(slow_double, range(10), concurrency)
+    assert list(results) == [item * 2 for item in range(10)]
+
+
+def test_prefetcher_fetches_partitions_ahead():
+    """Partitions are fetched at once and handed out in partition order."""
+    partitions = [{"group_id": group_id} for group_id in range(1, 5)]
+    started = threading.Barrier(len(partitions), timeout=5)
+
+    def fetch(context: dict) -> t.Iterator[dict]:
+        # Каждая партиция ждёт остальных, последовательное чтение зависло бы
+        started.wait()
+        for i in range(3):
+            yield {"group_id": context["group_id"], "i": i}
+
+    prefetcher = PartitionPrefetcher(fetch, partitions, concurrency=4)
+    records = [
+        record
+        for context in partitions
+        for record in prefetcher.records(context)
+    ]
+    assert [(record["group_id"], record["i"]) for record in records] == [
+        (group_id, i) for group_id in range(1, 5) for i in range(3)
+    ]
+
+
+def test_prefetcher_raises_fetch_errors():
+    """An error while fetching a partition is raised when it is consumed."""
+    partitions = [{"group_id": 1}, {"group_id": 2}]
+
+    def fetch(context: dict) -> t.Iterator[dict]:
+        if context["group_id"] == 2:
+            msg = "fetch failed"
+            raise RuntimeError(msg)
+        yield {"group_id": 1}
+
+    prefetcher = PartitionPrefetcher(fetch, partitions, concurrency=2)
+    assert list(prefetcher.records(partitions[0])) == [{"group_id": 1}]
+    with pytest.raises(RuntimeError, match="fetch failed"):
+        list(prefetcher.records(partitions[1]))
+
+
+def test_chunked_is_lazy():
+    """Chunks are built as the items arrive, the last one may be shorter."""
+    read = []
+
+    def items() -> t.Iterator[int]:
+        for item in range(7):
+            read.append(item)
+            yield item
+
+    chunks = chunked(items(), 3)
+    assert next(chunks) == [0, 1, 2]
+    assert read == [0, 1, 2]
+    assert list(chunks) == [[3, 4, 5], [6]]
+
+
+def test_failed_execute_fails_every_call():
+    """An error of the ``execute`` request itself is the error of all its calls."""
+    client, _ = make_client(
+        lambda *_: {"error": {"error_code": 13, "error_msg": "Runtime error"}}
+    )
+    with client.batch() as batch:
+        vk = batch.get_api()
+        results = [vk.wall.getComments(owner_id=-1, post_id=i) for i in range(3)]
+    assert [result.error.code for result in results if result.error] == [13] * 3
+    client.close()
+
+
+def test_batch_result_before_execute():
+    """Reading a result of a batch that has not been sent is an error."""
+    client = VkClient("test-token")
+    result = client.batch().method("wall.get", {"owner_id": -1})
+    with pytest.raises(RuntimeError, match="has not been executed"):
+        _ = result.result
+    client.close()
+
+
+def test_cached_responses_are_not_requested_again(tmp_path):
+    """Methods with a TTL are answered from the cache on repeated calls."""
+    cache = ResponseCache(tmp_path / "responses.sqlite", {"groups.getById": 60})
+    client, transport = make_client(
+        lambda *_: {"response": [{"id": 1, "name": "Group"}]}, cache
+    )
+    for _ in range(2):
+        assert client.method("groups.getById", {"group_ids": "1"})[0]["id"] == 1
+    client.method("groups.getById", {"group_ids": "2"})
+    assert transport.calls == ["groups.getById"] * 2
+    cache.close()
+    client.close()
+
+
+def test_metrics_count_requests_retries_and_batched_calls():
+    """Every request, retry and call inside ``execute`` is counted per method."""
+    client, _ = make_client(throttle_first(1))
+    client.method("wall.get", {"owner_id": -1})
+    stats = client.metrics.methods["wall.get"]
+    assert (stats.requests, stats.retries) == (2, 1)
+    assert stats.errors == {TOO_MANY_RPS_CODE: 1}
+    client.close()
+
+    client, _ = make_client(answer_comments)
+    with client.batch() as batch:
+        vk = batch.get_api()
+        for post_id in (1, 2, 999):
+            vk.wall.getComments(owner_id=-1, post_id=post_id)
+    assert client.metrics.methods["execute"].requests == 1
+    assert client.metrics.methods["wall.getComments"].batched == 3
+    assert client.metrics.methods["wall.getComments"].errors == {100: 1}
+    assert 'tap_vk_api_batched_calls_total{method="wall.getComments"} 3' in (
+        client.metrics.render_prometheus()
+    )
+    client.close()
+
+
+def make_tap(standin: VkStandIn, tmp_path: Path) -> TapVk:
+    """Return a tap of community 1 served by ``standin``."""
+    return TapVk(
+        config={
+            "token": "test-token",
+            "group_ids": [1],
+            "api_url": standin.url,
+            "requests_per_second": 1e6,
+            "cache_dir": str(tmp_path),
+        },
+        parse_env_config=False,
+    )
+
+
+def test_missing_communities_are_a_config_error(tmp_path):
+    """Without group_ids or group_id a stream fails with a clear message."""
+    tap = TapVk(
+        config={"token": "test-token", "cache_dir": str(tmp_path)},
+        parse_env_config=False,
+    )
+    with pytest.raises(ConfigValidationError, match="group_ids"):
+        tap.streams["group_posts"].get_group_id(None)
+
+
+def test_fetch_reach_splits_failing_batches(tmp_path):
+    """A missing post only loses its own reach, not that of its batch."""
+    with VkStandIn(SyntheticVk(posts=60, missing_posts=[7])) as standin:
+        tap = make_tap(standin, tmp_path)
+        reach = tap.streams["group_posts"].fetch_reach(-1, list(range(1, 61)))
+        tap.client.close()
+    assert sorted(reach) == [post_id for post_id in range(1, 61) if post_id != 7]
+    assert reach[8]["reach_total"] == 8 * 15
+    # Две пачки по 30, затем деление пополам только пачки с постом 7
+    assert standin.calls["stats.getPostReach"] == 2 + 2 * 5
+
+
+def test_fetch_stories_splits_failing_requests(tmp_path, capsys):
+    """A story VK refuses is logged and skipped, the others are read."""
+    with VkStandIn(SyntheticVk(missing_stories=[7])) as standin:
+        tap = make_tap(standin, tmp_path)
+        stories = tap.streams["story_history"].fetch_stories(-1, list(range(1, 21)))
+        tap.client.close()
+    assert [story["id"] for story in stories] == [i for i in range(1, 21) if i != 7]
+    # 20 -> 10 -> 5 -> 2 -> 1: по два запроса на каждое деление
+    assert standin.calls["stories.getById"] == 1 + 2 * 4
+    assert "Skipping stories -1_7..-1_7" in capsys.readouterr().err
+
+
+def test_deselected_enrichments_are_not_requested(tmp_path):
+    """No reach is requested when none of the reach properties are selected."""
+    with VkStandIn(SyntheticVk(posts=40)) as standin:
+        tap = make_tap(standin, tmp_path)
+        stream = tap.streams["group_posts"]
+        for name in POST_REACH_FIELDS:
+            stream.metadata["properties", name].selected = False
+        records = list(stream.get_records({"group_id": 1}))
+        tap.client.close()
+    assert len(records) == 40
+    assert standin.calls["stats.getPostReach"] == 0
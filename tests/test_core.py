@@ -1,14 +1,26 @@
 """Tests standard tap features using the built-in SDK tests library."""
 
 import datetime
+import tempfile
 
 from singer_sdk.testing import get_tap_test_class
 
+from tap_vk.standin import SyntheticVk, VkStandIn
 from tap_vk.tap import TapVk
 
+# Локальная заглушка VK API, тесты не ходят в сеть и не требуют токена
+STANDIN = VkStandIn(SyntheticVk(posts=30, comments=2, replies=2, stories=5)).start()
+
 SAMPLE_CONFIG = {
-    "start_date": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d"),
-    # TODO: Initialize minimal tap config
+    "token": "test-token",
+    "group_ids": [1, 2],
+    "api_url": STANDIN.url,
+    "requests_per_second": 1000,
+    # Кэши и файлы батчей пишутся во временный каталог, а не в репозиторий
+    "cache_dir": tempfile.mkdtemp(prefix="tap-vk-test-"),
+    "start_date": (
+        datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=3)
+    ).strftime("%Y-%m-%d"),
 }
 
 
@@ -17,6 +29,3 @@ TestTapVk = get_tap_test_class(
     tap_class=TapVk,
     config=SAMPLE_CONFIG,
 )
-
-
-# TODO: Create additional tests as appropriate for your tap.
@@ -0,0 +1,208 @@
+"""Incremental syncs of several communities against the local VK stand-in."""
+
+from __future__ import annotations
+
+import contextlib
+import datetime
+import io
+import json
+import time
+import typing as t
+
+import pytest
+from singer_sdk._singerlib import StateMessage
+from vk_api.exceptions import ApiError
+
+from tap_vk.standin import SyntheticVk, VkStandIn
+from tap_vk.tap import TapVk
+
+if t.TYPE_CHECKING:
+    from pathlib import Path
+
+GROUP_IDS = [1, 2, 3]
+
+
+@pytest.fixture
+def standin():
+    """Serve 300 hourly posts per community, the newest two hours old."""
+    now = int(time.time()) - 2 * 60 * 60
+    data = SyntheticVk(posts=300, comments=1, replies=0, cities=2, now=now)
+    with VkStandIn(data) as server:
+        yield server
+
+
+def sync(
+        standin: VkStandIn,
+        stream: str,
+        config: dict,
+        state: dict | None = None,
+) -> tuple[list[dict], dict]:
+    """Sync one stream and return its messages and the last STATE value."""
+    tap = TapVk(
+        config={
+            "token": "test-token",
+            "group_ids": GROUP_IDS,
+            "api_url": standin.url,
+            "requests_per_second": 1e6,
+            **config,
+        },
+        state=state,
+        parse_env_config=False,
+    )
+    for name, tap_stream in tap.streams.items():
+        tap_stream.selected = name == stream
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        tap.sync_all()
+        tap.teardown()
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    states = [message["value"] for message in messages if message["type"] == "STATE"]
+    return messages, states[-1]
+
+
+def days_ago(days: int) -> str:
+    """Return the ``start_date`` of ``days`` days ago."""
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    return start.strftime("%Y-%m-%dT00:00:00Z")
+
+
+def group_calls(standin: VkStandIn, method: str) -> dict[int, int]:
+    """Return the number of ``method`` calls per community."""
+    return {group_id: standin.group_calls[method, group_id] for group_id in GROUP_IDS}
+
+
+@pytest.mark.parametrize("group_concurrency", [1, 4])
+def test_group_posts_bookmark_of_every_group(standin, tmp_path, group_concurrency):
+    """Each community reads only its first wall page once it has a bookmark."""
+    config = {
+        "cache_dir": str(tmp_path),
+        "start_date": days_ago(30),
+        "refresh_window_days": 0,
+        "group_concurrency": group_concurrency,
+    }
+    _, state = sync(standin, "group_posts", config)
+    assert group_calls(standin, "wall.get") == dict.fromkeys(GROUP_IDS, 3)
+
+    standin.group_calls.clear()
+    messages, _ = sync(standin, "group_posts", config, state)
+    assert group_calls(standin, "wall.get") == dict.fromkeys(GROUP_IDS, 1)
+    # Заново выгружается только последний пост каждого сообщества
+    assert sum(message["type"] == "RECORD" for message in messages) == len(GROUP_IDS)
+
+
+@pytest.mark.parametrize("group_concurrency", [1, 4])
+def test_group_stat_bookmark_of_every_group(standin, tmp_path, group_concurrency):
+    """Each community requests a single stats window once it has a bookmark."""
+    config = {
+        "cache_dir": str(tmp_path),
+        "start_date": days_ago(120),
+        "stats_window_days": 30,
+        "group_concurrency": group_concurrency,
+    }
+    _, state = sync(standin, "groupStat", config)
+    assert min(group_calls(standin, "stats.get").values()) > 1
+
+    standin.group_calls.clear()
+    sync(standin, "groupStat", config, state)
+    assert group_calls(standin, "stats.get") == dict.fromkeys(GROUP_IDS, 1)
+
+
+def comment_records(messages: list[dict]) -> list[dict]:
+    """Return the ``group_posts_comments`` records of a run."""
+    return [
+        message["record"]
+        for message in messages
+        if message["type"] == "RECORD" and message["stream"] == "group_posts_comments"
+    ]
+
+
+def comments_config(tmp_path: Path) -> dict:
+    """Return the config of a comments sync over the last 30 days."""
+    return {"cache_dir": str(tmp_path), "start_date": days_ago(30)}
+
+
+def test_closed_comments_are_skipped(tmp_path):
+    """Posts with closed comments are skipped, the other posts are read."""
+    data = SyntheticVk(posts=5, comments=2, replies=0, comment_errors={3: 212})
+    with VkStandIn(data) as server:
+        messages, _ = sync(server, "group_posts_comments", comments_config(tmp_path))
+    assert {record["post_id"] for record in comment_records(messages)} == {1, 2, 4, 5}
+
+
+def test_comments_api_error_is_raised(tmp_path):
+    """Errors other than unavailable comments fail the sync."""
+    data = SyntheticVk(posts=5, comments=2, replies=0, comment_errors={3: 100})
+    with VkStandIn(data) as server, pytest.raises(ApiError):
+        sync(server, "group_posts_comments", comments_config(tmp_path))
+
+
+def test_first_comment_pages_are_batched(tmp_path):
+    """Comments that fit on one page come from ``execute`` batches."""
+    data = SyntheticVk(posts=40, comments=2, replies=1)
+    with VkStandIn(data) as server:
+        messages, _ = sync(server, "group_posts_comments", comments_config(tmp_path))
+    assert len(comment_records(messages)) == len(GROUP_IDS) * 40 * 2 * 2
+    # Страница каждого поста запрошена один раз и только внутри execute
+    assert server.calls["wall.getComments"] == len(GROUP_IDS) * 40
+    assert server.requests == server.calls["wall.get"] + server.calls["execute"]
+
+
+def test_unfinished_thread_is_read_again(tmp_path):
+    """A post whose replies became unavailable part-way is read again next run."""
+    # Ответов больше thread_items_count, поэтому ветка читается отдельными запросами
+    data = SyntheticVk(posts=5, comments=2, replies=12, thread_errors={30000: 15})
+    config = comments_config(tmp_path)
+    with VkStandIn(data) as server:
+        messages, state = sync(server, "group_posts_comments", config)
+        records = comment_records(messages)
+        assert {record["post_id"] for record in records} == {1, 2, 3, 4, 5}
+        assert 30000 + 1 not in {record["comment_id"] for record in records}
+
+        messages, _ = sync(server, "group_posts_comments", config, state)
+    assert {record["post_id"] for record in comment_records(messages)} == {3}
+
+
+def test_thread_api_error_is_raised(tmp_path):
+    """Errors other than unavailable comments in a thread fail the sync."""
+    data = SyntheticVk(posts=5, comments=2, replies=12, thread_errors={30000: 100})
+    with VkStandIn(data) as server, pytest.raises(ApiError):
+        sync(server, "group_posts_comments", comments_config(tmp_path))
+
+
+def test_unchanged_posts_are_skipped(standin, tmp_path):
+    """With ``skip_unchanged_records`` posts with unchanged metrics are skipped."""
+    config = {
+        "cache_dir": str(tmp_path),
+        "start_date": days_ago(30),
+        "skip_unchanged_records": True,
+    }
+    messages, state = sync(standin, "group_posts", config)
+    assert sum(message["type"] == "RECORD" for message in messages) == 900
+
+    messages, _ = sync(standin, "group_posts", config, state)
+    assert sum(message["type"] == "RECORD" for message in messages) == 0
+
+
+def test_fingerprints_are_saved_after_state(standin, tmp_path):
+    """Fingerprints of a partition are written only once a STATE covers it."""
+    tap = TapVk(
+        config={
+            "token": "test-token",
+            "group_ids": [1],
+            "api_url": standin.url,
+            "requests_per_second": 1e6,
+            "cache_dir": str(tmp_path),
+            "start_date": days_ago(30),
+            "skip_unchanged_records": True,
+        },
+        parse_env_config=False,
+    )
+    stream = tap.streams["group_posts"]
+    assert len(list(stream.get_records({"group_id": 1}))) == 300
+    path = tmp_path / "fingerprints_group_posts_1.json"
+    assert not path.exists()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        tap.write_message(StateMessage(value=tap.state))
+    assert path.exists()
+    tap.teardown(completed=False)
@@ -0,0 +1,63 @@
+"""Buffered Singer message writer."""
+
+from __future__ import annotations
+
+import datetime
+import decimal
+import io
+import json
+import sys
+
+from singer_sdk._singerlib import RecordMessage, SchemaMessage, StateMessage
+from singer_sdk._singerlib.json import serialize_json
+
+from tap_vk.output import MessageWriter
+
+
+def test_record_lines_match_the_sdk():
+    """RECORD lines parse to the same message the SDK would write."""
+    message = RecordMessage(
+        stream="group_posts",
+        record={
+            "id": 1,
+            "text": 'Пост "1"\n',
+            "reach": decimal.Decimal("1.5"),
+            "tags": None,
+        },
+        time_extracted=datetime.datetime(2024, 5, 1, 12, tzinfo=datetime.timezone.utc),
+    )
+    line = MessageWriter().serialize(message)
+    assert line.endswith(b"}\n")
+    assert json.loads(line) == json.loads(serialize_json(message.to_dict()))
+
+
+def test_buffer_is_written_on_state_and_flush(monkeypatch):
+    """Records stay buffered until a STATE message, a full buffer or a flush."""
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", stdout)
+    writer = MessageWriter()
+    writer.write(SchemaMessage(stream="s", schema={}, key_properties=[]))
+    writer.write(RecordMessage(stream="s", record={"id": 1}))
+    assert stdout.getvalue() == ""
+
+    writer.write(StateMessage(value={"bookmarks": {}}))
+    types = [json.loads(line)["type"] for line in stdout.getvalue().splitlines()]
+    assert types == ["SCHEMA", "RECORD", "STATE"]
+
+    writer.write(RecordMessage(stream="s", record={"id": 2}))
+    writer.flush()
+    assert json.loads(stdout.getvalue().splitlines()[-1])["record"] == {"id": 2}
+
+
+def test_full_buffer_is_written(monkeypatch):
+    """The buffer is written out once it grows over ``buffer_size``."""
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", stdout)
+    writer = MessageWriter(buffer_size=100)
+    for i in range(10):
+        writer.write(RecordMessage(stream="s", record={"id": i}))
+    written = stdout.getvalue().splitlines()
+    assert 0 < len(written) < 10
+    writer.flush()
+    lines = stdout.getvalue().splitlines()
+    assert [json.loads(line)["record"]["id"] for line in lines] == list(range(10))
@@ -0,0 +1,117 @@
+"""Threaded fetch/transform/emit pipeline."""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import threading
+import typing as t
+
+import pytest
+
+from tap_vk import client
+from tap_vk.pipeline import CHUNK_SIZE, Pipeline
+from tap_vk.standin import SyntheticVk, VkStandIn
+from tap_vk.tap import TapVk
+
+
+def double(items):
+    """Yield every item twice as large."""
+    for item in items:
+        yield item * 2
+
+
+def test_items_keep_their_order():
+    """Items pass all stages in order and are counted per stage."""
+    def increment(items: t.Iterable[int]) -> t.Iterator[int]:
+        return (item + 1 for item in items)
+
+    stages = [("double", double), ("increment", increment)]
+    pipeline = Pipeline("test", range(1000), stages)
+    assert list(pipeline) == [i * 2 + 1 for i in range(1000)]
+    names = [stage.name for stage in pipeline.stats]
+    assert names == ["fetch", "double", "increment", "emit"]
+    assert [stage.items for stage in pipeline.stats] == [1000] * 4
+
+
+def test_stage_error_reaches_the_caller():
+    """An exception in a stage is raised where the pipeline is iterated."""
+    def fail(items: t.Iterable[int]) -> t.Iterator[int]:
+        for item in items:
+            if item == 150:
+                msg = "broken item"
+                raise ValueError(msg)
+            yield item
+
+    with pytest.raises(ValueError, match="broken item"):
+        list(Pipeline("test", range(1000), [("fail", fail)]))
+
+
+def test_source_error_reaches_the_caller():
+    """An exception while fetching is raised where the pipeline is iterated."""
+    def source() -> t.Iterator[int]:
+        yield 1
+        msg = "fetch failed"
+        raise RuntimeError(msg)
+
+    with pytest.raises(RuntimeError, match="fetch failed"):
+        list(Pipeline("test", source()))
+
+
+def test_early_stop_closes_the_source():
+    """Leaving the loop stops the stages and closes the source generator."""
+    closed = threading.Event()
+
+    def source() -> t.Iterator[int]:
+        try:
+            yield from range(10**9)
+        finally:
+            closed.set()
+
+    pipeline = Pipeline("test", source(), queue_size=CHUNK_SIZE)
+    for item in pipeline:
+        if item == 10:
+            break
+    assert closed.wait(5)
+
+
+def test_stats_are_shared_between_pipelines():
+    """Consecutive pipelines of a stream add to the same counters."""
+    stats = Pipeline.new_stats(["fetch", "double"])
+    for _ in range(2):
+        list(Pipeline("test", range(10), [("double", double)], stats=stats))
+    assert [stage.items for stage in stats] == [20, 20, 20]
+
+
+def test_child_contexts_run_inline(monkeypatch, tmp_path):
+    """Comments of a post are read without a pipeline of their own."""
+    created = []
+
+    class CountingPipeline(Pipeline):
+        """Pipeline remembering the streams it was created for."""
+
+        def __init__(self, name: str, *args: t.Any, **kwargs: t.Any) -> None:
+            created.append(name)
+            super().__init__(name, *args, **kwargs)
+
+    monkeypatch.setattr(client, "Pipeline", CountingPipeline)
+    data = SyntheticVk(posts=20, comments=2, replies=1)
+    with VkStandIn(data) as standin:
+        tap = TapVk(
+            config={
+                "token": "test-token",
+                "group_ids": [1, 2],
+                "api_url": standin.url,
+                "requests_per_second": 1e6,
+                "cache_dir": str(tmp_path),
+            },
+            parse_env_config=False,
+        )
+        for name, stream in tap.streams.items():
+            stream.selected = name == "group_posts_comments"
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            tap.sync_all()
+            tap.teardown()
+    records = [line for line in output.getvalue().splitlines() if '"RECORD"' in line]
+    assert len(records) == 2 * 20 * 2 * 2
+    assert created == ["group_posts", "group_posts"]
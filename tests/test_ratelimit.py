@@ -0,0 +1,99 @@
+"""Token buckets and the per-token, per-method rate limiter."""
+
+from __future__ import annotations
+
+import pytest
+
+from tap_vk.ratelimit import (
+    FLOOD_CONTROL_CODE,
+    TOO_MANY_RPS_CODE,
+    RateLimiter,
+    TokenBucket,
+)
+
+
+class FakeClock:
+    """Monotonic clock that only moves when somebody sleeps."""
+
+    def __init__(self) -> None:
+        """Start at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Return the current time."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Move the clock forward."""
+        self.now += seconds
+
+
+def test_bucket_allows_burst_then_paces():
+    """A full bucket lets ``capacity`` calls through, then paces them."""
+    clock = FakeClock()
+    bucket = TokenBucket(2.0, clock=clock, sleep=clock.sleep)
+    assert [bucket.acquire() for _ in range(4)] == [0.0, 0.0, 0.5, 0.5]
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_bucket_refills_while_idle():
+    """Tokens come back over time, but not beyond the capacity."""
+    clock = FakeClock()
+    bucket = TokenBucket(2.0, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 10
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.5]
+
+
+def test_bucket_slow_down_and_speed_up():
+    """The rate halves down to ``min_rate`` and recovers up to the initial rate."""
+    clock = FakeClock()
+    bucket = TokenBucket(16.0, clock=clock, sleep=clock.sleep)
+    bucket.slow_down()
+    assert bucket.rate == 8.0
+    # Накопленный запас сбрасывается, следующий вызов уже ждёт
+    assert bucket.tokens <= 0
+    for _ in range(10):
+        bucket.slow_down()
+    assert bucket.rate == bucket.min_rate == 1.0
+    for _ in range(100):
+        bucket.speed_up(4.0)
+    assert bucket.rate == 16.0
+
+
+def test_limiter_buckets_per_token_and_family():
+    """Every access token and method family gets its own buckets."""
+    limiter = RateLimiter({"user": 3.0}, family_rates={"stats": 1.0})
+    assert limiter.bucket("user", token="a") is not limiter.bucket("user", token="b")
+    assert limiter.bucket("user", "wall", "a").rate == 3.0
+    assert limiter.bucket("user", "stats", "a").rate == 1.0
+    assert limiter.bucket("community", token="a").rate == 20.0
+
+
+def test_limiter_slows_the_bucket_of_the_error():
+    """Error 6 slows the token bucket, errors 9 and 29 the method family."""
+    limiter = RateLimiter({"user": 4.0})
+    token_bucket = limiter.bucket("user", token="a")
+    wall_bucket = limiter.bucket("user", "wall", "a")
+
+    limiter.on_error("user", "wall.get", FLOOD_CONTROL_CODE, "a")
+    assert (token_bucket.rate, wall_bucket.rate) == (4.0, 2.0)
+
+    limiter.on_error("user", "wall.get", TOO_MANY_RPS_CODE, "a")
+    assert (token_bucket.rate, wall_bucket.rate) == (2.0, 2.0)
+    assert limiter.bucket("user", token="b").rate == 4.0
+
+
+def test_limiter_recovers_after_successes():
+    """A slowed bucket speeds up again after ``recovery_after`` successes in a row."""
+    limiter = RateLimiter({"user": 10.0}, recovery_after=3)
+    limiter.on_error("user", "wall.get", FLOOD_CONTROL_CODE, "a")
+    bucket = limiter.bucket("user", "wall", "a")
+    assert bucket.rate == 5.0
+
+    for _ in range(2):
+        limiter.on_success("user", "wall.get", "a")
+    assert bucket.rate == 5.0
+    limiter.on_success("user", "wall.get", "a")
+    assert bucket.rate == 6.0
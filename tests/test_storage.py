@@ -0,0 +1,171 @@
+"""On-disk state kept by the tap between runs and the SQLite caches."""
+
+from __future__ import annotations
+
+from tap_vk.storage import (
+    FingerprintStore,
+    ProfileCache,
+    ResponseCache,
+    StoryIdCache,
+)
+
+FIELDS = ("views",)
+
+
+class FakeClock:
+    """Wall clock set by the test."""
+
+    def __init__(self) -> None:
+        """Start at a fixed time."""
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        """Return the current time."""
+        return self.now
+
+
+def test_fingerprints_detect_changed_rows(tmp_path):
+    """Only new and changed rows count as changed on the next run."""
+    path = tmp_path / "fingerprints.json"
+    store = FingerprintStore(path)
+    assert store.changed("1", {"id": 1, "views": 10}, FIELDS)
+    assert store.changed("2", {"id": 2, "views": 20}, FIELDS)
+    store.save()
+
+    store = FingerprintStore(path)
+    assert not store.changed("1", {"id": 1, "views": 10}, FIELDS)
+    assert store.changed("2", {"id": 2, "views": 21}, FIELDS)
+    assert store.changed("3", {"id": 3, "views": 30}, FIELDS)
+
+
+def test_fingerprints_ignore_other_fields(tmp_path):
+    """Only the metric fields are compared."""
+    store = FingerprintStore(tmp_path / "fingerprints.json")
+    store.changed("1", {"id": 1, "views": 10, "text": "a"}, FIELDS)
+    store.save()
+    assert not store.changed("1", {"id": 1, "views": 10, "text": "b"}, FIELDS)
+
+
+def test_fingerprints_of_unread_rows_are_dropped(tmp_path):
+    """Rows not read during a run are forgotten when it is saved."""
+    path = tmp_path / "fingerprints.json"
+    store = FingerprintStore(path)
+    store.changed("1", {"id": 1}, FIELDS)
+    store.changed("2", {"id": 2}, FIELDS)
+    store.save()
+
+    store = FingerprintStore(path)
+    store.changed("2", {"id": 2}, FIELDS)
+    store.save()
+    assert set(FingerprintStore(path).rows) == {"2"}
+
+
+def test_full_refresh_is_due_after_days(tmp_path):
+    """The refresh period restarts when a full refresh is saved."""
+    store = FingerprintStore(tmp_path / "fingerprints.json")
+    assert store.full_refresh_due(7)
+    store.save(full_refresh=True)
+    assert not store.full_refresh_due(7)
+    assert store.full_refresh_due(7, now=store.full_refresh_at + 7 * 24 * 60 * 60)
+
+
+def test_story_index_survives_a_restart(tmp_path):
+    """Known stories and the high-water mark are read back from disk."""
+    index = StoryIdCache(tmp_path).get(1)
+    assert index.merge_from_db([(5, 100), (3, None)]) == 2
+    index.add(9, 300)
+    index.save()
+    index = StoryIdCache(tmp_path).get(1)
+    assert index.db_high_water == 5
+    assert index.ids() == [3, 5, 9]
+    assert index.ids(expires_since=200) == [9]
+
+
+def test_response_cache_expires_entries(tmp_path):
+    """Responses are served until their method's TTL is over."""
+    clock = FakeClock()
+    cache = ResponseCache(
+        tmp_path / "responses.sqlite", {"groups.getById": 60}, clock=clock
+    )
+    key = cache.make_key("groups.getById", {"group_ids": "1"})
+    cache.set(key, "groups.getById", [{"id": 1}])
+    assert cache.get(key) == [{"id": 1}]
+
+    clock.now += 61
+    assert cache.get(key) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_response_cache_skips_methods_without_ttl(tmp_path):
+    """Methods without a positive TTL are not stored."""
+    cache = ResponseCache(tmp_path / "responses.sqlite", {"wall.get": 0})
+    key = cache.make_key("wall.get", {"owner_id": -1})
+    cache.set(key, "wall.get", {"items": []})
+    assert cache.get(key) is None
+    cache.close()
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    """Over ``max_bytes`` the entries used longest ago are removed first."""
+    clock = FakeClock()
+    cache = ResponseCache(
+        tmp_path / "responses.sqlite", {"users.get": 3600}, max_bytes=250, clock=clock
+    )
+    keys = [cache.make_key("users.get", {"user_ids": str(i)}) for i in range(3)]
+    for key in keys[:2]:
+        cache.set(key, "users.get", ["x" * 100])
+        clock.now += 1
+    # Первый ответ прочитан последним и переживает вытеснение
+    cache.get(keys[0])
+    clock.now += 1
+    cache.set(keys[2], "users.get", ["x" * 100])
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+    cache.close()
+
+
+def test_response_cache_key():
+    """Keys ignore the access token but separate scopes and parameters."""
+    key = ResponseCache.make_key("users.get", {"user_ids": "1", "access_token": "a"})
+    same = ResponseCache.make_key("users.get", {"access_token": "b", "user_ids": "1"})
+    assert key == same
+    assert key != ResponseCache.make_key("users.get", {"user_ids": "1"}, scope="other")
+    assert key != ResponseCache.make_key("users.get", {"user_ids": "2"})
+
+
+def test_profile_cache_serves_fresh_profiles_across_runs(tmp_path):
+    """Profiles are read back by a new process until their TTL is over."""
+    clock = FakeClock()
+    path = tmp_path / "profiles.sqlite"
+    cache = ProfileCache(path, ttl=60, clock=clock)
+    cache.put_many({1: {"id": 1, "first_name": "A"}, -2: {"id": -2, "name": "B"}})
+    cache.close()
+
+    cache = ProfileCache(path, ttl=60, clock=clock)
+    assert cache.get_many([1, -2, 3]) == {
+        1: {"id": 1, "first_name": "A"},
+        -2: {"id": -2, "name": "B"},
+    }
+    clock.now += 61
+    assert cache.get_many([1, -2]) == {}
+    cache.close()
+
+
+def test_profile_cache_misses_profiles_without_the_selected_fields(tmp_path):
+    """A profile resolved without a field does not serve a run that needs it."""
+    path = tmp_path / "profiles.sqlite"
+    cache = ProfileCache(path, ttl=60, clock=FakeClock())
+    cache.put_many({1: {"id": 1, "screen_name": None}})
+    cache.put_many({2: {"id": 2, "screen_name": "b"}}, ["screen_name", "photo_100"])
+    assert sorted(cache.get_many([1, 2])) == [1, 2]
+    assert sorted(cache.get_many([1, 2], ["screen_name"])) == [2]
+    cache.close()
+
+    # То же после перезапуска, когда записи читаются из SQLite
+    cache = ProfileCache(path, ttl=60, clock=FakeClock())
+    assert sorted(cache.get_many([1, 2], ["screen_name"])) == [2]
+    assert sorted(cache.get_many([1, 2], [""])) == [1, 2]
+    cache.close()
@@ -0,0 +1,141 @@
+"""Token pool dispatching, quarantine and daily quotas."""
+
+from __future__ import annotations
+
+import typing as t
+
+import pytest
+
+from tap_vk.ratelimit import FLOOD_CONTROL_CODE, RATE_LIMIT_CODE
+from tap_vk.tokens import (
+    AUTH_FAILED_CODE,
+    NoTokenAvailableError,
+    PooledToken,
+    TokenPool,
+)
+
+if t.TYPE_CHECKING:
+    from pathlib import Path
+
+DAY = 24 * 60 * 60
+
+
+class FakeClock:
+    """Wall clock set by the test."""
+
+    def __init__(self, now: float = 1_700_000_000.0) -> None:
+        """Start at ``now``."""
+        self.now = now
+
+    def __call__(self) -> float:
+        """Return the current time."""
+        return self.now
+
+
+def make_pool(
+        *tokens: PooledToken,
+        clock: FakeClock | None = None,
+        usage_path: Path | None = None,
+) -> TokenPool:
+    """Return a pool of ``tokens`` driven by ``clock``."""
+    return TokenPool(list(tokens), clock=clock or FakeClock(), usage_path=usage_path)
+
+
+def test_empty_pool_is_rejected():
+    """A pool needs at least one token."""
+    with pytest.raises(ValueError, match="At least one"):
+        TokenPool([])
+
+
+def test_least_loaded_token_is_used():
+    """Calls in flight are spread over the tokens."""
+    a, b = PooledToken("a", name="a"), PooledToken("b", name="b")
+    pool = make_pool(a, b)
+    assert {pool.acquire(), pool.acquire()} == {a, b}
+    pool.release(a)
+    assert pool.acquire() is a
+
+
+def test_tokens_are_restricted_to_their_communities():
+    """A token is only used for the communities it is allowed for."""
+    a = PooledToken("a", group_ids=[1], name="a")
+    b = PooledToken("b", group_ids=[2], name="b")
+    pool = make_pool(a, b)
+    assert pool.acquire({"owner_id": -2}) is b
+    assert pool.acquire({"group_id": 1}) is a
+    assert pool.acquire({"stories": "-1_10,-1_11"}) is a
+    with pytest.raises(NoTokenAvailableError):
+        pool.acquire({"group_ids": "1,2"})
+
+
+def test_rate_limited_token_is_quarantined():
+    """A throttled token leaves the rotation until its quarantine is over."""
+    clock = FakeClock()
+    a, b = PooledToken("a", name="a"), PooledToken("b", name="b")
+    pool = make_pool(a, b, clock=clock)
+    token = pool.acquire()
+    assert pool.release(token, RATE_LIMIT_CODE) is True
+    other = b if token is a else a
+    assert [pool.acquire() for _ in range(3)] == [other] * 3
+
+    clock.now += 60 * 60
+    for _ in range(3):
+        pool.release(other)
+    assert pool.acquire() is token
+
+
+def test_switch_needs_a_ready_token_allowed_for_the_call():
+    """Tokens of other communities or out of quota are no reason to switch."""
+    a = PooledToken("a", group_ids=[1], name="a")
+    b = PooledToken("b", group_ids=[2], name="b")
+    c = PooledToken("c", daily_quota=1, name="c")
+    pool = make_pool(a, b, c)
+    values = {"owner_id": -1}
+    assert pool.acquire(values) is a
+    assert pool.acquire(values) is c
+    assert pool.release(c, FLOOD_CONTROL_CODE, values) is True
+    assert pool.release(a, FLOOD_CONTROL_CODE, values) is False
+    assert pool.release(pool.acquire(values), FLOOD_CONTROL_CODE) is True
+
+
+def test_single_quarantined_token_is_still_used():
+    """Without another token the quarantined one is used, the client backs off."""
+    a = PooledToken("a", name="a")
+    pool = make_pool(a)
+    assert pool.release(pool.acquire(), FLOOD_CONTROL_CODE) is False
+    assert pool.acquire() is a
+
+
+def test_revoked_token_is_dropped_for_the_run():
+    """A token VK rejected is never used again."""
+    clock = FakeClock()
+    a, b = PooledToken("a", name="a"), PooledToken("b", name="b")
+    pool = make_pool(a, b, clock=clock)
+    pool.release(a, AUTH_FAILED_CODE)
+    clock.now += DAY
+    assert {pool.acquire() for _ in range(3)} == {b}
+
+    pool.release(b, AUTH_FAILED_CODE)
+    with pytest.raises(NoTokenAvailableError, match="out of its daily quota"):
+        pool.acquire()
+
+
+def test_daily_quota_is_kept_between_runs(tmp_path):
+    """Usage is saved per day and a token stops at its quota."""
+    clock = FakeClock()
+    path = tmp_path / "usage.json"
+    token = PooledToken("a", daily_quota=3, name="a")
+    pool = make_pool(token, clock=clock, usage_path=path)
+    for _ in range(2):
+        pool.release(pool.acquire())
+    pool.save_usage()
+
+    token = PooledToken("a", daily_quota=3, name="a")
+    pool = make_pool(token, clock=clock, usage_path=path)
+    pool.acquire()
+    with pytest.raises(NoTokenAvailableError):
+        pool.acquire()
+
+    # На следующий день счётчик начинается заново
+    clock.now += DAY
+    assert pool.acquire().used_today == 1
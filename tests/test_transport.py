@@ -0,0 +1,101 @@
+"""Record/replay transports and the local VK API stand-in."""
+
+from __future__ import annotations
+
+import pytest
+import requests
+from vk_api.exceptions import ApiError
+
+from tap_vk.client import VkClient
+from tap_vk.ratelimit import RateLimiter
+from tap_vk.standin import SyntheticVk, VkStandIn
+from tap_vk.transport import make_adapter
+
+
+@pytest.fixture
+def standin():
+    """Serve a small data set."""
+    with VkStandIn(SyntheticVk(posts=30, comments=2)) as server:
+        yield server
+
+
+def make_client(
+        api_url: str,
+        mode: str = "live",
+        fixtures_path: str | None = None,
+        token: str = "test-token",  # noqa: S107
+) -> VkClient:
+    """Return a client of ``api_url`` without rate limiting or backoff delays."""
+    return VkClient(
+        token,
+        api_url=api_url,
+        limiter=RateLimiter({"user": 1e6}),
+        backoff_factor=0,
+        max_retries=0,
+        transport=make_adapter(mode, fixtures_path),
+    )
+
+
+def test_recorded_calls_are_replayed(standin, tmp_path):
+    """A replayed run gets the recorded answers without reaching the server."""
+    fixtures = str(tmp_path / "fixtures.jsonl.gz")
+    url = standin.url
+    client = make_client(url, "record", fixtures)
+    group = client.method("groups.getById", {"group_ids": "1"})
+    posts = list(client.paginate("wall.get", {"owner_id": -1}))
+    client.close()
+    standin.stop()
+
+    # Токен не входит в ключ записи, ответы подходят и для другого токена
+    client = make_client(url, "replay", fixtures, token="other-token")
+    assert client.method("groups.getById", {"group_ids": "1"}) == group
+    assert list(client.paginate("wall.get", {"owner_id": -1})) == posts
+    client.close()
+
+
+def test_replay_falls_back_to_the_closest_recording(standin, tmp_path):
+    """Calls missing from the fixtures get a recording of the same method."""
+    fixtures = str(tmp_path / "fixtures.jsonl.gz")
+    client = make_client(standin.url, "record", fixtures)
+    values = {"group_id": 1, "timestamp_from": 0, "timestamp_to": 86399}
+    stats = client.method("stats.get", values)
+    client.close()
+
+    client = make_client(standin.url, "replay", fixtures)
+    shifted = {**values, "timestamp_from": 86400, "timestamp_to": 172799}
+    assert client.method("stats.get", shifted) == stats
+    assert standin.calls["stats.get"] == 1
+    with pytest.raises(requests.ConnectionError, match="No recorded response"):
+        client.method("wall.get", {"owner_id": -1})
+    client.close()
+
+
+def test_unknown_transport_is_rejected():
+    """Only the documented transport modes are accepted."""
+    with pytest.raises(ValueError, match="Unknown transport"):
+        make_adapter("cached")
+    with pytest.raises(ValueError, match="fixtures"):
+        make_adapter("replay")
+
+
+def test_standin_answers_execute_batches(standin):
+    """Every call of an ``execute`` gets its own result or error."""
+    client = make_client(standin.url)
+    with client.batch() as batch:
+        vk = batch.get_api()
+        found = vk.wall.getComments(owner_id=-1, post_id=1)
+        missing = vk.wall.getComments(owner_id=-1, post_id=999)
+    assert found.result["count"] == 2
+    assert missing.error.code == 100
+    assert standin.calls["execute"] == 1
+    client.close()
+
+
+def test_standin_injects_throttling_errors():
+    """With an error rate of 1 every call is throttled with the chosen code."""
+    with VkStandIn(error_rate=1.0, error_code=9) as server:
+        client = make_client(server.url)
+        with pytest.raises(ApiError) as error:
+            client.method("wall.get", {"owner_id": -1})
+        assert error.value.code == 9
+        client.close()